@@ -4,7 +4,7 @@ import json
 import cv2
 import numpy as np
 from PIL import Image, ImageTk
-from utils.layout_preview import LayoutPreviewGenerator
+from hivision.creator.layout_preview import LayoutPreviewGenerator
 
 class LayoutEditorDialog:
     def __init__(self, parent, callback=None, edit_style=None):
@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+r"""
+@DATE: 2026/10/17 21:30
+@File: batch.py
+@IDE: pycharm
+@Description:
+    命令行批量制作证件照：读取目录中的照片，生成指定尺寸的证件照、换背景并排版
+    尺寸和排版样式取自程序使用的 photo_sizes.json、paper_sizes.json 和 layout_styles.json
+
+    用法（在项目根目录运行）：
+    python -m hivision.batch 照片目录 输出目录 --size 一寸 --bg blue --layout 1寸9张
+    python -m hivision.batch 照片目录 输出目录 --size 二寸 --bg "#FFFFFF" --workers 4
+"""
+import argparse
+import contextlib
+import json
+import os
+import re
+import sys
+from multiprocessing import Pool, cpu_count
+from time import time
+
+import cv2
+import numpy as np
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+BACKGROUND_COLORS = {
+    "red": "#FF0000",
+    "blue": "#438EDB",
+    "white": "#FFFFFF",
+    "darkblue": "#00047B",
+    "gray": "#F0F0F0",
+    "红色": "#FF0000",
+    "蓝色": "#438EDB",
+    "白色": "#FFFFFF",
+    "深蓝": "#00047B",
+    "浅灰": "#F0F0F0",
+}
+"""
+背景颜色名与 RGB 颜色值，与程序换背景参数中的预设颜色一致
+"""
+
+_worker = {}
+"""
+工作进程内的状态：IDCreator 与处理参数，每个进程只初始化一次
+"""
+
+
+def load_json(config_dir: str, name: str) -> dict:
+    path = os.path.join(config_dir, name)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"找不到配置文件 {path}，请在项目根目录运行或使用 --config-dir 指定")
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def match_name(name: str, options: dict, kind: str) -> str:
+    """
+    按名称查找配置项，支持省略括号中的尺寸说明，如 "一寸" 匹配 "一寸 (25×35mm)"
+    """
+    if name in options:
+        return name
+    matches = [key for key in options if re.split(r"\s|\(|（", key, 1)[0] == name]
+    if len(matches) == 1:
+        return matches[0]
+    raise ValueError(f"未知的{kind}: {name}，可选: {', '.join(options)}")
+
+
+def parse_color(value: str):
+    """
+    颜色名或 #RRGGBB 转为 BGR 元组
+    """
+    hex_color = BACKGROUND_COLORS.get(value.lower(), BACKGROUND_COLORS.get(value, value))
+    if not re.fullmatch(r"#?[0-9a-fA-F]{6}", hex_color):
+        raise ValueError(f"未知的背景颜色: {value}，可选: {', '.join(BACKGROUND_COLORS)} 或 #RRGGBB")
+    hex_color = hex_color.lstrip("#")
+    r, g, b = (int(hex_color[i : i + 2], 16) for i in (0, 2, 4))
+    return b, g, r
+
+
+def safe_filename(name: str) -> str:
+    return re.sub(r'[\\/:*?"<>|()（）\s]+', "_", name).strip("_")
+
+
+def mm_to_pixels(size_mm, dpi: int):
+    """
+    证件照尺寸 (宽, 高) 毫米转为 IDCreator 使用的 (高, 宽) 像素
+    """
+    return int(size_mm[1] * dpi / 25.4), int(size_mm[0] * dpi / 25.4)
+
+
+def read_image(path: str) -> np.ndarray:
+    # 使用 imdecode 读取，避免中文路径问题；IMREAD_COLOR 会按 EXIF 方向旋转
+    image = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("无法读取图片")
+    return image
+
+
+def write_image(path: str, image: np.ndarray):
+    ext = os.path.splitext(path)[1]
+    params = [cv2.IMWRITE_JPEG_QUALITY, 95] if ext == ".jpg" else []
+    ok, buffer = cv2.imencode(ext, image, params)
+    if not ok:
+        raise ValueError(f"无法保存图片: {path}")
+    buffer.tofile(path)
+
+
+def build_options(args) -> dict:
+    """
+    解析命令行参数并读取配置文件，得到传给工作进程的处理参数
+    """
+    photo_sizes = load_json(args.config_dir, "photo_sizes.json")
+
+    layout = None
+    if args.layout:
+        styles = load_json(args.config_dir, "layout_styles.json")
+        paper_sizes = load_json(args.config_dir, "paper_sizes.json")
+        style = styles[match_name(args.layout, styles, "排版样式")]
+        photos = [
+            {
+                "size": photo_sizes[photo["photo_size"]],
+                "count": photo["count"],
+                "layout_type": photo["layout_type"],
+            }
+            for photo in style["photos"]
+            if photo["count"] > 0
+        ]
+        layout = {
+            "name": style.get("name", args.layout),
+            "paper_size": list(paper_sizes[style["paper_size"]]),
+            "orientation": style["orientation"],
+            "margins": style["margins"],
+            "photos": photos,
+            "spacing": style["spacing"],
+            "show_gridlines": style["show_gridlines"],
+            "show_divider": style["show_divider"],
+        }
+        if args.bg is None:
+            raise ValueError("排版需要使用 --bg 指定背景颜色")
+
+    if args.size:
+        size_name = match_name(args.size, photo_sizes, "证件照尺寸")
+    elif layout:
+        # 未指定尺寸时使用排版样式中第一种照片的尺寸
+        size_name = next(
+            name for name, size in photo_sizes.items() if size == layout["photos"][0]["size"]
+        )
+    else:
+        raise ValueError("请使用 --size 指定证件照尺寸")
+
+    return {
+        "size_name": size_name,
+        "size": mm_to_pixels(photo_sizes[size_name], args.dpi),
+        "bgr": parse_color(args.bg) if args.bg else None,
+        "layout": layout,
+        "dpi": args.dpi,
+        "out_dir": args.out_dir,
+        "save_transparent": args.save_transparent or args.bg is None,
+        "matting_model": args.matting_model,
+        "face_model": args.face_model,
+        "head_measure_ratio": args.head_measure_ratio,
+        "head_top_range": (args.head_top_range, 0.1),
+        "face_alignment": args.face_alignment,
+        "roi_matting": args.roi_matting,
+        "threads": args.threads,
+        "verbose": args.verbose,
+    }
+
+
+def init_worker(options: dict):
+    """
+    工作进程初始化：设置推理线程数，创建 IDCreator 并预热模型，之后该进程处理的所有照片共用这些模型
+    """
+    from hivision import IDCreator
+    from hivision.creator.choose_handler import choose_handler
+    from hivision.creator.onnx_session import set_session_profile
+    from hivision.creator.warmup import warmup
+
+    if options["threads"]:
+        set_session_profile(
+            intra_op_num_threads=options["threads"], inter_op_num_threads=1
+        )
+
+    creator = IDCreator()
+    # 检测不到人脸或有多张人脸的照片在抠图之前就跳过
+    creator.detect_first = True
+    creator.roi_matting = options["roi_matting"]
+    choose_handler(creator, options["matting_model"], options["face_model"])
+    with quiet(options):
+        warmup(options["matting_model"], options["face_model"])
+
+    _worker["creator"] = creator
+    _worker["options"] = options
+
+
+@contextlib.contextmanager
+def quiet(options: dict):
+    """
+    非 verbose 模式下屏蔽处理过程中的阶段耗时输出，避免打乱进度条
+    """
+    if options["verbose"]:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def process_file(path: str) -> dict:
+    """
+    处理单张照片，异常被记录在返回结果中，不影响其他照片
+    :return: {"file", "outputs", "error", "seconds"}
+    """
+    from hivision.utils import add_background
+
+    creator = _worker["creator"]
+    options = _worker["options"]
+    stem = os.path.splitext(os.path.basename(path))[0]
+    size_tag = safe_filename(options["size_name"])
+    start = time()
+    outputs = []
+    try:
+        image = read_image(path)
+        with quiet(options):
+            result = creator(
+                image,
+                size=options["size"],
+                head_measure_ratio=options["head_measure_ratio"],
+                head_top_range=options["head_top_range"],
+                face_alignment=options["face_alignment"],
+                # 只输出标准照，抠图尺寸够用即可
+                matting_resolution="auto",
+            )
+
+        if options["save_transparent"]:
+            outputs.append(os.path.join(options["out_dir"], f"{stem}_{size_tag}.png"))
+            write_image(outputs[-1], result.standard)
+
+        if options["bgr"] is not None:
+            colored = add_background(result.standard, bgr=options["bgr"]).astype(np.uint8)
+            outputs.append(os.path.join(options["out_dir"], f"{stem}_{size_tag}.jpg"))
+            write_image(outputs[-1], colored)
+
+            layout = options["layout"]
+            if layout:
+                from hivision.creator.layout_preview import LayoutPreviewGenerator
+
+                canvas = LayoutPreviewGenerator.generate_preview(
+                    paper_size=layout["paper_size"],
+                    orientation=layout["orientation"],
+                    margins=layout["margins"],
+                    photos=[dict(photo, image=colored) for photo in layout["photos"]],
+                    spacing=layout["spacing"],
+                    show_gridlines=layout["show_gridlines"],
+                    show_divider=layout["show_divider"],
+                    dpi=options["dpi"],
+                    images=True,
+                )
+                outputs.append(
+                    os.path.join(
+                        options["out_dir"], f"{stem}_{safe_filename(layout['name'])}.jpg"
+                    )
+                )
+                write_image(outputs[-1], canvas)
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+
+    return {
+        "file": path,
+        "outputs": outputs,
+        "error": error,
+        "seconds": round(time() - start, 3),
+    }
+
+
+def print_progress(done: int, total: int, failed: int, start: float):
+    width = 30
+    filled = int(width * done / total) if total else width
+    rate = done / max(time() - start, 1e-6)
+    sys.stderr.write(
+        f"\r[{'=' * filled}{' ' * (width - filled)}] {done}/{total}"
+        f"  失败 {failed}  {rate:.2f} 张/秒"
+    )
+    sys.stderr.flush()
+
+
+def list_images(in_dir: str):
+    return [
+        os.path.join(in_dir, name)
+        for name in sorted(os.listdir(in_dir))
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+
+
+def main():
+    default_workers = max(1, min(4, cpu_count() // 2))
+    parser = argparse.ArgumentParser(description="批量制作证件照")
+    parser.add_argument("in_dir", help="照片目录")
+    parser.add_argument("out_dir", help="输出目录")
+    parser.add_argument("--size", help="证件照尺寸，photo_sizes.json 中的名称，如 一寸")
+    parser.add_argument("--bg", help="背景颜色：red/blue/white/darkblue/gray、中文颜色名或 #RRGGBB")
+    parser.add_argument("--layout", help="排版样式，layout_styles.json 中的名称，如 1寸9张")
+    parser.add_argument("--save-transparent", action="store_true", help="同时保存透明底 PNG")
+    parser.add_argument("--dpi", type=int, default=300, help="输出 DPI")
+    parser.add_argument("--matting-model", default="hivision_modnet", help="抠图模型")
+    parser.add_argument("--face-model", default="mtcnn", help="人脸检测模型")
+    parser.add_argument("--head-measure-ratio", type=float, default=0.2, help="面部比例")
+    parser.add_argument("--head-top-range", type=float, default=0.12, help="头顶距离")
+    parser.add_argument("--face-alignment", action="store_true", help="人脸矫正")
+    parser.add_argument("--roi-matting", action="store_true", help="只对人脸周围的裁剪区域抠图")
+    parser.add_argument("--workers", type=int, default=default_workers, help="工作进程数")
+    parser.add_argument(
+        "--threads", type=int, default=0, help="每个进程的推理线程数，默认 CPU 核数 / 进程数"
+    )
+    parser.add_argument("--config-dir", default=".", help="配置文件所在目录")
+    parser.add_argument("--verbose", action="store_true", help="输出每个处理阶段的耗时")
+    args = parser.parse_args()
+
+    try:
+        options = build_options(args)
+    except (ValueError, FileNotFoundError) as e:
+        parser.error(str(e))
+    workers = max(1, args.workers)
+    if not options["threads"]:
+        options["threads"] = max(1, cpu_count() // workers)
+
+    files = list_images(args.in_dir)
+    if not files:
+        print(f"目录中没有可处理的图片: {args.in_dir}")
+        return
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    print(
+        f"{len(files)} 张照片，尺寸 {options['size_name']}，{workers} 个进程 x "
+        f"{options['threads']} 线程，模型 {args.matting_model} / {args.face_model}"
+    )
+    start = time()
+    results = []
+    failed = 0
+    print_progress(0, len(files), failed, start)
+    if workers == 1:
+        init_worker(options)
+        iterator = map(process_file, files)
+        pool = None
+    else:
+        pool = Pool(workers, initializer=init_worker, initargs=(options,))
+        iterator = pool.imap_unordered(process_file, files)
+    try:
+        for result in iterator:
+            results.append(result)
+            failed += result["error"] is not None
+            print_progress(len(results), len(files), failed, start)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    sys.stderr.write("\n")
+
+    results.sort(key=lambda r: r["file"])
+    report_path = os.path.join(args.out_dir, "batch_report.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    print(
+        f"完成 {len(files) - failed}/{len(files)}，耗时 {time() - start:.1f}s，报告: {report_path}"
+    )
+    for result in results:
+        if result["error"]:
+            print(f"  失败 {os.path.basename(result['file'])}: {result['error']}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
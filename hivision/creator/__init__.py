@@ -7,14 +7,17 @@ r"""
 @Description:
     创建证件照
 """
+import copy
+import hashlib
 import numpy as np
-from typing import Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
 import hivision.creator.utils as U
 from .context import Context, ContextHandler, Params, Result
-from .human_matting import extract_human
+from .human_matting import extract_human, handler_ref_size, BATCH_HANDLERS
 from .face_detector import detect_face_mtcnn
 from hivision.plugin.beauty.handler import beauty_face
-from .photo_adjuster import adjust_photo
+from .photo_adjuster import adjust_photo, matting_input_size, matting_roi
 import cv2
 import time
 
@@ -42,6 +45,36 @@ class IDCreator:
         """
         在所有处理之后，此时 ctx.result 被赋值
         """
+        self.before_stage: Callable[[str, Context], None] = None
+        """
+        在每个处理阶段开始之前，参数为阶段名（matting、beauty、detection、alignment、adjust）和上下文，
+        可用于显示进度；回调中抛出的异常会中止本次处理
+        """
+        self.incremental: bool = False
+        """
+        增量模式：记住上一次各处理阶段的输入指纹和结果，再次处理同一张图像时只重新执行输入发生变化的阶段。
+        只修改 size、head_measure_ratio、head_top_range 时只重新执行图像调整，只修改美颜参数时不重新检测人脸；
+        被跳过的阶段不会调用 before_stage、after_matting、after_detect 回调
+        """
+        self._memo: dict = {}
+        self.parallel: bool = False
+        """
+        并行模式：人脸检测只读取原图，与抠图、美颜同时在后台线程中执行，在人脸对齐之前等待检测结束。
+        after_matting 仍在抠图后立即调用，after_detect 在美颜之后由调用线程调用，顺序与串行时相同；
+        检测线程只写入 ctx.face，抠图和美颜的回调中不应读取或修改 ctx.face
+        """
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.detect_first: bool = False
+        """
+        先检测模式：抠图之前先在原图上检测人脸，人脸数量不符时立即抛出 FaceError，不再执行抠图；
+        检测结果直接用于后续处理，不会重复检测。after_detect 仍在美颜之后调用，与串行时顺序相同。
+        同时开启并行模式时以先检测模式为准
+        """
+        self.roi_matting: bool = False
+        """
+        区域抠图模式：先检测人脸，只对图像调整可能用到的区域（见 photo_adjuster.matting_roi）抠图，
+        区域外的透明度为 0。区域越小，抠图模型对人像的有效分辨率越高；需要人脸矫正时仍对全图抠图
+        """
         # 处理者
         self.matting_handler: ContextHandler = extract_human
         self.detection_handler: ContextHandler = detect_face_mtcnn
@@ -65,6 +98,7 @@ class IDCreator:
         sharpen_strength: int = 0,
         saturation_strength: int = 0,
         face_alignment: bool = False,
+        matting_resolution=None,
     ) -> Result:
         """
         证件照处理函数
@@ -81,6 +115,7 @@ class IDCreator:
         :param contrast_strength: 对比度强度
         :param sharpen_strength: 锐化强度
         :param align_face: 是否需要人脸矫正
+        :param matting_resolution: 抠图模型的输入尺寸策略，None 为模型默认尺寸，"auto" 按标准照尺寸选择，整数为期望尺寸
 
         :return: 返回处理后的证件照和一系列参数
         """
@@ -99,42 +134,218 @@ class IDCreator:
             sharpen_strength=sharpen_strength,
             saturation_strength=saturation_strength,
             face_alignment=face_alignment,
+            matting_resolution=matting_resolution,
         )
 
-
         # 总的开始时间
         total_start_time = time.time()
-        
-        self.ctx = Context(params)
-        ctx = self.ctx
-        ctx.processing_image = image
-        ctx.processing_image = U.resize_image_esp(
-            ctx.processing_image, 2000
-        )  # 将输入图片 resize 到最大边长为 2000
-        ctx.origin_image = ctx.processing_image.copy()
-        self.before_all and self.before_all(ctx)
+
+        ctx = self._prepare(image, params)
+
+        # 增量模式下，输入图像的指纹，用于判断各阶段能否复用上一次的结果
+        fingerprint = image_fingerprint(ctx.processing_image) if self.incremental else None
+        detection_key = self._detection_key(fingerprint)
+
+        # 区域抠图和自动选择抠图尺寸都需要在抠图之前知道人脸位置
+        need_face = (
+            (self.roi_matting or params.matting_resolution == "auto")
+            and not params.crop_only
+            and not params.change_bg_only
+        )
+
+        # 先检测模式下（以及需要人脸位置时），人脸检测在抠图之前执行，检测失败时不再抠图；
+        # 并行模式下，人脸检测在后台线程中与抠图、美颜同时执行
+        detection = None
+        if (
+            (self.detect_first or need_face or self.parallel)
+            and not params.crop_only
+            and not params.change_bg_only
+            and not self._reusable("detection", detection_key)
+        ):
+            self.before_stage and self.before_stage("detection", ctx)
+            if self.detect_first or need_face:
+                self._detect(ctx)
+                detection = Future()
+                detection.set_result(None)
+            else:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hivision-detect")
+                detection = self._executor.submit(self._detect, ctx)
+
+        face = None
+        if need_face:
+            face = ctx.face if detection is not None else self._memo["detection"][1]["face"]
+
+        # 区域抠图模式下，根据人脸框计算抠图区域；人脸矫正会旋转整张抠图，此时仍对全图抠图
+        roi = None
+        if self.roi_matting and face is not None:
+            if not (params.face_alignment and abs(face["roll_angle"]) > 2):
+                roi = matting_roi(face["rectangle"], params, ctx.processing_image.shape)
+
+        self._set_matting_target(ctx, face, roi)
+
+        # 抠图结果的指纹：图像内容、抠图处理器、是否仅裁剪、抠图区域、模型实际使用的输入尺寸；
+        # 用输入尺寸而不是尺寸下限，只改照片尺寸、面部比例时，下限变化但选中的输入尺寸不变，抠图结果仍可复用
+        matting_key = None
+        if self.incremental:
+            matting_key = (
+                fingerprint,
+                self.matting_handler,
+                params.crop_only,
+                roi,
+                handler_ref_size(self.matting_handler, ctx.matting_target),
+            )
 
         # 1. ------------------人像抠图------------------
         # 如果仅裁剪，则不进行抠图
-        if not ctx.params.crop_only:
+        if self._reuse("matting", matting_key, ctx):
+            pass
+        elif not ctx.params.crop_only:
             # 调用抠图工作流
+            self.before_stage and self.before_stage("matting", ctx)
             print("[1]  Start Human Matting...")
             start_matting_time = time.time()
-            self.matting_handler(ctx)
+            if roi is None:
+                self.matting_handler(ctx)
+            else:
+                self._matting_roi(ctx, roi)
             end_matting_time = time.time()
-            print(f"[1]  Human Matting Time: {end_matting_time - start_matting_time:.3f}s")
+            resolution = f" (input {ctx.matting_ref_size})" if ctx.matting_ref_size else ""
+            print(f"[1]  Human Matting Time: {end_matting_time - start_matting_time:.3f}s{resolution}")
             self.after_matting and self.after_matting(ctx)
+            self._save("matting", matting_key, ctx, "processing_image", "matting_image")
         # 如果进行抠图
         else:
             ctx.matting_image = ctx.processing_image
 
+        self._finish(ctx, matting_key, detection)
+
+        # 总的结束时间
+        total_end_time = time.time()
+        print(f"[Total]  Total Time: {total_end_time - total_start_time:.3f}s")
+
+        return ctx.result
+
+    def batch(
+        self,
+        images: List[np.ndarray],
+        batch_size: int = 8,
+        return_exceptions: bool = False,
+        **kwargs,
+    ) -> List[Result]:
+        """
+        批量证件照处理函数，多张图像的抠图在一次模型推理中完成，其余步骤逐张执行
+        :param images: 输入图像列表
+        :param batch_size: 单次抠图推理的最大图像数
+        :param return_exceptions: 为 True 时，单张图像的异常（如 FaceError）放入结果列表而不是直接抛出
+        :param kwargs: 与 __call__ 相同的处理参数，对所有图像生效；matting_resolution 为 "auto" 时逐张先检测人脸再抠图
+
+        :return: 与输入顺序一致的处理结果列表
+        """
+        params = Params(**kwargs)
+        total_start_time = time.time()
+
+        # 自动选择抠图尺寸需要在抠图之前知道人脸位置
+        need_face = params.matting_resolution == "auto" and not params.crop_only and not params.change_bg_only
+        # 此时人脸检测已在抠图之前完成，_finish 中不再检测
+        detection = None
+        if need_face:
+            detection = Future()
+            detection.set_result(None)
+
+        batch_handler = BATCH_HANDLERS.get(self.matting_handler)
+        results = []
+        # 按 batch_size 分块处理，避免同时持有全部图像的中间结果
+        for i in range(0, len(images), batch_size):
+            ctxs = [self._prepare(image, params) for image in images[i : i + batch_size]]
+
+            # 逐张确定抠图模型输入尺寸的下限；需要人脸位置时先检测，检测失败的图像不再参与抠图
+            errors = {}
+            for ctx in ctxs:
+                if need_face:
+                    self.before_stage and self.before_stage("detection", ctx)
+                    try:
+                        self._detect(ctx)
+                    except Exception as e:
+                        if not return_exceptions:
+                            raise
+                        errors[id(ctx)] = e
+                        continue
+                self._set_matting_target(ctx, ctx.face if need_face else None)
+            ctxs_ok = [ctx for ctx in ctxs if id(ctx) not in errors]
+
+            # 1. ------------------批量人像抠图------------------
+            if params.crop_only:
+                for ctx in ctxs:
+                    ctx.matting_image = ctx.processing_image
+            elif ctxs_ok:
+                self.before_stage and self.before_stage("matting", ctxs_ok[0])
+                print(f"[1]  Start Batch Human Matting ({len(ctxs_ok)} images)...")
+                start_matting_time = time.time()
+                if batch_handler is not None:
+                    batch_handler(ctxs_ok)
+                else:
+                    for ctx in ctxs_ok:
+                        self.matting_handler(ctx)
+                end_matting_time = time.time()
+                print(f"[1]  Batch Human Matting Time: {end_matting_time - start_matting_time:.3f}s")
+                if self.after_matting:
+                    for ctx in ctxs_ok:
+                        self.after_matting(ctx)
+
+            for ctx in ctxs:
+                if id(ctx) in errors:
+                    results.append(errors[id(ctx)])
+                    continue
+                try:
+                    self._finish(ctx, detection=detection)
+                    results.append(ctx.result)
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    results.append(e)
+
+        print(f"[Total]  Batch Total Time: {time.time() - total_start_time:.3f}s")
+
+        return results
+
+    def _prepare(self, image: np.ndarray, params: Params) -> Context:
+        """
+        初始化上下文，将输入图片 resize 到最大边长为 2000
+        """
+        self.ctx = Context(params)
+        ctx = self.ctx
+        ctx.processing_image = image
+        ctx.processing_image = U.resize_image_esp(
+            ctx.processing_image, 2000
+        )  # 将输入图片 resize 到最大边长为 2000
+        ctx.origin_image = ctx.processing_image.copy()
+        self.before_all and self.before_all(ctx)
+        return ctx
+
+    def _finish(
+        self,
+        ctx: Context,
+        matting_key: Optional[tuple] = None,
+        detection: Optional[Future] = None,
+    ):
+        """
+        抠图之后的处理：美颜、人脸检测、人脸对齐、图像调整，结果写入 ctx.result
+        :param matting_key: 增量模式下抠图结果的指纹，None 表示不复用也不保存各阶段结果
+        :param detection: 已在后台开始或已经完成的人脸检测，None 表示在这里执行检测
+        """
+        self.ctx = ctx
+        beauty_key, detection_key, alignment_key = self._stage_keys(ctx.params, matting_key)
 
         # 2. ------------------美颜------------------
-        print("[2]  Start Beauty...")
-        start_beauty_time = time.time()
-        self.beauty_handler(ctx)
-        end_beauty_time = time.time()
-        print(f"[2]  Beauty Time: {end_beauty_time - start_beauty_time:.3f}s")
+        if not self._reuse("beauty", beauty_key, ctx):
+            self.before_stage and self.before_stage("beauty", ctx)
+            print("[2]  Start Beauty...")
+            start_beauty_time = time.time()
+            self.beauty_handler(ctx)
+            end_beauty_time = time.time()
+            print(f"[2]  Beauty Time: {end_beauty_time - start_beauty_time:.3f}s")
+            self._save("beauty", beauty_key, ctx, "matting_image")
 
         # 如果仅换底，则直接返回抠图结果
         if ctx.params.change_bg_only:
@@ -147,58 +358,155 @@ class IDCreator:
                 face=None,
             )
             self.after_all and self.after_all(ctx)
-            return ctx.result
+            return
 
         # 3. ------------------人脸检测------------------
-        print("[3]  Start Face Detection...")
-        start_detection_time = time.time()
-        self.detection_handler(ctx)
-        end_detection_time = time.time()
-        print(f"[3]  Face Detection Time: {end_detection_time - start_detection_time:.3f}s")
-        self.after_detect and self.after_detect(ctx)
+        if detection is not None:
+            # 等待后台的人脸检测结束，检测失败时在这里抛出 FaceError；先检测模式下检测已完成
+            detection.result()
+            self.after_detect and self.after_detect(ctx)
+            self._save("detection", detection_key, ctx, "face")
+        elif not self._reuse("detection", detection_key, ctx):
+            self.before_stage and self.before_stage("detection", ctx)
+            self._detect(ctx)
+            self.after_detect and self.after_detect(ctx)
+            self._save("detection", detection_key, ctx, "face")
 
         # 3.1 ------------------人脸对齐------------------
         if ctx.params.face_alignment and abs(ctx.face["roll_angle"]) > 2:
-            print("[3.1]  Start Face Alignment...")
-            start_alignment_time = time.time()
-            from hivision.creator.rotation_adjust import rotate_bound_4channels
-
-            # 根据角度旋转原图和抠图
-            b, g, r, a = cv2.split(ctx.matting_image)
-            ctx.origin_image, ctx.matting_image, _, _, _, _ = rotate_bound_4channels(
-                cv2.merge((b, g, r)),
-                a,
-                -1 * ctx.face["roll_angle"],
-            )
+            if not self._reuse("alignment", alignment_key, ctx):
+                self.before_stage and self.before_stage("alignment", ctx)
+                print("[3.1]  Start Face Alignment...")
+                start_alignment_time = time.time()
+                from hivision.creator.rotation_adjust import rotate_bound_4channels
 
-            # 旋转后再执行一遍人脸检测
-            self.detection_handler(ctx)
-            self.after_detect and self.after_detect(ctx)
-            end_alignment_time = time.time()
-            print(f"[3.1]  Face Alignment Time: {end_alignment_time - start_alignment_time:.3f}s")
+                # 根据角度旋转原图和抠图
+                b, g, r, a = cv2.split(ctx.matting_image)
+                ctx.origin_image, ctx.matting_image, _, _, _, _ = rotate_bound_4channels(
+                    cv2.merge((b, g, r)),
+                    a,
+                    -1 * ctx.face["roll_angle"],
+                )
+
+                # 旋转后再执行一遍人脸检测，旋转后的原图来自美颜后的抠图，因此美颜参数变化时需要重新检测
+                self.detection_handler(ctx)
+                self.after_detect and self.after_detect(ctx)
+                end_alignment_time = time.time()
+                print(f"[3.1]  Face Alignment Time: {end_alignment_time - start_alignment_time:.3f}s")
+                self._save("alignment", alignment_key, ctx, "origin_image", "matting_image", "face")
 
         # 4. ------------------图像调整------------------
+        self.before_stage and self.before_stage("adjust", ctx)
         print("[4]  Start Image Post-Adjustment...")
         start_adjust_time = time.time()
-        result_image_hd, result_image_standard, clothing_params, typography_params = (
-            adjust_photo(ctx)
-        )
+        crop, clothing_params = adjust_photo(ctx)
         end_adjust_time = time.time()
         print(f"[4]  Image Post-Adjustment Time: {end_adjust_time - start_adjust_time:.3f}s")
 
         # 5. ------------------返回结果------------------
         ctx.result = Result(
-            standard=result_image_standard,
-            hd=result_image_hd,
+            standard=None,
+            hd=None,
             matting=ctx.matting_image,
             clothing_params=clothing_params,
-            typography_params=typography_params,
+            typography_params=None,
             face=ctx.face,
+            crop=crop,
         )
         self.after_all and self.after_all(ctx)
 
-        # 总的结束时间
-        total_end_time = time.time()
-        print(f"[Total]  Total Time: {total_end_time - total_start_time:.3f}s")
 
-        return ctx.result
+    def _matting_roi(self, ctx: Context, roi: Tuple[int, int, int, int]):
+        """
+        只对区域 roi 抠图，再放回与处理图像同尺寸的画布，区域外的透明度为 0
+        """
+        x1, y1, x2, y2 = roi
+        image = ctx.processing_image
+        print(f"[1]  Matting ROI: {x2 - x1}x{y2 - y1} of {image.shape[1]}x{image.shape[0]}")
+        ctx.processing_image = np.ascontiguousarray(image[y1:y2, x1:x2])
+        try:
+            self.matting_handler(ctx)
+        finally:
+            roi_image, ctx.processing_image = ctx.processing_image, image
+
+        matting_image = np.zeros((*image.shape[:2], 4), np.uint8)
+        matting_image[:, :, :3] = image[:, :, :3]
+        matting_image[y1:y2, x1:x2] = roi_image
+        ctx.processing_image = matting_image
+        ctx.matting_image = matting_image.copy()
+
+    @staticmethod
+    def _set_matting_target(ctx: Context, face: Optional[dict], roi: Optional[Tuple[int, int, int, int]] = None):
+        """
+        抠图模型输入尺寸的下限：自动模式下由标准照尺寸和裁剪框在抠图区域中的大小决定，没有人脸位置时使用模型默认尺寸；
+        整数为期望尺寸
+        """
+        params = ctx.params
+        if params.matting_resolution == "auto":
+            if face is not None:
+                region = ctx.processing_image.shape[:2] if roi is None else (roi[3] - roi[1], roi[2] - roi[0])
+                ctx.matting_target = matting_input_size(face["rectangle"], params, region)
+        elif params.matting_resolution is not None:
+            ctx.matting_target = int(params.matting_resolution)
+
+    def _detect(self, ctx: Context):
+        print("[3]  Start Face Detection...")
+        start_detection_time = time.time()
+        self.detection_handler(ctx)
+        end_detection_time = time.time()
+        print(f"[3]  Face Detection Time: {end_detection_time - start_detection_time:.3f}s")
+
+    def _stage_keys(self, params: Params, matting_key: Optional[tuple]):
+        """
+        美颜、人脸检测、人脸对齐的指纹，由上游阶段的指纹和本阶段用到的参数组成；人脸检测只依赖原图，与美颜无关
+        :return: (beauty_key, detection_key, alignment_key)，非增量模式下均为 None
+        """
+        if matting_key is None:
+            return None, None, None
+        beauty_key = (
+            matting_key,
+            self.beauty_handler,
+            params.whitening_strength,
+            params.brightness_strength,
+            params.contrast_strength,
+            params.sharpen_strength,
+            params.saturation_strength,
+        )
+        detection_key = self._detection_key(matting_key[0])
+        return beauty_key, detection_key, (beauty_key, detection_key)
+
+    def _detection_key(self, fingerprint: Optional[str]) -> Optional[tuple]:
+        return None if fingerprint is None else (fingerprint, self.detection_handler)
+
+    def _reusable(self, stage: str, key: Optional[tuple]) -> bool:
+        memo = self._memo.get(stage)
+        return key is not None and memo is not None and memo[0] == key
+
+    def _reuse(self, stage: str, key: Optional[tuple], ctx: Context) -> bool:
+        """
+        增量模式下，阶段输入的指纹与上一次相同时，把上次保存的结果恢复到 ctx
+        :return: 是否复用了上次的结果
+        """
+        if not self._reusable(stage, key):
+            return False
+        for name, value in self._memo[stage][1].items():
+            setattr(ctx, name, copy.deepcopy(value))
+        print(f"[Memo]  Reuse {stage}")
+        return True
+
+    def _save(self, stage: str, key: Optional[tuple], ctx: Context, *names: str):
+        """
+        增量模式下保存阶段结果，每个阶段只保留最近一次；保存的是副本，之后对 ctx 的修改不影响保存的结果
+        """
+        if key is None:
+            return
+        self._memo[stage] = (key, {name: copy.deepcopy(getattr(ctx, name)) for name in names})
+
+def image_fingerprint(image: np.ndarray) -> str:
+    """
+    图像内容的指纹，用于增量模式下判断输入图像是否变化
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str((image.shape, image.dtype.str)).encode())
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
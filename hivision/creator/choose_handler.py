@@ -7,6 +7,9 @@ HUMAN_MATTING_MODELS = [
     "birefnet-v1-lite",
     "hivision_modnet",
     "rmbg-1.4",
+    "hivision_modnet-int8",
+    "modnet_photographic_portrait_matting-int8",
+    "rmbg-1.4-int8",
 ]
 
 FACE_DETECT_MODELS = ["face++ (联网Online API)", "mtcnn", "retinaface-resnet50"]
@@ -21,6 +24,12 @@ def choose_handler(creator, matting_model_option=None, face_detect_option=None):
         creator.matting_handler = extract_human_rmbg
     elif matting_model_option == "birefnet-v1-lite":
         creator.matting_handler = extract_human_birefnet_lite
+    elif matting_model_option == "hivision_modnet-int8":
+        creator.matting_handler = extract_human_int8
+    elif matting_model_option == "modnet_photographic_portrait_matting-int8":
+        creator.matting_handler = extract_human_modnet_photographic_portrait_matting_int8
+    elif matting_model_option == "rmbg-1.4-int8":
+        creator.matting_handler = extract_human_rmbg_int8
     else:
         creator.matting_handler = extract_human
 
@@ -8,7 +8,9 @@ r"""
     证件照创建上下文类，用于同步信息
 """
 from typing import Optional, Callable, Tuple
+import cv2
 import numpy as np
+from .mask_analysis import MaskAnalysis
 
 
 class Params:
@@ -27,6 +29,7 @@ class Params:
         sharpen_strength: int = 0,
         saturation_strength: int = 0,
         face_alignment: bool = False,
+        matting_resolution=None,
     ):
         self.__size = size
         self.__change_bg_only = change_bg_only
@@ -41,6 +44,7 @@ class Params:
         self.__sharpen_strength = sharpen_strength
         self.__saturation_strength = saturation_strength
         self.__face_alignment = face_alignment
+        self.__matting_resolution = matting_resolution
 
     @property
     def size(self):
@@ -94,29 +98,98 @@ class Params:
     def face_alignment(self):
         return self.__face_alignment
 
+    @property
+    def matting_resolution(self):
+        """
+        抠图模型的输入尺寸策略：None 使用模型的默认尺寸；"auto" 根据标准照尺寸和人脸位置选择够用的最小尺寸；
+        整数表示期望的输入尺寸，取模型支持的尺寸中不小于它的最小值
+        """
+        return self.__matting_resolution
+
 
 class Result:
     def __init__(
         self,
-        standard: np.ndarray,
-        hd: np.ndarray,
+        standard: Optional[np.ndarray],
+        hd: Optional[np.ndarray],
         matting: np.ndarray,
         clothing_params: Optional[dict],
         typography_params: Optional[dict],
         face: Optional[Tuple[int, int, int, int, float]],
+        crop=None,
     ):
-        self.standard = standard
-        self.hd = hd
+        """
+        :param crop: 裁剪几何（photo_adjuster.PhotoCrop），给出时 standard、hd、typography_params 可以为 None，
+            在第一次读取时才由裁剪几何生成
+        """
+        self._standard = standard
+        self._hd = hd
         self.matting = matting
         self.clothing_params = clothing_params
         """
         服装参数，仅换底时为 None
         """
-        self.typography_params = typography_params
+        self._typography_params = typography_params
+        self.face = face
+        self.crop = crop
+        """
+        裁剪几何，仅换底时为 None
+        """
+
+    @property
+    def standard(self) -> np.ndarray:
+        """
+        标准照
+        """
+        if self._standard is None and self.crop is not None:
+            self._standard = self.crop.standard()
+        return self._standard
+
+    @standard.setter
+    def standard(self, value: np.ndarray):
+        self._standard = value
+
+    @property
+    def hd(self) -> np.ndarray:
+        """
+        高清照
+        """
+        if self._hd is None and self.crop is not None:
+            self._hd = self.crop.hd()
+        return self._hd
+
+    @hd.setter
+    def hd(self, value: np.ndarray):
+        self._hd = value
+
+    @property
+    def typography_params(self) -> Optional[dict]:
         """
         排版参数，仅换底时为 None
         """
-        self.face = face
+        if self._typography_params is None and self.crop is not None:
+            self._typography_params = self.crop.typography()
+        return self._typography_params
+
+    @typography_params.setter
+    def typography_params(self, value: Optional[dict]):
+        self._typography_params = value
+
+    def resize(self, size: Tuple[int, int]) -> np.ndarray:
+        """
+        由裁剪几何直接生成尺寸为 size=(高, 宽) 的照片，只重采样一次，不经过标准照或高清照
+        """
+        if self.crop is None:
+            raise ValueError("仅换底的结果没有裁剪信息，无法生成其他尺寸！")
+        return self.crop.render(size)
+
+    def with_dpi(self, dpi: int, base_dpi: int = 300) -> np.ndarray:
+        """
+        以 dpi 输出同一物理尺寸的照片：标准照尺寸按 base_dpi 计算，输出尺寸按 dpi / base_dpi 缩放
+        """
+        scale = dpi / base_dpi
+        height, width = self.crop.standard_size if self.crop is not None else self.standard.shape[:2]
+        return self.resize((max(1, int(round(height * scale))), max(1, int(round(width * scale)))))
 
     def __iter__(self):
         return iter(
@@ -163,6 +236,27 @@ class Context:
         """
         人脸矫正信息，仅当 align_face 为 True 时存在
         """
+        self.matting_target: Optional[int] = None
+        """
+        抠图模型输入尺寸的下限，由 params.matting_resolution 得到，None 表示使用模型的默认尺寸
+        """
+        self.matting_ref_size: Optional[int] = None
+        """
+        本次抠图实际使用的模型输入尺寸，由抠图处理器写入
+        """
+        self._mask_analysis: Optional[MaskAnalysis] = None
+        self._mask_source: Optional[np.ndarray] = None
+
+    @property
+    def mask_analysis(self) -> MaskAnalysis:
+        """
+        matting_image 透明通道的分析结果（二值图、最大连通区域、行列投影），第一次使用时计算，
+        同一张抠图的多次取框共用；matting_image 被替换（如美颜、人脸矫正）后重新计算
+        """
+        if self._mask_analysis is None or self._mask_source is not self.matting_image:
+            self._mask_analysis = MaskAnalysis(cv2.extractChannel(self.matting_image, 3))
+            self._mask_source = self.matting_image
+        return self._mask_analysis
 
 
 ContextHandler = Optional[Callable[[Context], None]]
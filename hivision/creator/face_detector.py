@@ -7,25 +7,33 @@ r"""
 @Description:
     人脸检测器
 """
-try:
-    from mtcnnruntime import MTCNN
-except ImportError:
-    raise ImportError(
-        "Please install mtcnn-runtime by running `pip install mtcnn-runtime`"
-    )
 from .context import Context
 from hivision.error import FaceError, APIError
 from hivision.utils import resize_image_to_kb_base64
 from hivision.creator.retinaface import retinaface_detect_faces
-import requests
+from hivision.creator.retinaface.inference import load_onnx_model
+from .session_registry import REGISTRY
 import cv2
 import os
 import numpy as np
 
 
-mtcnn = None
 base_dir = os.path.dirname(os.path.abspath(__file__))
-RETINAFCE_SESS = None
+MTCNN_KEY = "mtcnn"
+RETINAFACE_WEIGHT = os.path.join(base_dir, "retinaface/weights/retinaface-resnet50.onnx")
+
+
+def load_mtcnn():
+    """
+    加载 MTCNN 模型，mtcnnruntime 在第一次使用时才导入
+    """
+    try:
+        from mtcnnruntime import MTCNN
+    except ImportError:
+        raise ImportError(
+            "Please install mtcnn-runtime by running `pip install mtcnn-runtime`"
+        )
+    return MTCNN()
 
 
 def detect_face_mtcnn(ctx: Context, scale: int = 2):
@@ -35,9 +43,7 @@ def detect_face_mtcnn(ctx: Context, scale: int = 2):
     :param scale: 最大边长缩放比例，原图:缩放图 = 1:scale
     :raise FaceError: 人脸检测错误，多个人脸或者没有人脸
     """
-    global mtcnn
-    if mtcnn is None:
-        mtcnn = MTCNN()
+    mtcnn, _ = REGISTRY.get(MTCNN_KEY, load_mtcnn, nbytes=0)
     image = cv2.resize(
         ctx.origin_image,
         (ctx.origin_image.shape[1] // scale, ctx.origin_image.shape[0] // scale),
@@ -83,6 +89,8 @@ def detect_face_face_plusplus(ctx: Context):
     :param scale: 最大边长缩放比例，原图:缩放图 = 1:scale
     :raise FaceError: 人脸检测错误，多个人脸或者没有人脸
     """
+    import requests
+
     url = "https://api-cn.faceplusplus.com/facepp/v3/detect"
     api_key = os.getenv("FACE_PLUS_API_KEY")
     api_secret = os.getenv("FACE_PLUS_API_SECRET")
@@ -168,26 +176,12 @@ def detect_face_retinaface(ctx: Context):
     :param ctx: 上下文，此时已获取到原始图和抠图结果，但是我们只需要原始图
     :raise FaceError: 人脸检测错误，多个人脸或者没有人脸
     """
-    from time import time
-
-    global RETINAFCE_SESS
-
-    if RETINAFCE_SESS is None:
-        # 计算用时
-        tic = time()
-        faces_dets, sess = retinaface_detect_faces(
-            ctx.origin_image,
-            os.path.join(base_dir, "retinaface/weights/retinaface-resnet50.onnx"),
-            sess=None,
-        )
-        RETINAFCE_SESS = sess
-    else:
-        tic = time()
-        faces_dets, _ = retinaface_detect_faces(
-            ctx.origin_image,
-            os.path.join(base_dir, "retinaface/weights/retinaface-resnet50.onnx"),
-            sess=RETINAFCE_SESS,
-        )
+    sess, _ = REGISTRY.get(
+        RETINAFACE_WEIGHT, lambda: load_onnx_model(RETINAFACE_WEIGHT, set_cpu=False)
+    )
+    faces_dets, _ = retinaface_detect_faces(
+        ctx.origin_image, RETINAFACE_WEIGHT, sess=sess
+    )
 
     faces_num = len(faces_dets)
     faces_landmarks = []
@@ -213,7 +207,3 @@ def detect_face_retinaface(ctx: Context):
     dx = right_eye[0] - left_eye[0]
     roll_angle = np.degrees(np.arctan2(dy, dx))
     ctx.face["roll_angle"] = roll_angle
-
-    # 如果RUN_MODE不是野兽模式，则释放模型
-    if os.getenv("RUN_MODE") == "beast":
-        RETINAFCE_SESS = None
\ No newline at end of file
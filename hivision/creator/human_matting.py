@@ -8,13 +8,17 @@ r"""
     人像抠图
 """
 import numpy as np
-from PIL import Image
-import onnxruntime
-from .tensor2numpy import NNormalize, NTo_Tensor, NUnsqueeze
 from .context import Context
+from .session_registry import REGISTRY
+from .matting_scheduler import SCHEDULER
+from .matting_cache import MATTING_CACHE
+from .mask_analysis import MaskAnalysis
+from .onnx_session import create_session, get_device, get_provider
 import cv2
 import os
+import threading
 from time import time
+from typing import List, Optional
 
 
 WEIGHTS = {
@@ -32,42 +36,80 @@ WEIGHTS = {
         "mnn_hivision_modnet.mnn",
     ),
     "rmbg-1.4": os.path.join(os.path.dirname(__file__), "weights", "rmbg-1.4.onnx"),
+    "hivision_modnet-int8": os.path.join(
+        os.path.dirname(__file__), "weights", "hivision_modnet-int8.onnx"
+    ),
+    "modnet_photographic_portrait_matting-int8": os.path.join(
+        os.path.dirname(__file__),
+        "weights",
+        "modnet_photographic_portrait_matting-int8.onnx",
+    ),
+    "rmbg-1.4-int8": os.path.join(
+        os.path.dirname(__file__), "weights", "rmbg-1.4-int8.onnx"
+    ),
     "birefnet-v1-lite": os.path.join(
         os.path.dirname(__file__), "weights", "birefnet-v1-lite.onnx"
     ),
 }
 
-ONNX_DEVICE = onnxruntime.get_device()
-ONNX_PROVIDER = (
-    "CUDAExecutionProvider" if ONNX_DEVICE == "GPU" else "CPUExecutionProvider"
-)
 
-HIVISION_MODNET_SESS = None
-MODNET_PHOTOGRAPHIC_PORTRAIT_MATTING_SESS = None
-RMBG_SESS = None
-BIREFNET_V1_LITE_SESS = None
+_MODNET_RESOLUTIONS = (320, 384, 448, 512)
+_LARGE_RESOLUTIONS = (512, 640, 768, 896, 1024)
+
+MATTING_RESOLUTIONS = {
+    "hivision_modnet": _MODNET_RESOLUTIONS,
+    "modnet_photographic_portrait_matting": _MODNET_RESOLUTIONS,
+    "mnn_hivision_modnet": (512,),
+    "rmbg-1.4": _LARGE_RESOLUTIONS,
+    "hivision_modnet-int8": _MODNET_RESOLUTIONS,
+    "modnet_photographic_portrait_matting-int8": _MODNET_RESOLUTIONS,
+    "rmbg-1.4-int8": _LARGE_RESOLUTIONS,
+    "birefnet-v1-lite": _LARGE_RESOLUTIONS,
+}
+"""
+各抠图模型可选的输入尺寸（升序，均为 32 的倍数），最后一个为模型的默认尺寸；
+低于最小尺寸时透明通道的边缘质量明显下降
+"""
+
+
+MATTE_REFINEMENT = os.getenv("HIVISION_MATTE_REFINE", "0") == "1"
+"""
+是否在放大 matte 时对边缘带做导向滤波修正（见 refine_matte），会改变抠图结果，默认关闭，环境变量 HIVISION_MATTE_REFINE=1 时开启
+"""
+
+MATTE_BAND = (4, 251)
+"""
+边缘带的透明度范围，放大后的透明度在此范围内的像素视为不确定；模型输出很少恰好为 0 或 255，因此两端各留一点余量
+"""
+
+
+def __getattr__(name):
+    # ONNX_DEVICE / ONNX_PROVIDER 在第一次访问时才导入 onnxruntime
+    if name == "ONNX_DEVICE":
+        return get_device()
+    if name == "ONNX_PROVIDER":
+        return get_provider()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def load_onnx_model(checkpoint_path, set_cpu=False):
     providers = (
         ["CUDAExecutionProvider", "CPUExecutionProvider"]
-        if ONNX_PROVIDER == "CUDAExecutionProvider"
+        if get_provider() == "CUDAExecutionProvider"
         else ["CPUExecutionProvider"]
     )
 
     if set_cpu:
-        sess = onnxruntime.InferenceSession(
-            checkpoint_path, providers=["CPUExecutionProvider"]
-        )
+        sess = create_session(checkpoint_path, providers=["CPUExecutionProvider"])
     else:
         try:
-            sess = onnxruntime.InferenceSession(checkpoint_path, providers=providers)
+            sess = create_session(checkpoint_path, providers=providers)
         except Exception as e:
-            if ONNX_DEVICE == "CUDAExecutionProvider":
+            if get_provider() == "CUDAExecutionProvider":
                 print(f"Failed to load model with CUDAExecutionProvider: {e}")
                 print("Falling back to CPUExecutionProvider")
                 # 尝试使用CPU加载模型
-                sess = onnxruntime.InferenceSession(
+                sess = create_session(
                     checkpoint_path, providers=["CPUExecutionProvider"]
                 )
             else:
@@ -76,15 +118,127 @@ def load_onnx_model(checkpoint_path, set_cpu=False):
     return sess
 
 
+def get_onnx_session(checkpoint_path, set_cpu=True):
+    """
+    从会话注册表获取模型会话，首次使用时加载，之后常驻直至空闲超时或内存不足被释放
+    :param checkpoint_path: 模型权重路径
+    :param set_cpu: 是否强制使用 CPU
+    :return: 模型会话和输入输出元信息
+    """
+    return REGISTRY.get(
+        checkpoint_path, lambda: load_onnx_model(checkpoint_path, set_cpu=set_cpu)
+    )
+
+
+def select_ref_size(ctx: Context, name: str) -> int:
+    """
+    选择抠图模型的输入尺寸：取可选尺寸中不小于 ctx.matting_target 的最小值，没有要求时使用默认尺寸；
+    ONNX 模型导出时固定了输入尺寸的只能使用该尺寸。选择结果写入 ctx.matting_ref_size
+    :param name: WEIGHTS 中的模型名
+    """
+    ctx.matting_ref_size = choose_ref_size(name, ctx.matting_target)
+    return ctx.matting_ref_size
+
+
+def choose_ref_size(name: str, target: Optional[int]) -> int:
+    """
+    输入尺寸下限为 target 时模型 name 实际使用的输入尺寸，规则见 select_ref_size
+    """
+    sizes = MATTING_RESOLUTIONS[name]
+    if target is None:
+        return sizes[-1]
+    fixed = fixed_input_size(WEIGHTS[name])
+    return fixed or next((size for size in sizes if size >= target), sizes[-1])
+
+
+def handler_ref_size(handler, target: Optional[int]):
+    """
+    抠图处理器在输入尺寸下限为 target 时实际使用的模型输入尺寸，在抠图之前确定，用于判断抠图结果能否复用；
+    不在 MATTING_MODELS 中的处理器（如自定义处理器）无法预知，返回 target 本身
+    """
+    name = MATTING_MODELS.get(handler)
+    return target if name is None else choose_ref_size(name, target)
+
+
+def fixed_input_size(checkpoint_path):
+    """
+    ONNX 模型导出时固定的输入高度，输入尺寸可变、权重不存在或不是 ONNX 模型时返回 None
+    """
+    if not checkpoint_path.endswith(".onnx") or not os.path.exists(checkpoint_path):
+        return None
+    meta = REGISTRY.meta(checkpoint_path)
+    if meta is None:
+        # 与推理函数的加载方式一致：BiRefNet 有 GPU 时使用 GPU，其余模型使用 CPU
+        set_cpu = "birefnet" not in checkpoint_path or get_device() != "GPU"
+        _, meta = get_onnx_session(checkpoint_path, set_cpu=set_cpu)
+    shape = meta.input_shapes[0]
+    height = shape[2] if len(shape) == 4 else None
+    return height if isinstance(height, int) else None
+
+
+def matte_variant() -> str:
+    return "refine" if MATTE_REFINEMENT else ""
+
+
+def cached_matting(input_image, matting_fn, checkpoint_path, ref_size, fix=False):
+    """
+    带缓存的单张抠图，同一张图像用同一模型再次抠图时直接从缓存取透明通道
+    :param matting_fn: 抠图函数 matting_fn(image, checkpoint_path, ref_size)
+    :param fix: 是否用 hollow_out_fix 修补抠图结果，缓存的是修补后的透明通道
+    :return: BGRA 抠图结果，权重不存在时为 None
+    """
+    key = MATTING_CACHE.key(input_image, checkpoint_path, ref_size, matte_variant())
+    alpha = MATTING_CACHE.get(key)
+    if alpha is not None:
+        return compose_matting_image(input_image, alpha)
+
+    matting_image = matting_fn(input_image, checkpoint_path, ref_size)
+    if matting_image is None:
+        return None
+    if fix:
+        matting_image = hollow_out_fix(matting_image)
+    MATTING_CACHE.put(key, matting_image[:, :, 3])
+    return matting_image
+
+
+def cached_matting_batch(input_images, batch_fn, checkpoint_path, ref_size, fix=False):
+    """
+    带缓存的批量抠图，只有未命中缓存的图像参与批量推理
+    :param batch_fn: 批量抠图函数 batch_fn(images, checkpoint_path, ref_size)
+    :return: 与输入顺序一致的 BGRA 抠图结果列表，权重不存在时为 None
+    """
+    keys = [MATTING_CACHE.key(image, checkpoint_path, ref_size, matte_variant()) for image in input_images]
+    output_images = [MATTING_CACHE.get(key) for key in keys]
+    missing = [i for i, alpha in enumerate(output_images) if alpha is None]
+    for i, alpha in enumerate(output_images):
+        if alpha is not None:
+            output_images[i] = compose_matting_image(input_images[i], alpha)
+
+    if missing:
+        matting_images = batch_fn([input_images[i] for i in missing], checkpoint_path, ref_size)
+        if matting_images is None:
+            return None
+        for i, matting_image in zip(missing, matting_images):
+            if fix:
+                matting_image = hollow_out_fix(matting_image)
+            MATTING_CACHE.put(keys[i], matting_image[:, :, 3])
+            output_images[i] = matting_image
+    return output_images
+
+
 def extract_human(ctx: Context):
     """
     人像抠图
     :param ctx: 上下文
     """
-    # 抠图
-    matting_image = get_modnet_matting(ctx.processing_image, WEIGHTS["hivision_modnet"])
-    # 修复抠图
-    ctx.processing_image = hollow_out_fix(matting_image)
+    # 抠图并修复抠图
+    ctx.processing_image = cached_matting(
+        ctx.processing_image,
+        get_modnet_matting,
+        WEIGHTS["hivision_modnet"],
+        select_ref_size(ctx, "hivision_modnet"),
+        fix=True,
+    )
     ctx.matting_image = ctx.processing_image.copy()
 
 
@@ -94,25 +248,68 @@ def extract_human_modnet_photographic_portrait_matting(ctx: Context):
     :param ctx: 上下文
     """
     # 抠图
-    matting_image = get_modnet_matting_photographic_portrait_matting(
-        ctx.processing_image, WEIGHTS["modnet_photographic_portrait_matting"]
+    ctx.processing_image = cached_matting(
+        ctx.processing_image,
+        get_modnet_matting_photographic_portrait_matting,
+        WEIGHTS["modnet_photographic_portrait_matting"],
+        select_ref_size(ctx, "modnet_photographic_portrait_matting"),
     )
-    # 修复抠图
-    ctx.processing_image = matting_image
     ctx.matting_image = ctx.processing_image.copy()
 
 
 def extract_human_mnn_modnet(ctx: Context):
-    matting_image = get_mnn_modnet_matting(
-        ctx.processing_image, WEIGHTS["mnn_hivision_modnet"]
+    ctx.processing_image = cached_matting(
+        ctx.processing_image,
+        get_mnn_modnet_matting,
+        WEIGHTS["mnn_hivision_modnet"],
+        select_ref_size(ctx, "mnn_hivision_modnet"),
+        fix=True,
     )
-    ctx.processing_image = hollow_out_fix(matting_image)
     ctx.matting_image = ctx.processing_image.copy()
 
 
 def extract_human_rmbg(ctx: Context):
-    matting_image = get_rmbg_matting(ctx.processing_image, WEIGHTS["rmbg-1.4"])
-    ctx.processing_image = matting_image
+    ctx.processing_image = cached_matting(
+        ctx.processing_image,
+        get_rmbg_matting,
+        WEIGHTS["rmbg-1.4"],
+        select_ref_size(ctx, "rmbg-1.4"),
+    )
+    ctx.matting_image = ctx.processing_image.copy()
+
+
+def extract_human_int8(ctx: Context):
+    """
+    人像抠图，使用 INT8 动态量化的 hivision_modnet
+    :param ctx: 上下文
+    """
+    ctx.processing_image = cached_matting(
+        ctx.processing_image,
+        get_modnet_matting,
+        WEIGHTS["hivision_modnet-int8"],
+        select_ref_size(ctx, "hivision_modnet-int8"),
+        fix=True,
+    )
+    ctx.matting_image = ctx.processing_image.copy()
+
+
+def extract_human_modnet_photographic_portrait_matting_int8(ctx: Context):
+    ctx.processing_image = cached_matting(
+        ctx.processing_image,
+        get_modnet_matting,
+        WEIGHTS["modnet_photographic_portrait_matting-int8"],
+        select_ref_size(ctx, "modnet_photographic_portrait_matting-int8"),
+    )
+    ctx.matting_image = ctx.processing_image.copy()
+
+
+def extract_human_rmbg_int8(ctx: Context):
+    ctx.processing_image = cached_matting(
+        ctx.processing_image,
+        get_rmbg_matting,
+        WEIGHTS["rmbg-1.4-int8"],
+        select_ref_size(ctx, "rmbg-1.4-int8"),
+    )
     ctx.matting_image = ctx.processing_image.copy()
 
 
@@ -125,48 +322,128 @@ def extract_human_rmbg(ctx: Context):
 
 
 def extract_human_birefnet_lite(ctx: Context):
-    matting_image = get_birefnet_portrait_matting(
-        ctx.processing_image, WEIGHTS["birefnet-v1-lite"]
+    ctx.processing_image = cached_matting(
+        ctx.processing_image,
+        get_birefnet_portrait_matting,
+        WEIGHTS["birefnet-v1-lite"],
+        select_ref_size(ctx, "birefnet-v1-lite"),
     )
-    ctx.processing_image = matting_image
     ctx.matting_image = ctx.processing_image.copy()
 
 
+def set_matting_images(ctxs: List[Context], matting_images):
+    for ctx, matting_image in zip(ctxs, matting_images):
+        ctx.processing_image = matting_image
+        ctx.matting_image = ctx.processing_image.copy()
+
+
+def matting_batch(ctxs: List[Context], batch_fn, name: str, fix=False):
+    """
+    批量抠图，每张图像的输入尺寸与单张抠图一样由 select_ref_size 选择，同一输入尺寸的图像在一次推理中完成
+    :param batch_fn: 批量抠图函数 batch_fn(images, checkpoint_path, ref_size)
+    :param name: WEIGHTS 中的模型名
+    :param fix: 是否用 hollow_out_fix 修补抠图结果
+    """
+    groups = {}
+    for ctx in ctxs:
+        groups.setdefault(select_ref_size(ctx, name), []).append(ctx)
+    for ref_size, group in groups.items():
+        matting_images = cached_matting_batch(
+            [ctx.processing_image for ctx in group], batch_fn, WEIGHTS[name], ref_size, fix=fix
+        )
+        set_matting_images(group, matting_images)
+
+
+def extract_human_batch(ctxs: List[Context]):
+    """
+    批量人像抠图，多张图在一次推理中完成
+    :param ctxs: 上下文列表
+    """
+    matting_batch(ctxs, get_modnet_matting_batch, "hivision_modnet", fix=True)
+
+
+def extract_human_modnet_photographic_portrait_matting_batch(ctxs: List[Context]):
+    matting_batch(ctxs, get_modnet_matting_batch, "modnet_photographic_portrait_matting")
+
+
+def extract_human_rmbg_batch(ctxs: List[Context]):
+    matting_batch(ctxs, get_rmbg_matting_batch, "rmbg-1.4")
+
+
+def extract_human_birefnet_lite_batch(ctxs: List[Context]):
+    matting_batch(ctxs, get_birefnet_portrait_matting_batch, "birefnet-v1-lite")
+
+
+def extract_human_int8_batch(ctxs: List[Context]):
+    matting_batch(ctxs, get_modnet_matting_batch, "hivision_modnet-int8", fix=True)
+
+
+def extract_human_modnet_photographic_portrait_matting_int8_batch(ctxs: List[Context]):
+    matting_batch(ctxs, get_modnet_matting_batch, "modnet_photographic_portrait_matting-int8")
+
+
+def extract_human_rmbg_int8_batch(ctxs: List[Context]):
+    matting_batch(ctxs, get_rmbg_matting_batch, "rmbg-1.4-int8")
+
+
+BATCH_HANDLERS = {
+    extract_human: extract_human_batch,
+    extract_human_modnet_photographic_portrait_matting: extract_human_modnet_photographic_portrait_matting_batch,
+    extract_human_rmbg: extract_human_rmbg_batch,
+    extract_human_birefnet_lite: extract_human_birefnet_lite_batch,
+    extract_human_int8: extract_human_int8_batch,
+    extract_human_modnet_photographic_portrait_matting_int8: extract_human_modnet_photographic_portrait_matting_int8_batch,
+    extract_human_rmbg_int8: extract_human_rmbg_int8_batch,
+}
+"""
+单图抠图处理器到批量处理器的映射，没有批量版本的处理器（如 MNN）会逐张调用
+"""
+
+MATTING_MODELS = {
+    extract_human: "hivision_modnet",
+    extract_human_modnet_photographic_portrait_matting: "modnet_photographic_portrait_matting",
+    extract_human_mnn_modnet: "mnn_hivision_modnet",
+    extract_human_rmbg: "rmbg-1.4",
+    extract_human_birefnet_lite: "birefnet-v1-lite",
+    extract_human_int8: "hivision_modnet-int8",
+    extract_human_modnet_photographic_portrait_matting_int8: "modnet_photographic_portrait_matting-int8",
+    extract_human_rmbg_int8: "rmbg-1.4-int8",
+}
+"""
+单图抠图处理器使用的模型（WEIGHTS 中的模型名）
+"""
+
+
 def hollow_out_fix(src: np.ndarray) -> np.ndarray:
     """
-    修补抠图区域，作为抠图模型精度不够的补充
-    :param src:
-    :return:
-    """
-    b, g, r, a = cv2.split(src)
-    src_bgr = cv2.merge((b, g, r))
-    # -----------padding---------- #
-    add_area = np.zeros((10, a.shape[1]), np.uint8)
-    a = np.vstack((add_area, a, add_area))
-    add_area = np.zeros((a.shape[0], 10), np.uint8)
-    a = np.hstack((add_area, a, add_area))
-    # -------------end------------ #
+    修补抠图区域，作为抠图模型精度不够的补充：
+    二值化并腐蚀后取最大连通区域，其外轮廓以内（不含轮廓附近一像素）的透明度补为 255
+    :param src: BGRA 抠图结果
+    :return: 修补后的 BGRA 图像，没有前景时原样返回
+    """
+    a = cv2.extractChannel(src, 3)
     _, a_threshold = cv2.threshold(a, 127, 255, 0)
+    # 图像外视为透明，效果与先补边再腐蚀相同
     a_erode = cv2.erode(
         a_threshold,
         kernel=cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5)),
         iterations=3,
+        borderType=cv2.BORDER_CONSTANT,
+        borderValue=0,
     )
-    contours, hierarchy = cv2.findContours(
-        a_erode, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE
+    analysis = MaskAnalysis(a_erode)
+    if analysis.bbox is None:
+        return src
+    filled = analysis.largest
+    # 去掉外轮廓及其四邻域，与沿外轮廓画 2 像素宽的线再从外部填充的结果一致
+    cross = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+    edge = cv2.subtract(
+        filled, cv2.erode(filled, cross, borderType=cv2.BORDER_CONSTANT, borderValue=0)
     )
-    contours = [x for x in contours]
-    # contours = np.squeeze(contours)
-    contours.sort(key=lambda c: cv2.contourArea(c), reverse=True)
-    a_contour = cv2.drawContours(np.zeros(a.shape, np.uint8), contours[0], -1, 255, 2)
-    # a_base = a_contour[1:-1, 1:-1]
-    h, w = a.shape[:2]
-    mask = np.zeros(
-        [h + 2, w + 2], np.uint8
-    )  # mask 必须行和列都加 2，且必须为 uint8 单通道阵列
-    cv2.floodFill(a_contour, mask=mask, seedPoint=(0, 0), newVal=255)
-    a = cv2.add(a, 255 - a_contour)
-    return cv2.merge((src_bgr, a[10:-10, 10:-10]))
+    interior = cv2.subtract(filled, cv2.dilate(edge, cross))
+    output = src.copy()
+    output[:, :, 3] = cv2.add(a, interior)
+    return output
 
 
 def image2bgr(input_image):
@@ -182,137 +459,277 @@ def image2bgr(input_image):
     return result_image
 
 
-def read_modnet_image(input_image, ref_size=512):
-    im = Image.fromarray(np.uint8(input_image))
-    width, length = im.size[0], im.size[1]
-    im = np.asarray(im)
-    im = image2bgr(im)
-    im = cv2.resize(im, (ref_size, ref_size), interpolation=cv2.INTER_AREA)
-    im = NNormalize(im, mean=np.array([0.5, 0.5, 0.5]), std=np.array([0.5, 0.5, 0.5]))
-    im = NUnsqueeze(NTo_Tensor(im))
-
-    return im, width, length
+MODNET_MEAN_STD = ((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))
+RMBG_MEAN_STD = ((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))
+BIREFNET_MEAN_STD = ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225))
+PIL_BILINEAR, PIL_BICUBIC = 2, 3
+"""
+PIL.Image.BILINEAR 和 PIL.Image.BICUBIC 的取值，PIL 只在预处理时导入
+"""
 
+_local = threading.local()
 
-def get_modnet_matting(input_image, checkpoint_path, ref_size=512):
-    global HIVISION_MODNET_SESS
 
-    if not os.path.exists(checkpoint_path):
-        print(f"Checkpoint file not found: {checkpoint_path}")
-        return None
+def get_input_buffer(batch, ref_size):
+    """
+    获取当前线程复用的 float32 输入缓冲区，形状为 (batch, 3, H, W)
+    onnxruntime 在 run 时会拷贝输入，因此推理结束后缓冲区可以直接复用
+    :param batch: 批大小
+    :param ref_size: 模型输入大小 (H, W)
+    """
+    pool = getattr(_local, "buffers", None)
+    if pool is None:
+        pool = _local.buffers = {}
+    buffer = pool.get(ref_size)
+    if buffer is None or buffer.shape[0] < batch:
+        buffer = pool[ref_size] = np.empty((batch, 3) + tuple(ref_size), np.float32)
+    return buffer[:batch]
 
-    # 如果RUN_MODE不是野兽模式，则不加载模型
-    if HIVISION_MODNET_SESS is None:
-        HIVISION_MODNET_SESS = load_onnx_model(checkpoint_path, set_cpu=True)
 
-    input_name = HIVISION_MODNET_SESS.get_inputs()[0].name
-    output_name = HIVISION_MODNET_SESS.get_outputs()[0].name
+def image_to_tensor(input_image, ref_size, mean_std, out, interpolation=None, resample=None):
+    """
+    resize、归一化和 HWC→CHW 一步完成，结果直接写入 out，不产生中间的 float64 数组
+    out = (resize(image) / 255 - mean) / std
+    :param input_image: uint8 图像
+    :param ref_size: 模型输入大小 (H, W)
+    :param mean_std: 归一化的 (mean, std)
+    :param out: (3, H, W) float32 输出
+    :param interpolation: 插值方式，None 表示缩小用 INTER_AREA、放大用 INTER_LINEAR
+    :param resample: PIL 的重采样方式，给出时用 PIL 缩放，与模型原有的预处理保持一致，此时忽略 interpolation
+    :return: out
+    """
+    image = image2bgr(input_image)
+    height, width = image.shape[:2]
+    if resample is not None:
+        from PIL import Image
+
+        resized = np.asarray(
+            Image.fromarray(np.ascontiguousarray(image, dtype=np.uint8)).resize(
+                (ref_size[1], ref_size[0]), resample
+            )
+        )
+        return normalize_to(resized, mean_std, out)
+    if interpolation is None:
+        interpolation = (
+            cv2.INTER_AREA
+            if height >= ref_size[0] and width >= ref_size[1]
+            else cv2.INTER_LINEAR
+        )
+    resized = cv2.resize(image, (ref_size[1], ref_size[0]), interpolation=interpolation)
+    return normalize_to(resized, mean_std, out)
 
-    im, width, length = read_modnet_image(input_image=input_image, ref_size=ref_size)
 
-    matte = HIVISION_MODNET_SESS.run([output_name], {input_name: im})
-    matte = (matte[0] * 255).astype("uint8")
-    matte = np.squeeze(matte)
-    mask = cv2.resize(matte, (width, length), interpolation=cv2.INTER_AREA)
-    b, g, r = cv2.split(np.uint8(input_image))
+def normalize_to(resized, mean_std, out):
+    """
+    out = (resized / 255 - mean) / std，同时完成 HWC→CHW
+    """
+    mean, std = (np.asarray(v, np.float32).reshape(3, 1, 1) for v in mean_std)
+    np.multiply(resized.transpose(2, 0, 1), 1 / (255 * std), out=out)
+    np.subtract(out, mean / std, out=out)
+    return out
 
-    output_image = cv2.merge((b, g, r, mask))
-    
-    # 如果RUN_MODE不是野兽模式，则释放模型
-    if os.getenv("RUN_MODE") != "beast":
-        HIVISION_MODNET_SESS = None
 
+def compose_matting_image(input_image, mask):
+    """
+    将与原图同尺寸的 uint8 matte 直接写入输出图像的透明通道，一次拷贝得到 BGRA 结果
+    """
+    image = image2bgr(input_image)
+    height, width = image.shape[:2]
+    output_image = np.empty((height, width, 4), np.uint8)
+    cv2.mixChannels(
+        [np.ascontiguousarray(image, dtype=np.uint8), mask],
+        [output_image],
+        [0, 0, 1, 1, 2, 2, 3, 3],
+    )
     return output_image
 
 
+def read_modnet_image(input_image, ref_size=512):
+    height, width = input_image.shape[:2]
+    im = np.empty((1, 3, ref_size, ref_size), np.float32)
+    image_to_tensor(
+        input_image, (ref_size, ref_size), MODNET_MEAN_STD, im[0], cv2.INTER_AREA
+    )
+
+    return im, width, height
+
+
+def run_onnx_batch(sess, meta, tensor, output_index=0):
+    """
+    对 (N,C,H,W) 的批量输入执行一次推理，再按张拆分输出
+    模型导出时若固定了 batch 维度，则退回逐张推理
+    :param sess: 模型会话
+    :param meta: 模型输入输出元信息
+    :param tensor: 预处理后的批量输入
+    :param output_index: 取第几个输出
+    :return: 每张图对应的输出 (1,...) 列表
+    """
+    batch_dim = meta.input_shapes[0][0] if meta.input_shapes[0] else None
+    if isinstance(batch_dim, int) or len(tensor) == 1:
+        return [
+            sess.run(None, {meta.input_name: tensor[i : i + 1]})[output_index]
+            for i in range(len(tensor))
+        ]
+    outputs = sess.run(None, {meta.input_name: tensor})
+    return np.split(outputs[output_index], len(tensor), axis=0)
+
+
+def get_modnet_matting(input_image, checkpoint_path, ref_size=512):
+    # 开启动态批处理时，与其他线程同时到达的请求合并推理
+    return SCHEDULER.run(get_modnet_matting_batch, input_image, checkpoint_path, ref_size)
+
+
 def get_modnet_matting_photographic_portrait_matting(
     input_image, checkpoint_path, ref_size=512
 ):
-    global MODNET_PHOTOGRAPHIC_PORTRAIT_MATTING_SESS
+    return SCHEDULER.run(get_modnet_matting_batch, input_image, checkpoint_path, ref_size)
+
 
+def get_modnet_matting_batch(input_images, checkpoint_path, ref_size=512):
+    """
+    MODNet 批量抠图，所有图像 resize 到 ref_size 后在一次推理中完成
+    :param input_images: BGR 图像列表
+    :return: BGRA 抠图结果列表
+    """
     if not os.path.exists(checkpoint_path):
         print(f"Checkpoint file not found: {checkpoint_path}")
         return None
 
-    # 如果RUN_MODE不是野兽模式，则不加载模型
-    if MODNET_PHOTOGRAPHIC_PORTRAIT_MATTING_SESS is None:
-        MODNET_PHOTOGRAPHIC_PORTRAIT_MATTING_SESS = load_onnx_model(
-            checkpoint_path, set_cpu=True
-        )
-
-    input_name = MODNET_PHOTOGRAPHIC_PORTRAIT_MATTING_SESS.get_inputs()[0].name
-    output_name = MODNET_PHOTOGRAPHIC_PORTRAIT_MATTING_SESS.get_outputs()[0].name
-
-    im, width, length = read_modnet_image(input_image=input_image, ref_size=ref_size)
+    sess, meta = get_onnx_session(checkpoint_path, set_cpu=True)
 
-    matte = MODNET_PHOTOGRAPHIC_PORTRAIT_MATTING_SESS.run(
-        [output_name], {input_name: im}
-    )
-    matte = (matte[0] * 255).astype("uint8")
-    matte = np.squeeze(matte)
-    mask = cv2.resize(matte, (width, length), interpolation=cv2.INTER_AREA)
-    b, g, r = cv2.split(np.uint8(input_image))
+    tensor = get_input_buffer(len(input_images), (ref_size, ref_size))
+    for i, input_image in enumerate(input_images):
+        image_to_tensor(
+            input_image, (ref_size, ref_size), MODNET_MEAN_STD, tensor[i], cv2.INTER_AREA
+        )
 
-    output_image = cv2.merge((b, g, r, mask))
-    
-    # 如果RUN_MODE不是野兽模式，则释放模型
-    if os.getenv("RUN_MODE") != "beast":
-        MODNET_PHOTOGRAPHIC_PORTRAIT_MATTING_SESS = None
+    output_images = []
+    for input_image, matte in zip(input_images, run_onnx_batch(sess, meta, tensor)):
+        matte = np.squeeze(matte * 255).astype(np.uint8)
+        output_images.append(resize_matte(input_image, matte, cv2.INTER_AREA))
 
-    return output_image
+    return output_images
 
 
 def get_rmbg_matting(input_image: np.ndarray, checkpoint_path, ref_size=1024):
-    global RMBG_SESS
+    return SCHEDULER.run(get_rmbg_matting_batch, input_image, checkpoint_path, ref_size)
+
 
+def get_rmbg_matting_batch(input_images, checkpoint_path, ref_size=1024):
+    """
+    RMBG 批量抠图，所有图像 resize 到 ref_size×ref_size 后在一次推理中完成
+    :param input_images: 图像列表
+    :return: 透明通道为 matte 的四通道图像列表
+    """
     if not os.path.exists(checkpoint_path):
         print(f"Checkpoint file not found: {checkpoint_path}")
         return None
 
-    def resize_rmbg_image(image):
-        image = image.convert("RGB")
-        model_input_size = (ref_size, ref_size)
-        image = image.resize(model_input_size, Image.BILINEAR)
-        return image
+    sess, meta = get_onnx_session(checkpoint_path, set_cpu=True)
 
-    if RMBG_SESS is None:
-        RMBG_SESS = load_onnx_model(checkpoint_path, set_cpu=True)
-
-    orig_image = Image.fromarray(input_image)
-    image = resize_rmbg_image(orig_image)
-    im_np = np.array(image).astype(np.float32)
-    im_np = im_np.transpose(2, 0, 1)  # Change to CxHxW format
-    im_np = np.expand_dims(im_np, axis=0)  # Add batch dimension
-    im_np = im_np / 255.0  # Normalize to [0, 1]
-    im_np = (im_np - 0.5) / 0.5  # Normalize to [-1, 1]
+    tensor = get_input_buffer(len(input_images), (ref_size, ref_size))
+    for i, input_image in enumerate(input_images):
+        # 与 RMBG 的原有预处理一致：PIL 双线性缩放，归一化到 [-1, 1]
+        image_to_tensor(
+            input_image, (ref_size, ref_size), RMBG_MEAN_STD, tensor[i], resample=PIL_BILINEAR
+        )
 
     # Inference
-    result = RMBG_SESS.run(None, {RMBG_SESS.get_inputs()[0].name: im_np})[0]
+    results = run_onnx_batch(sess, meta, tensor)
+
+    output_images = []
+    for input_image, result in zip(input_images, results):
+        # Post process: Normalize to [0, 255]
+        result = np.squeeze(result)
+        ma = np.max(result)
+        mi = np.min(result)
+        result = ((result - mi) * (255 / (ma - mi))).astype(np.uint8)
+        output_images.append(resize_matte(input_image, result))
 
-    # Post process
-    result = np.squeeze(result)
-    ma = np.max(result)
-    mi = np.min(result)
-    result = (result - mi) / (ma - mi)  # Normalize to [0, 1]
+    return output_images
 
-    # Convert to PIL image
-    im_array = (result * 255).astype(np.uint8)
-    pil_im = Image.fromarray(
-        im_array, mode="L"
-    )  # Ensure mask is single channel (L mode)
 
-    # Resize the mask to match the original image size
-    pil_im = pil_im.resize(orig_image.size, Image.BILINEAR)
+def resize_matte(input_image, matte, interpolation=cv2.INTER_LINEAR):
+    """
+    将模型输出的 uint8 matte 缩放到原图大小，并写入输出图像的透明通道
+    缩小用 INTER_AREA；放大时开启 MATTE_REFINEMENT 则见 refine_matte，否则用 interpolation 直接放大
+    """
+    height, width = input_image.shape[:2]
+    if height <= matte.shape[0] and width <= matte.shape[1]:
+        mask = cv2.resize(matte, (width, height), interpolation=cv2.INTER_AREA)
+    elif MATTE_REFINEMENT:
+        mask = refine_matte(input_image, matte)
+    else:
+        mask = cv2.resize(matte, (width, height), interpolation=interpolation)
+    return compose_matting_image(input_image, mask)
 
-    # Paste the mask on the original image
-    new_im = Image.new("RGBA", orig_image.size, (0, 0, 0, 0))
-    new_im.paste(orig_image, mask=pil_im)
-    
-    # 如果RUN_MODE不是野兽模式，则释放模型
-    if os.getenv("RUN_MODE") != "beast":
-        RMBG_SESS = None
 
-    return np.array(new_im)
+def refine_matte(input_image, matte, radius=2, eps=1e-4):
+    """
+    由低分辨率 matte 得到原图尺寸的透明通道：先双线性放大，再只在不确定的边缘带（透明度在 MATTE_BAND 范围内）中，
+    用快速导向滤波按原图的明暗细节修正透明度；前景内部和背景保持放大的结果，发丝等边缘更清晰
+    导向滤波的系数在 matte 的分辨率上计算，放大后只作用于边缘带的外接矩形
+    :param input_image: 原图
+    :param matte: 模型输出的 uint8 matte
+    :param radius: matte 分辨率上的滤波半径
+    :param eps: 正则项，越小越贴合原图边缘
+    :return: 与原图同尺寸的 uint8 透明通道
+    """
+    height, width = input_image.shape[:2]
+    alpha = cv2.resize(matte, (width, height), interpolation=cv2.INTER_LINEAR)
+    band = cv2.inRange(alpha, *MATTE_BAND)
+    x, y, w, h = cv2.boundingRect(band)
+    if w == 0 or h == 0:
+        return alpha
+
+    # 导向图用灰度图，系数 a、b 在 matte 分辨率上计算
+    gray = cv2.cvtColor(image2bgr(input_image), cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (matte.shape[1], matte.shape[0]), interpolation=cv2.INTER_AREA)
+    guide = small.astype(np.float32) * (1 / 255)
+    source = matte.astype(np.float32) * (1 / 255)
+    size = (2 * radius + 1, 2 * radius + 1)
+    mean_i = cv2.boxFilter(guide, -1, size)
+    mean_p = cv2.boxFilter(source, -1, size)
+    var_i = cv2.boxFilter(guide * guide, -1, size) - mean_i * mean_i
+    cov_ip = cv2.boxFilter(guide * source, -1, size) - mean_i * mean_p
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    mean_a = cv2.boxFilter(a, -1, size)
+    mean_b = cv2.boxFilter(b, -1, size)
+
+    # 只在边缘带的像素上插值系数并计算 q = a * I + b，插值与 cv2.resize 的像素中心对齐方式一致
+    ys, xs = np.nonzero(band[y : y + h, x : x + w])
+    ys += y
+    xs += x
+    map_x = (xs + 0.5) * (matte.shape[1] / width) - 0.5
+    map_y = (ys + 0.5) * (matte.shape[0] / height) - 0.5
+    mean_a = sample_points(mean_a, map_x, map_y)
+    mean_b = sample_points(mean_b, map_x, map_y)
+
+    # I 为 [0, 1] 的灰度，结果换算到 0~255
+    refined = mean_a * gray[ys, xs] + mean_b * 255
+    alpha[ys, xs] = np.clip(refined, 0, 255, out=refined).astype(np.uint8)
+    return alpha
+
+
+def sample_points(image, map_x, map_y, cols=1024):
+    """
+    在若干个浮点坐标上对单通道图像做双线性插值，返回一维结果
+    cv2.remap 的输出边长不能超过 32767，因此把坐标排成 cols 列的二维表
+    """
+    count = len(map_x)
+    rows = -(-count // cols)
+    maps = np.zeros((2, rows * cols), np.float32)
+    maps[0, :count] = map_x
+    maps[1, :count] = map_y
+    values = cv2.remap(
+        image,
+        maps[0].reshape(rows, cols),
+        maps[1].reshape(rows, cols),
+        cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_REPLICATE,
+    )
+    return values.reshape(-1)[:count]
 
 
 def get_mnn_modnet_matting(input_image, checkpoint_path, ref_size=512):
@@ -343,53 +760,45 @@ def get_mnn_modnet_matting(input_image, checkpoint_path, ref_size=512):
     matte = matte.read()  # var转换为np
     matte = (matte * 255).astype("uint8")
     matte = np.squeeze(matte)
-    mask = cv2.resize(matte, (width, length), interpolation=cv2.INTER_AREA)
-    b, g, r = cv2.split(np.uint8(input_image))
 
-    output_image = cv2.merge((b, g, r, mask))
+    return resize_matte(input_image, matte, cv2.INTER_AREA)
 
-    return output_image
 
+def get_birefnet_portrait_matting(input_image, checkpoint_path, ref_size=1024):
+    return SCHEDULER.run(
+        get_birefnet_portrait_matting_batch, input_image, checkpoint_path, ref_size
+    )
 
-def get_birefnet_portrait_matting(input_image, checkpoint_path, ref_size=512):
-    global BIREFNET_V1_LITE_SESS
 
+def get_birefnet_portrait_matting_batch(input_images, checkpoint_path, ref_size=1024):
+    """
+    BiRefNet 批量抠图，所有图像 resize 到 ref_size×ref_size 后在一次推理中完成
+    :param input_images: 图像列表
+    :return: 透明通道为 matte 的四通道图像列表
+    """
     if not os.path.exists(checkpoint_path):
         print(f"Checkpoint file not found: {checkpoint_path}")
         return None
 
-    def transform_image(image):
-        image = image.resize((1024, 1024))  # Resize to 1024x1024
-        image = (
-            np.array(image, dtype=np.float32) / 255.0
-        )  # Convert to numpy array and normalize to [0, 1]
-        image = (image - [0.485, 0.456, 0.406]) / [0.229, 0.224, 0.225]  # Normalize
-        image = np.transpose(image, (2, 0, 1))  # Change from (H, W, C) to (C, H, W)
-        image = np.expand_dims(image, axis=0)  # Add batch dimension
-        return image.astype(np.float32)  # Ensure the output is float32
-
-    orig_image = Image.fromarray(input_image)
-    input_images = transform_image(
-        orig_image
-    )  # This will already have the correct shape
+    tensor = get_input_buffer(len(input_images), (ref_size, ref_size))
+    for i, input_image in enumerate(input_images):
+        # 与 BiRefNet 的原有预处理一致：PIL 默认的双三次缩放
+        image_to_tensor(
+            input_image, (ref_size, ref_size), BIREFNET_MEAN_STD, tensor[i], resample=PIL_BICUBIC
+        )
 
     # 记录加载onnx模型的开始时间
     load_start_time = time()
 
-    # 如果RUN_MODE不是野兽模式，则不加载模型
-    if BIREFNET_V1_LITE_SESS is None:
-        # print("首次加载birefnet-v1-lite模型...")
-        if ONNX_DEVICE == "GPU":
-            print("onnxruntime-gpu已安装，尝试使用CUDA加载模型")
-            try:
-                import torch
-            except ImportError:
-                print(
-                    "torch未安装，尝试直接使用onnxruntime-gpu加载模型，这需要配置好CUDA和cuDNN"
-                )
-            BIREFNET_V1_LITE_SESS = load_onnx_model(checkpoint_path)
-        else:
-            BIREFNET_V1_LITE_SESS = load_onnx_model(checkpoint_path, set_cpu=True)
+    if not REGISTRY.is_loaded(checkpoint_path) and get_device() == "GPU":
+        print("onnxruntime-gpu已安装，尝试使用CUDA加载模型")
+        try:
+            import torch
+        except ImportError:
+            print(
+                "torch未安装，尝试直接使用onnxruntime-gpu加载模型，这需要配置好CUDA和cuDNN"
+            )
+    sess, meta = get_onnx_session(checkpoint_path, set_cpu=get_device() != "GPU")
 
     # 记录加载onnx模型的结束时间
     load_end_time = time()
@@ -397,32 +806,21 @@ def get_birefnet_portrait_matting(input_image, checkpoint_path, ref_size=512):
     # 打印加载onnx模型所花的时间
     print(f"Loading ONNX model took {load_end_time - load_start_time:.4f} seconds")
 
-    input_name = BIREFNET_V1_LITE_SESS.get_inputs()[0].name
-    print(onnxruntime.get_device(), BIREFNET_V1_LITE_SESS.get_providers())
+    print(get_device(), sess.get_providers())
 
     time_st = time()
-    pred_onnx = BIREFNET_V1_LITE_SESS.run(None, {input_name: input_images})[
-        -1
-    ]  # Use float32 input
-    pred_onnx = np.squeeze(pred_onnx)  # Use numpy to squeeze
-    result = 1 / (1 + np.exp(-pred_onnx))  # Sigmoid function using numpy
+    preds = run_onnx_batch(sess, meta, tensor, output_index=-1)
     print(f"Inference time: {time() - time_st:.4f} seconds")
 
-    # Convert to PIL image
-    im_array = (result * 255).astype(np.uint8)
-    pil_im = Image.fromarray(
-        im_array, mode="L"
-    )  # Ensure mask is single channel (L mode)
-
-    # Resize the mask to match the original image size
-    pil_im = pil_im.resize(orig_image.size, Image.BILINEAR)
-
-    # Paste the mask on the original image
-    new_im = Image.new("RGBA", orig_image.size, (0, 0, 0, 0))
-    new_im.paste(orig_image, mask=pil_im)
-    
-    # 如果RUN_MODE不是野兽模式，则释放模型
-    if os.getenv("RUN_MODE") != "beast":
-        BIREFNET_V1_LITE_SESS = None
-
-    return np.array(new_im)
+    output_images = []
+    for input_image, pred_onnx in zip(input_images, preds):
+        # Sigmoid function, computed in place
+        result = np.squeeze(pred_onnx)
+        np.negative(result, out=result)
+        np.exp(result, out=result)
+        result += 1
+        np.reciprocal(result, out=result)
+        result *= 255
+        output_images.append(resize_matte(input_image, result.astype(np.uint8)))
+
+    return output_images
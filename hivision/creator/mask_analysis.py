@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+r"""
+@DATE: 2026/10/18 00:20
+@File: mask_analysis.py
+@IDE: pycharm
+@Description:
+    透明通道分析：二值化、最大连通区域、行列占用投影和外接矩形只计算一次，
+    hollow_out_fix、get_box 和图像调整中的多次取框都从同一个分析结果读取，不再反复拆分通道和二值化；
+    最大连通区域由一次连通区域标记得到，外接矩形由它的行列投影得到，不追踪轮廓
+"""
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+class MaskAnalysis:
+    """
+    单个透明通道的分析结果，各项在第一次使用时计算
+    """
+
+    def __init__(self, alpha: np.ndarray, thresh: int = 127, binary: np.ndarray = None):
+        """
+        :param alpha: uint8 透明通道
+        :param thresh: 二值化阈值，大于该值的像素视为前景
+        :param binary: 已经按 thresh 二值化的结果，None 表示在需要时计算
+        """
+        self.alpha = alpha
+        self.thresh = thresh
+        self._binary: Optional[np.ndarray] = binary
+        self._component: Optional[np.ndarray] = None
+        self._largest: Optional[np.ndarray] = None
+        self._rows: Optional[np.ndarray] = None
+        self._cols: Optional[np.ndarray] = None
+        self._crops: Dict[Tuple[int, int, int, int], Optional[Tuple[int, int, int, int]]] = {}
+
+    @property
+    def binary(self) -> np.ndarray:
+        """
+        二值化的前景，0 或 255
+        """
+        if self._binary is None:
+            _, self._binary = cv2.threshold(self.alpha, self.thresh, 255, cv2.THRESH_BINARY)
+        return self._binary
+
+    @property
+    def component(self) -> np.ndarray:
+        """
+        面积最大的前景连通区域（8 邻域），0 或 255；没有前景时全为 0
+        只做一次连通区域标记，之后的外接矩形都由该区域的行列投影得到
+        """
+        if self._component is None:
+            self._component = np.zeros_like(self.binary)
+            # 只在前景的外接矩形内标记，透明的背景不参与
+            x, y, w, h = cv2.boundingRect(self.binary)
+            if w > 0 and h > 0:
+                count, labels, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(
+                    self.binary[y : y + h, x : x + w], 8, cv2.CV_32S, cv2.CCL_GRANA
+                )
+                label = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+                cv2.compare(labels, label, cv2.CMP_EQ, dst=self._component[y : y + h, x : x + w])
+        return self._component
+
+    @property
+    def largest(self) -> np.ndarray:
+        """
+        最大前景连通区域连同其内部的空洞（外轮廓围成的区域），0 或 255；没有前景时全为 0
+        空洞为从图像边缘出发（4 邻域）到达不了的背景
+        """
+        if self._largest is None:
+            component = self.component
+            outside = cv2.copyMakeBorder(component, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+            cv2.floodFill(outside, None, (0, 0), 255)
+            # outside 中仍为 0 的像素是空洞
+            self._largest = cv2.bitwise_or(component, cv2.bitwise_not(outside[1:-1, 1:-1]))
+        return self._largest
+
+    @property
+    def rows(self) -> np.ndarray:
+        """
+        最大前景区域的行占用投影，每行的前景像素数
+        """
+        if self._rows is None:
+            self._rows = occupancy(self.component, 1)
+        return self._rows
+
+    @property
+    def cols(self) -> np.ndarray:
+        """
+        最大前景区域的列占用投影，每列的前景像素数
+        """
+        if self._cols is None:
+            self._cols = occupancy(self.component, 0)
+        return self._cols
+
+    @property
+    def bbox(self) -> Optional[Tuple[int, int, int, int]]:
+        """
+        最大前景区域的外接矩形 (x, y, w, h)，由行列投影得到；没有前景时为 None
+        """
+        return projection_rect(self.rows, self.cols)
+
+    def rect_in(self, x1: int, y1: int, x2: int, y2: int) -> Optional[Tuple[int, int, int, int]]:
+        """
+        最大前景区域落在裁剪框 (x1, y1, x2, y2) 内部分的外接矩形，坐标相对于裁剪框左上角；
+        由该区域在裁剪框内的行列投影得到，不再对裁剪框重新二值化或标记连通区域，结果按裁剪框缓存。
+        裁剪框可以超出图像范围，超出部分视为透明
+        :return: (x, y, w, h)，裁剪框内没有前景时为 None
+        """
+        box = (x1, y1, x2, y2)
+        if box not in self._crops:
+            height, width = self.alpha.shape[:2]
+            left, top = max(0, x1), max(0, y1)
+            right, bottom = min(width, x2), min(height, y2)
+            rect = None
+            if left < right and top < bottom:
+                region = self.component[top:bottom, left:right]
+                rect = projection_rect(occupancy(region, 1), occupancy(region, 0))
+            if rect is not None:
+                x, y, w, h = rect
+                rect = x + left - x1, y + top - y1, w, h
+            self._crops[box] = rect
+        return self._crops[box]
+
+
+def occupancy(mask: np.ndarray, dim: int) -> np.ndarray:
+    """
+    0/255 掩码的占用投影：dim=1 为每行的前景像素数，dim=0 为每列的前景像素数
+    """
+    return cv2.reduce(mask, dim, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel() // 255
+
+
+def projection_rect(rows: np.ndarray, cols: np.ndarray) -> Optional[Tuple[int, int, int, int]]:
+    """
+    由行列占用投影得到外接矩形 (x, y, w, h)，投影全为 0 时返回 None
+    """
+    ys = np.flatnonzero(rows)
+    xs = np.flatnonzero(cols)
+    if len(ys) == 0 or len(xs) == 0:
+        return None
+    return int(xs[0]), int(ys[0]), int(xs[-1] - xs[0] + 1), int(ys[-1] - ys[0] + 1)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+r"""
+@DATE: 2026/10/17 23:20
+@File: matting_cache.py
+@IDE: pycharm
+@Description:
+    抠图结果缓存：以 (图像内容哈希, 抠图模型, 处理分辨率) 为键缓存抠图得到的透明通道，
+    只修改尺寸、面部比例等参数重新生成证件照时，同一张照片不再重复抠图
+    内存中按 LRU 保留，总字节数不超过预算；可选的磁盘缓存在程序重启后仍然有效，超出容量时删除最久未使用的文件
+    锁只保护内存中的数据，磁盘读写、PNG 编解码和目录扫描都在锁外进行
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import cv2
+import numpy as np
+
+
+class MattingCache:
+    """
+    两级抠图缓存，值为与处理图像同尺寸的 uint8 透明通道
+    """
+
+    def __init__(self, memory_limit: int = 256 * 1024**2, disk_dir: str = None, disk_limit: int = 1024**3):
+        """
+        :param memory_limit: 内存缓存上限（字节），<=0 表示不使用内存缓存
+        :param disk_dir: 磁盘缓存目录，None 表示不使用磁盘缓存
+        :param disk_limit: 磁盘缓存上限（字节）
+        """
+        self.memory_limit = memory_limit
+        self.disk_dir = disk_dir
+        self.disk_limit = disk_limit
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._memory_usage = 0
+        self._disk_usage = None
+        self._trimming = False
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, memory_limit: int = None, disk_dir: str = None, disk_limit: int = None):
+        with self._lock:
+            if memory_limit is not None:
+                self.memory_limit = memory_limit
+                self._trim_memory()
+            if disk_dir is not None:
+                self.disk_dir = disk_dir or None
+                self._disk_usage = None
+            if disk_limit is not None:
+                self.disk_limit = disk_limit
+
+    @staticmethod
+    def key(image: np.ndarray, checkpoint_path: str, ref_size: int, variant: str = "") -> str:
+        """
+        缓存键：图像尺寸和像素内容的哈希、模型名与权重文件版本（大小和修改时间）、模型输入尺寸
+        :param variant: 后处理方式的标识，后处理不同的结果不共用缓存
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(str((image.shape, image.dtype.str)).encode())
+        digest.update(np.ascontiguousarray(image).data)
+        if variant:
+            digest.update(variant.encode())
+        name = os.path.splitext(os.path.basename(checkpoint_path))[0]
+        try:
+            stat = os.stat(checkpoint_path)
+            digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+        except OSError:
+            pass
+        return f"{name}-{ref_size}-{digest.hexdigest()}"
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            alpha = self._memory.get(key)
+            if alpha is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return alpha
+
+        # 磁盘读取和 PNG 解码在锁外进行，不阻塞其他线程
+        alpha = self._read_disk(key)
+        with self._lock:
+            if alpha is None:
+                self.misses += 1
+                return None
+            self._put_memory(key, alpha)
+            self.hits += 1
+            return alpha
+
+    def put(self, key: str, alpha: np.ndarray):
+        alpha = np.ascontiguousarray(alpha)
+        alpha.flags.writeable = False
+        with self._lock:
+            self._put_memory(key, alpha)
+        self._write_disk(key, alpha)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_usage = 0
+
+    def stats(self) -> dict:
+        disk_dir = self.disk_dir
+        if disk_dir and self._disk_usage is None:
+            usage = self._scan_disk(disk_dir)
+            with self._lock:
+                if self._disk_usage is None:
+                    self._disk_usage = usage
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_items": len(self._memory),
+                "memory_mb": round(self._memory_usage / 1024**2, 1),
+                "disk_mb": round((self._disk_usage or 0) / 1024**2, 1),
+            }
+
+    def _put_memory(self, key: str, alpha: np.ndarray):
+        if alpha.nbytes > self.memory_limit:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_usage -= old.nbytes
+        self._memory[key] = alpha
+        self._memory_usage += alpha.nbytes
+        self._trim_memory()
+
+    def _trim_memory(self):
+        while self._memory and self._memory_usage > self.memory_limit:
+            _, alpha = self._memory.popitem(last=False)
+            self._memory_usage -= alpha.nbytes
+
+    def _read_disk(self, key: str) -> Optional[np.ndarray]:
+        disk_dir = self.disk_dir
+        if not disk_dir:
+            return None
+        path = os.path.join(disk_dir, f"{key}.png")
+        if not os.path.isfile(path):
+            return None
+        alpha = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        if alpha is None or alpha.ndim != 2:
+            # 文件损坏，删除后按未命中处理
+            self._remove_disk(path)
+            return None
+        # 用修改时间记录最近使用，淘汰时删除最久未使用的文件；只读或共享的缓存目录中无法修改时忽略
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        alpha.flags.writeable = False
+        return alpha
+
+    def _write_disk(self, key: str, alpha: np.ndarray):
+        disk_dir = self.disk_dir
+        if not disk_dir:
+            return
+        try:
+            os.makedirs(disk_dir, exist_ok=True)
+            _, buffer = cv2.imencode(".png", alpha, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+            path = os.path.join(disk_dir, f"{key}.png")
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            buffer.tofile(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Failed to write matting cache {disk_dir}: {e}")
+            return
+        # 容量统计在锁内更新；超出上限时由一个线程在锁外扫描并删除旧文件
+        with self._lock:
+            if self._disk_usage is not None:
+                self._disk_usage += buffer.nbytes
+            trim = (self._disk_usage is None or self._disk_usage > self.disk_limit) and not self._trimming
+            if trim:
+                self._trimming = True
+        if not trim:
+            return
+        usage = None
+        try:
+            usage = self._scan_disk(disk_dir)
+            if usage > self.disk_limit:
+                usage = self._trim_disk(disk_dir)
+        finally:
+            with self._lock:
+                self._disk_usage = usage
+                self._trimming = False
+
+    @staticmethod
+    def _scan_disk(disk_dir: str) -> int:
+        return sum(entry.stat().st_size for entry in MattingCache._disk_entries(disk_dir))
+
+    @staticmethod
+    def _disk_entries(disk_dir: str):
+        if not os.path.isdir(disk_dir):
+            return []
+        return [entry for entry in os.scandir(disk_dir) if entry.name.endswith(".png")]
+
+    def _trim_disk(self, disk_dir: str) -> int:
+        """
+        按修改时间从旧到新删除缓存文件，直到总大小不超过上限
+        :return: 删除后的总大小
+        """
+        entries = sorted(self._disk_entries(disk_dir), key=lambda entry: entry.stat().st_mtime)
+        usage = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if usage <= self.disk_limit:
+                break
+            usage -= entry.stat().st_size
+            self._remove_disk(entry.path)
+        return usage
+
+    @staticmethod
+    def _remove_disk(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+MATTING_CACHE = MattingCache(
+    memory_limit=int(float(os.getenv("HIVISION_MATTING_CACHE_MB", 256)) * 1024**2),
+    disk_dir=os.getenv("HIVISION_MATTING_CACHE_DIR") or None,
+    disk_limit=int(float(os.getenv("HIVISION_MATTING_CACHE_DISK_MB", 1024)) * 1024**2),
+)
+"""
+全局抠图缓存：
+- HIVISION_MATTING_CACHE_MB: 内存缓存上限（MB），默认 256，0 表示不缓存
+- HIVISION_MATTING_CACHE_DIR: 磁盘缓存目录，默认不使用磁盘缓存
+- HIVISION_MATTING_CACHE_DISK_MB: 磁盘缓存上限（MB），默认 1024
+"""
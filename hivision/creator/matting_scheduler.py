@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+r"""
+@DATE: 2026/10/17 22:50
+@File: matting_scheduler.py
+@IDE: pycharm
+@Description:
+    抠图请求的动态批处理：多个线程同时抠图时（HTTP 服务的工作线程、批处理任务等），
+    把短时间内到达的同一模型的请求合并成一次批量推理，再把结果分别交还给各自的调用方
+
+    默认关闭，通过 HIVISION_MATTING_BATCH_WAIT（毫秒）或 SCHEDULER.configure 开启
+"""
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future
+from time import monotonic
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+BatchFunction = Callable[[List[np.ndarray], str, int], Optional[List[np.ndarray]]]
+"""
+批量抠图函数 (图像列表, 权重路径, 输入尺寸) -> 抠图结果列表，如 get_modnet_matting_batch
+"""
+
+
+class _BatchQueue:
+    """
+    单个模型（批量函数、权重、输入尺寸）的请求队列和调度线程
+    """
+
+    def __init__(self, scheduler: "MattingScheduler", batch_fn: BatchFunction, checkpoint_path: str, ref_size: int):
+        self.scheduler = scheduler
+        self.batch_fn = batch_fn
+        self.checkpoint_path = checkpoint_path
+        self.ref_size = ref_size
+        self.pending = deque()
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(
+            target=self._loop,
+            name=f"hivision-matting-batch-{os.path.basename(checkpoint_path)}",
+            daemon=True,
+        )
+        self.thread.start()
+
+    def submit(self, image: np.ndarray) -> Future:
+        future = Future()
+        with self.cond:
+            self.pending.append((monotonic(), image, future))
+            self.cond.notify()
+        return future
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                # 从第一个请求到达开始计时，凑满一批或等待超时后立即推理
+                deadline = self.pending[0][0] + self.scheduler.max_wait
+                while len(self.pending) < self.scheduler.max_batch:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                count = min(len(self.pending), self.scheduler.max_batch)
+                batch = [self.pending.popleft() for _ in range(count)]
+            self._run(batch)
+
+    def _run(self, batch: List[Tuple[float, np.ndarray, Future]]):
+        # 调用方已取消的请求不参与推理
+        batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            outputs = self.batch_fn([image for _, image, _ in batch], self.checkpoint_path, self.ref_size)
+        except BaseException as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        self.scheduler._record(len(batch))
+        for index, (_, _, future) in enumerate(batch):
+            future.set_result(None if outputs is None else outputs[index])
+
+
+class MattingScheduler:
+    """
+    抠图请求调度器，每个模型有自己的请求队列；max_wait 为单个请求最多等待多久（秒）来凑成一批
+    """
+
+    def __init__(self, max_batch: int = 4, max_wait: float = 0.0):
+        """
+        :param max_batch: 单次推理的最大图像数
+        :param max_wait: 等待凑批的最长时间（秒），<=0 表示关闭批处理，每次调用直接推理
+        """
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queues: Dict[tuple, _BatchQueue] = {}
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._largest = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_wait > 0 and self.max_batch > 1
+
+    def configure(self, max_batch: int = None, max_wait: float = None):
+        """
+        修改批处理参数，对之后的请求立即生效
+        """
+        if max_batch is not None:
+            self.max_batch = max(1, int(max_batch))
+        if max_wait is not None:
+            self.max_wait = max(0.0, float(max_wait))
+
+    def submit(self, batch_fn: BatchFunction, image: np.ndarray, checkpoint_path: str, ref_size: int) -> Future:
+        """
+        提交单张图像的抠图请求
+        :return: Future，结果为该图像的抠图结果（权重不存在时为 None）
+        """
+        key = (batch_fn, checkpoint_path, ref_size)
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = _BatchQueue(self, batch_fn, checkpoint_path, ref_size)
+        return queue.submit(image)
+
+    def run(self, batch_fn: BatchFunction, image: np.ndarray, checkpoint_path: str, ref_size: int):
+        """
+        单张图像抠图：开启批处理时经调度器合并推理，否则直接调用批量函数
+        """
+        if self.enabled:
+            return self.submit(batch_fn, image, checkpoint_path, ref_size).result()
+        output_images = batch_fn([image], checkpoint_path, ref_size)
+        return None if output_images is None else output_images[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "max_batch": self.max_batch,
+                "max_wait_ms": round(self.max_wait * 1000, 1),
+                "batches": self._batches,
+                "requests": self._requests,
+                "avg_batch": round(self._requests / self._batches, 2) if self._batches else None,
+                "largest_batch": self._largest,
+            }
+
+    def _record(self, size: int):
+        with self._lock:
+            self._batches += 1
+            self._requests += size
+            self._largest = max(self._largest, size)
+
+
+SCHEDULER = MattingScheduler(
+    max_batch=int(os.getenv("HIVISION_MATTING_MAX_BATCH", 4)),
+    max_wait=float(os.getenv("HIVISION_MATTING_BATCH_WAIT", 0)) / 1000,
+)
+"""
+全局抠图调度器：
+- HIVISION_MATTING_BATCH_WAIT: 等待凑批的最长时间（毫秒），默认 0 表示关闭
+- HIVISION_MATTING_MAX_BATCH: 单次推理的最大图像数，默认 4
+"""
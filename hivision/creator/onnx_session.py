@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+r"""
+@DATE: 2026/10/17 14:05
+@File: onnx_session.py
+@IDE: pycharm
+@Description:
+    ONNX Runtime 会话创建：按模型读取 SessionOptions 配置，并缓存优化后的计算图
+"""
+import hashlib
+import json
+import os
+from functools import lru_cache
+from typing import List, Optional
+
+
+DEFAULT_PROFILE = {
+    "intra_op_num_threads": 0,
+    "inter_op_num_threads": 0,
+    "graph_optimization_level": "all",
+    "execution_mode": "sequential",
+    "enable_cpu_mem_arena": True,
+    "enable_mem_pattern": True,
+    "optimized_model_cache": True,
+    "cache_dir": None,
+}
+"""
+默认配置，线程数为 0 表示由 onnxruntime 自行决定；cache_dir 为 None 时缓存在权重文件旁的 .ort_cache 目录
+"""
+
+ENV_PROFILE = {
+    "HIVISION_ORT_INTRA_THREADS": ("intra_op_num_threads", int),
+    "HIVISION_ORT_INTER_THREADS": ("inter_op_num_threads", int),
+    "HIVISION_ORT_OPT_LEVEL": ("graph_optimization_level", str),
+    "HIVISION_ORT_EXECUTION_MODE": ("execution_mode", str),
+    "HIVISION_ORT_CPU_ARENA": ("enable_cpu_mem_arena", lambda v: v != "0"),
+    "HIVISION_ORT_CACHE": ("optimized_model_cache", lambda v: v != "0"),
+    "HIVISION_ORT_CACHE_DIR": ("cache_dir", str),
+}
+
+_overrides = {}
+
+
+def set_session_profile(model_name: str = "default", **profile):
+    """
+    在代码中覆盖会话配置，优先级高于配置文件和环境变量，只影响之后新建的会话
+    例如多进程批处理时，每个进程设置 intra_op_num_threads=cpu_count // workers
+    :param model_name: 模型名（权重文件名去掉扩展名），default 表示所有模型
+    :param profile: DEFAULT_PROFILE 中的配置项
+    """
+    unknown = set(profile) - set(DEFAULT_PROFILE)
+    if unknown:
+        raise ValueError(f"Unknown session options: {', '.join(sorted(unknown))}")
+    _overrides.setdefault(model_name, {}).update(profile)
+
+
+def _load_config_file() -> dict:
+    """
+    读取 HIVISION_ORT_CONFIG 指定的 JSON 配置文件，格式为 {"default": {...}, "<模型名>": {...}}
+    """
+    path = os.getenv("HIVISION_ORT_CONFIG", "ort_config.json")
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"读取 ONNX Runtime 配置失败: {str(e)}")
+        return {}
+
+
+def get_session_profile(model_name: str) -> dict:
+    """
+    合并得到模型的会话配置，优先级：代码覆盖 > 环境变量 > 配置文件中的模型配置 > 配置文件中的 default > 默认值
+    """
+    config = _load_config_file()
+    profile = dict(DEFAULT_PROFILE)
+    profile.update(config.get("default", {}))
+    profile.update(config.get(model_name, {}))
+    for env, (key, cast) in ENV_PROFILE.items():
+        value = os.getenv(env)
+        if value:
+            profile[key] = cast(value)
+    profile.update(_overrides.get("default", {}))
+    profile.update(_overrides.get(model_name, {}))
+    return profile
+
+
+@lru_cache(maxsize=None)
+def get_device() -> str:
+    """
+    onnxruntime 的推理设备（CPU 或 GPU），第一次调用时才导入 onnxruntime
+    """
+    import onnxruntime
+
+    return onnxruntime.get_device()
+
+
+def get_provider() -> str:
+    """
+    与推理设备对应的默认执行后端
+    """
+    return "CUDAExecutionProvider" if get_device() == "GPU" else "CPUExecutionProvider"
+
+
+def build_session_options(profile: dict):
+    import onnxruntime
+
+    levels = {
+        "disable": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    modes = {
+        "sequential": onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+        "parallel": onnxruntime.ExecutionMode.ORT_PARALLEL,
+    }
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = int(profile["intra_op_num_threads"])
+    options.inter_op_num_threads = int(profile["inter_op_num_threads"])
+    options.graph_optimization_level = levels[profile["graph_optimization_level"]]
+    options.execution_mode = modes[profile["execution_mode"]]
+    options.enable_cpu_mem_arena = bool(profile["enable_cpu_mem_arena"])
+    options.enable_mem_pattern = bool(profile["enable_mem_pattern"])
+    return options
+
+
+def optimized_model_path(checkpoint_path: str, profile: dict) -> Optional[str]:
+    """
+    优化后模型的缓存路径，由源模型的大小、修改时间、优化级别和 onnxruntime 版本决定，
+    任一变化都会生成新的缓存文件；缓存目录不可写时返回 None
+    """
+    import onnxruntime
+
+    cache_dir = profile["cache_dir"] or os.path.join(
+        os.path.dirname(os.path.abspath(checkpoint_path)), ".ort_cache"
+    )
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+    except OSError:
+        return None
+    if not os.access(cache_dir, os.W_OK):
+        return None
+
+    stat = os.stat(checkpoint_path)
+    key = hashlib.md5(
+        "|".join(
+            [
+                os.path.abspath(checkpoint_path),
+                str(stat.st_size),
+                str(int(stat.st_mtime)),
+                profile["graph_optimization_level"],
+                onnxruntime.__version__,
+            ]
+        ).encode("utf-8")
+    ).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(checkpoint_path))[0]
+    return os.path.join(cache_dir, f"{name}.{key}.onnx")
+
+
+def create_session(checkpoint_path: str, providers: List[str]):
+    """
+    按模型配置创建 InferenceSession
+    仅使用 CPU 时启用优化图缓存：首次创建时把 basic/extended 级别优化后的计算图写入缓存，
+    之后直接加载缓存，只需再做与硬件相关的布局优化（all 级别），不再重复前面的图变换
+    :param checkpoint_path: 模型权重路径
+    :param providers: onnxruntime 执行后端列表
+    :return: InferenceSession
+    """
+    import onnxruntime
+
+    model_name = os.path.splitext(os.path.basename(checkpoint_path))[0]
+    profile = get_session_profile(model_name)
+
+    cache_path = None
+    if (
+        profile["optimized_model_cache"]
+        and profile["graph_optimization_level"] != "disable"
+        and providers == ["CPUExecutionProvider"]
+    ):
+        cache_path = optimized_model_path(checkpoint_path, profile)
+
+    if cache_path and not os.path.isfile(cache_path):
+        # all 级别的布局优化与 CPU 指令集相关，缓存中只保存到 extended 级别
+        save_profile = dict(profile)
+        if save_profile["graph_optimization_level"] == "all":
+            save_profile["graph_optimization_level"] = "extended"
+        save_options = build_session_options(save_profile)
+        # 先写临时文件再改名，避免多个进程同时写入时读到不完整的缓存
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        save_options.optimized_model_filepath = tmp_path
+        try:
+            onnxruntime.InferenceSession(
+                checkpoint_path, sess_options=save_options, providers=providers
+            )
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            print(f"Failed to write optimized model cache {cache_path}: {e}")
+            cache_path = None
+
+    if cache_path:
+        try:
+            return onnxruntime.InferenceSession(
+                cache_path,
+                sess_options=build_session_options(profile),
+                providers=providers,
+            )
+        except Exception as e:
+            print(f"Failed to load optimized model cache {cache_path}: {e}")
+
+    return onnxruntime.InferenceSession(
+        checkpoint_path, sess_options=build_session_options(profile), providers=providers
+    )
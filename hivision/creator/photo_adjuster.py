@@ -7,7 +7,8 @@ r"""
 @Description:
     证件照调整
 """
-from .context import Context
+from .context import Context, Params
+from .mask_analysis import MaskAnalysis
 from .layout_calculator import generate_layout_array
 import hivision.creator.utils as U
 import numpy as np
@@ -25,34 +26,15 @@ def adjust_photo(ctx: Context):
     height, width = ctx.matting_image.shape[:2]
     width_height_ratio = standard_size[1] / standard_size[0]
     # Step2. 计算高级参数
-    face_center = (x + w / 2, y + h / 2)  # 面部中心坐标
-    face_measure = w * h  # 面部面积
-    crop_measure = (
-        face_measure / params.head_measure_ratio
-    )  # 裁剪框面积：为面部面积的 5 倍
-    resize_ratio = crop_measure / (standard_size[0] * standard_size[1])  # 裁剪框缩放率
-    resize_ratio_single = math.sqrt(
-        resize_ratio
-    )  # 长和宽的缩放率（resize_ratio 的开方）
-    crop_size = (
-        int(standard_size[0] * resize_ratio_single),
-        int(standard_size[1] * resize_ratio_single),
-    )  # 裁剪框大小
-
-    # 裁剪框的定位信息
-    x1 = int(face_center[0] - crop_size[1] / 2)
-    y1 = int(face_center[1] - crop_size[0] * params.head_height_ratio)
-    y2 = y1 + crop_size[0]
-    x2 = x1 + crop_size[1]
+    x1, y1, x2, y2, crop_size = crop_box(face_rect, params)
 
-    # Step3, 裁剪框的调整
-    cut_image = IDphotos_cut(x1, y1, x2, y2, ctx.matting_image)
-    cut_image = cv2.resize(cut_image, (crop_size[1], crop_size[0]))
-    y_top, y_bottom, x_left, x_right = U.get_box(
-        cut_image.astype(np.uint8), model=2, correction_factor=0
-    )  # 得到 cut_image 中人像的上下左右距离信息
+    # Step3. 裁剪框中人像与四边的距离，直接在抠图的透明通道上测量，不生成裁剪图
+    analysis = ctx.mask_analysis
+    y_top, y_bottom, x_left, x_right = crop_edges(
+        analysis, x1, y1, x2, y2
+    )  # 得到裁剪框中人像的上下左右距离信息
 
-    # Step5. 判定 cut_image 中的人像是否处于合理的位置，若不合理，则处理数据以便之后调整位置
+    # Step5. 判定裁剪框中的人像是否处于合理的位置，若不合理，则处理数据以便之后调整位置
     # 检测人像与裁剪框左边或右边是否存在空隙
     if x_left > 0 or x_right > 0:
         status_left_right = 1
@@ -76,31 +58,28 @@ def adjust_photo(ctx: Context):
         min=params.head_top_range[1],
     )
 
-    # Step6. 对照片的第二轮裁剪
+    # Step6. 第二轮裁剪框
     if status_left_right == 0 and status_top == 0:
-        result_image = cut_image
+        y_high = y_bottom
     else:
-        result_image = IDphotos_cut(
+        x1, y1, x2, y2 = (
             x1 + x_left,
             y1 + cut_value_top + status_top * move_value,
             x2 - x_right,
             y2 - cut_value_top + status_top * move_value,
-            ctx.matting_image,
         )
+        y_high = crop_edges(analysis, x1, y1, x2, y2)[1]
 
-    # 换装参数准备
-    relative_x = x - (x1 + x_left)
-    relative_y = y - (y1 + cut_value_top + status_top * move_value)
-
-    # Step7. 当照片底部存在空隙时，下拉至底部
-    result_image, y_high = move(result_image.astype(np.uint8))
-    relative_y = relative_y + y_high  # 更新换装参数
+    # Step7. 当照片底部存在空隙时，下拉至底部：裁剪框上移 y_high，空出的顶部 y_high 行为透明
+    crop_rect = (x1, y1 - y_high, x2, y2 - y_high)
+    relative_x = x - x1  # 换装参数
+    relative_y = y - y1 + y_high
 
-    # Step8. 标准照与高清照转换
-    result_image_standard = standard_photo_resize(result_image, standard_size)
-    result_image_hd, resize_ratio_max = resize_image_by_min(
-        result_image, esp=max(600, standard_size[1])
+    # Step8. 记录裁剪几何，标准照、高清照和排版参数在第一次使用时才生成
+    crop = PhotoCrop(
+        ctx.matting_image, crop_rect, y_high, standard_size, esp=max(600, standard_size[1])
     )
+    resize_ratio_max = crop.hd_ratio
 
     # Step9. 参数准备 - 为换装服务
     clothing_params = {
@@ -110,148 +89,193 @@ def adjust_photo(ctx: Context):
         "h": h * resize_ratio_max,
     }
 
-    # Step7. 排版照参数获取
-    typography_arr, typography_rotate = generate_layout_array(
-        input_height=standard_size[0], input_width=standard_size[1]
-    )
+    return crop, clothing_params
+
 
-    return (
-        result_image_hd,
-        result_image_standard,
-        clothing_params,
-        {
+class PhotoCrop:
+    """
+    证件照的裁剪几何：抠图结果上的最终裁剪框、顶部留空行数和标准照尺寸。
+    标准照、高清照以及其他尺寸的照片都由它从抠图结果直接重采样一次得到
+    """
+
+    def __init__(self, image: np.ndarray, box, top: int, standard_size, esp: int = 600):
+        """
+        :param image: 抠图结果（BGRA）
+        :param box: 最终裁剪框 (x1, y1, x2, y2)，可以超出图像范围
+        :param top: 裁剪框顶部留空的行数（人像下拉到底部后空出的部分）
+        :param standard_size: 标准照尺寸 (高, 宽)
+        :param esp: 高清照的最短边长
+        """
+        self.image = image
+        self.box = tuple(box)
+        self.top = top
+        self.standard_size = tuple(standard_size)
+        self.hd_size, self.hd_ratio = hd_photo_size(
+            (self.box[3] - self.box[1], self.box[2] - self.box[0]), esp=esp
+        )
+
+    def render(self, size) -> np.ndarray:
+        """
+        生成尺寸为 size=(高, 宽) 的照片
+        """
+        return render_crop(self.image, self.box, self.top, size)
+
+    def standard(self) -> np.ndarray:
+        return self.render(self.standard_size)
+
+    def hd(self) -> np.ndarray:
+        return self.render(self.hd_size)
+
+    def typography(self) -> dict:
+        """
+        标准照的排版参数
+        """
+        typography_arr, typography_rotate = generate_layout_array(
+            input_height=self.standard_size[0], input_width=self.standard_size[1]
+        )
+        return {
             "arr": typography_arr,
             "rotate": typography_rotate,
-        },
-    )
+        }
 
 
-def IDphotos_cut(x1, y1, x2, y2, img):
+def crop_box(face_rect, params: Params):
     """
-    在图片上进行滑动裁剪，输入输出为
-    输入：一张图片 img，和裁剪框信息 (x1,x2,y1,y2)
-    输出：裁剪好的图片，然后裁剪框超出了图像范围，那么将用 0 矩阵补位
-    ------------------------------------
-    x:裁剪框左上的横坐标
-    y:裁剪框左上的纵坐标
-    x2:裁剪框右下的横坐标
-    y2:裁剪框右下的纵坐标
-    crop_size:裁剪框大小
-    img:裁剪图像（numpy.array）
-    output_path:裁剪图片的输出路径
-    ------------------------------------
+    根据人脸框和面部比例计算第一轮裁剪框
+    :param face_rect: 人脸框 (x, y, w, h)
+    :return: 裁剪框 (x1, y1, x2, y2) 和裁剪框大小 (高, 宽)
     """
+    standard_size = params.size
+    x, y = face_rect[0], face_rect[1]
+    w, h = face_rect[2], face_rect[3]
+    face_center = (x + w / 2, y + h / 2)  # 面部中心坐标
+    face_measure = w * h  # 面部面积
+    crop_measure = (
+        face_measure / params.head_measure_ratio
+    )  # 裁剪框面积：为面部面积的 5 倍
+    resize_ratio = crop_measure / (standard_size[0] * standard_size[1])  # 裁剪框缩放率
+    resize_ratio_single = math.sqrt(
+        resize_ratio
+    )  # 长和宽的缩放率（resize_ratio 的开方）
+    crop_size = (
+        int(standard_size[0] * resize_ratio_single),
+        int(standard_size[1] * resize_ratio_single),
+    )  # 裁剪框大小
+
+    # 裁剪框的定位信息
+    x1 = int(face_center[0] - crop_size[1] / 2)
+    y1 = int(face_center[1] - crop_size[0] * params.head_height_ratio)
+    y2 = y1 + crop_size[0]
+    x2 = x1 + crop_size[1]
+    return x1, y1, x2, y2, crop_size
+
 
-    crop_size = (y2 - y1, x2 - x1)
+def matting_roi(face_rect, params: Params, image_shape, margin: float = 0.1):
     """
-    ------------------------------------
-    temp_x_1:裁剪框左边超出图像部分
-    temp_y_1:裁剪框上边超出图像部分
-    temp_x_2:裁剪框右边超出图像部分
-    temp_y_2:裁剪框下边超出图像部分
-    ------------------------------------
+    抠图区域：adjust_photo 两轮裁剪可能用到的全部范围，再向四周各扩展 margin 倍裁剪框高度作为模型的上下文。
+    - 第二轮裁剪左右只会收缩，不超出第一轮裁剪框
+    - 裁剪框上移时，上边最多上移 head_top_range[1] 倍裁剪框高度
+    - 裁剪框下移时，下边最多下移（头顶距离 - head_top_range[0] 倍裁剪框高度），头顶不低于人脸框上边
+    :param face_rect: 人脸框 (x, y, w, h)
+    :param image_shape: 处理图像的尺寸
+    :return: 区域 (x1, y1, x2, y2)，已限制在图像范围内；区域覆盖整张图像时返回 None
     """
-    temp_x_1 = 0
-    temp_y_1 = 0
-    temp_x_2 = 0
-    temp_y_2 = 0
-
-    if y1 < 0:
-        temp_y_1 = abs(y1)
-        y1 = 0
-    if y2 > img.shape[0]:
-        temp_y_2 = y2
-        y2 = img.shape[0]
-        temp_y_2 = temp_y_2 - y2
-
-    if x1 < 0:
-        temp_x_1 = abs(x1)
-        x1 = 0
-    if x2 > img.shape[1]:
-        temp_x_2 = x2
-        x2 = img.shape[1]
-        temp_x_2 = temp_x_2 - x2
-
-    # 生成一张全透明背景
-    background_bgr = np.full((crop_size[0], crop_size[1]), 255, dtype=np.uint8)
-    background_a = np.full((crop_size[0], crop_size[1]), 0, dtype=np.uint8)
-    background = cv2.merge(
-        (background_bgr, background_bgr, background_bgr, background_a)
+    x1, y1, x2, y2, crop_size = crop_box(face_rect, params)
+    crop_height = crop_size[0]
+    head_top = max(0, face_rect[1] - y1)
+    pad = int(math.ceil(margin * crop_height))
+
+    height, width = image_shape[:2]
+    roi = (
+        max(0, x1 - pad),
+        max(0, int(y1 - params.head_top_range[1] * crop_height) - pad),
+        min(width, x2 + pad),
+        min(height, int(math.ceil(y2 + max(0, head_top - params.head_top_range[0] * crop_height))) + pad),
     )
+    if roi == (0, 0, width, height) or roi[0] >= roi[2] or roi[1] >= roi[3]:
+        return None
+    return roi
 
-    background[
-        temp_y_1 : crop_size[0] - temp_y_2, temp_x_1 : crop_size[1] - temp_x_2
-    ] = img[y1:y2, x1:x2]
 
-    return background
+def matting_input_size(face_rect, params: Params, region_shape) -> int:
+    """
+    抠图模型输入尺寸的下限：模型把抠图区域缩放为正方形输入，裁剪框在输入中的高和宽不应小于标准照的高和宽
+    :param face_rect: 人脸框 (x, y, w, h)
+    :param region_shape: 抠图区域的尺寸 (高, 宽)
+    """
+    _, _, _, _, crop_size = crop_box(face_rect, params)
+    return int(
+        math.ceil(
+            max(
+                params.size[0] * region_shape[0] / max(1, crop_size[0]),
+                params.size[1] * region_shape[1] / max(1, crop_size[1]),
+            )
+        )
+    )
 
 
-def move(input_image):
+def crop_edges(analysis: MaskAnalysis, x1, y1, x2, y2):
     """
-    裁剪主函数，输入一张 png 图像，该图像周围是透明的
+    裁剪框 (x1, y1, x2, y2) 中人像与裁剪框四边的距离 [上, 下, 左, 右]，与对裁剪结果调用 get_box(model=2) 相同
     """
-    png_img = input_image  # 获取图像
-
-    height, width, channels = png_img.shape  # 高 y、宽 x
-    y_low, y_high, _, _ = U.get_box(png_img, model=2)  # for 循环
-    base = np.zeros((y_high, width, channels), dtype=np.uint8)  # for 循环
-    png_img = png_img[0 : height - y_high, :, :]  # for 循环
-    png_img = np.concatenate((base, png_img), axis=0)
-    return png_img, y_high
+    rect = analysis.rect_in(x1, y1, x2, y2)
+    if rect is None:
+        raise ValueError("裁剪框中没有人像！")
+    return U.box_edges(rect, (y2 - y1, x2 - x1), model=2, correction_factor=0)
 
 
-def standard_photo_resize(input_image: np.array, size):
+def render_crop(image, box, top, size, interpolation=cv2.INTER_AREA):
     """
-    input_image: 输入图像，即高清照
-    size: 标准照的尺寸
+    从抠图结果直接生成裁剪后的照片，只做一次重采样
+    :param image: 抠图结果（BGRA）
+    :param box: 裁剪框 (x1, y1, x2, y2)，可以超出图像范围
+    :param top: 裁剪框顶部需要留空的行数（人像下拉到底部后空出的部分）
+    :param size: 输出尺寸 (高, 宽)
+    :return: 输出照片；裁剪框超出图像的部分和顶部留空部分为全透明，在缩放后以边框填充，不再生成整幅的裁剪画布
     """
-    resize_ratio = input_image.shape[0] / size[0]
-    resize_item = int(round(input_image.shape[0] / size[0]))
-    if resize_ratio >= 2:
-        for i in range(resize_item - 1):
-            if i == 0:
-                result_image = cv2.resize(
-                    input_image,
-                    (size[1] * (resize_item - i - 1), size[0] * (resize_item - i - 1)),
-                    interpolation=cv2.INTER_AREA,
-                )
-            else:
-                result_image = cv2.resize(
-                    result_image,
-                    (size[1] * (resize_item - i - 1), size[0] * (resize_item - i - 1)),
-                    interpolation=cv2.INTER_AREA,
-                )
-    else:
-        result_image = cv2.resize(
-            input_image, (size[1], size[0]), interpolation=cv2.INTER_AREA
-        )
+    x1, y1, x2, y2 = box
+    crop_height, crop_width = y2 - y1, x2 - x1
+    height, width = size
+    # 裁剪框中有图像内容的部分，坐标相对于裁剪框
+    left, upper = max(0, -x1), max(top, -y1)
+    right, lower = min(crop_width, image.shape[1] - x1), min(crop_height, image.shape[0] - y1)
+    # 该部分在输出中的位置
+    scale_x, scale_y = width / crop_width, height / crop_height
+    dst_left, dst_right = round(left * scale_x), round(right * scale_x)
+    dst_upper, dst_lower = round(upper * scale_y), round(lower * scale_y)
+    if dst_left >= dst_right or dst_upper >= dst_lower:
+        return np.zeros((height, width, image.shape[2]), dtype=np.uint8)
 
-    return result_image
+    region = image[y1 + upper : y1 + lower, x1 + left : x1 + right]
+    if region.shape[:2] != (dst_lower - dst_upper, dst_right - dst_left):
+        region = cv2.resize(
+            region, (dst_right - dst_left, dst_lower - dst_upper), interpolation=interpolation
+        )
+    return cv2.copyMakeBorder(
+        region,
+        dst_upper,
+        height - dst_lower,
+        dst_left,
+        width - dst_right,
+        cv2.BORDER_CONSTANT,
+        value=0,
+    )
 
 
-def resize_image_by_min(input_image, esp=600):
+def hd_photo_size(crop_size, esp=600):
     """
-    将图像缩放为最短边至少为 esp 的图像。
-    :param input_image: 输入图像（OpenCV 矩阵）
-    :param esp: 缩放后的最短边长
-    :return: 缩放后的图像，缩放倍率
+    高清照尺寸：裁剪框最短边小于 esp 时放大到最短边为 esp，否则保持裁剪框大小
+    :param crop_size: 裁剪框大小 (高, 宽)
+    :param esp: 高清照的最短边长
+    :return: 高清照尺寸 (高, 宽)，缩放倍率
     """
-    height, width = input_image.shape[0], input_image.shape[1]
-    min_border = min(height, width)
-    if min_border < esp:
+    height, width = crop_size
+    if min(height, width) < esp:
         if height >= width:
             new_width = esp
             new_height = height * esp // width
         else:
             new_height = esp
             new_width = width * esp // height
-
-        return (
-            cv2.resize(
-                input_image, (new_width, new_height), interpolation=cv2.INTER_AREA
-            ),
-            new_height / height,
-        )
-
-    else:
-        return input_image, 1
+        return (new_height, new_width), new_height / height
+    return (height, width), 1
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+r"""
+@DATE: 2026/10/17 15:20
+@File: quantize.py
+@IDE: pycharm
+@Description:
+    抠图模型 INT8 动态量化工具，生成量化模型并输出精度与速度对比报告
+
+    用法：
+    python -m hivision.creator.quantize --images ./samples
+    python -m hivision.creator.quantize --models rmbg-1.4 --images ./samples --runs 10 --report report.json
+"""
+import argparse
+import json
+import os
+from time import time
+
+import cv2
+import numpy as np
+
+import hivision.creator.utils as U
+from .human_matting import WEIGHTS, get_modnet_matting, get_rmbg_matting
+
+
+QUANTIZABLE_MODELS = {
+    "hivision_modnet": get_modnet_matting,
+    "modnet_photographic_portrait_matting": get_modnet_matting,
+    "rmbg-1.4": get_rmbg_matting,
+}
+"""
+可量化的模型及其抠图函数，量化模型在 WEIGHTS 中的名称为 <模型名>-int8
+"""
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def int8_name(model_name: str) -> str:
+    return f"{model_name}-int8"
+
+
+def quantize_model(model_name: str, weight_type: str = "QUInt8", op_types=None):
+    """
+    对模型做 INT8 动态量化，输出到 WEIGHTS 中 <模型名>-int8 对应的路径
+    :param model_name: QUANTIZABLE_MODELS 中的模型名
+    :param weight_type: 权重量化类型，QUInt8 或 QInt8
+    :param op_types: 需要量化的算子类型，None 表示使用 onnxruntime 默认值
+    :return: 量化模型路径
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    src_path = WEIGHTS[model_name]
+    dst_path = WEIGHTS[int8_name(model_name)]
+    if not os.path.exists(src_path):
+        raise FileNotFoundError(f"Checkpoint file not found: {src_path}")
+
+    # 量化前先做图优化和形状推理，量化效果更稳定
+    pre_path = dst_path + ".pre.onnx"
+    try:
+        quant_pre_process(src_path, pre_path, skip_symbolic_shape=True)
+    except Exception as e:
+        print(f"[{model_name}] 量化预处理失败，直接量化原模型: {e}")
+        pre_path = src_path
+
+    try:
+        quantize_dynamic(
+            pre_path,
+            dst_path,
+            op_types_to_quantize=op_types,
+            weight_type=getattr(QuantType, weight_type),
+        )
+    finally:
+        if pre_path != src_path and os.path.exists(pre_path):
+            os.remove(pre_path)
+
+    return dst_path
+
+
+def load_images(image_dir: str, limit: int = 0):
+    """
+    读取目录中的图像，并与证件照流程一样 resize 到最大边长 2000
+    """
+    images = []
+    for name in sorted(os.listdir(image_dir)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        # 使用 imdecode 读取，避免中文路径问题
+        image = cv2.imdecode(
+            np.fromfile(os.path.join(image_dir, name), dtype=np.uint8),
+            cv2.IMREAD_COLOR,
+        )
+        if image is None:
+            continue
+        images.append((name, U.resize_image_esp(image, 2000)))
+        if limit and len(images) >= limit:
+            break
+    return images
+
+
+def measure_latency(matting_fn, checkpoint_path, image, runs: int) -> float:
+    """
+    测量单张图像抠图的平均耗时（秒），首次调用用于加载模型，不计入
+    """
+    matting_fn(image, checkpoint_path)
+    start = time()
+    for _ in range(runs):
+        matting_fn(image, checkpoint_path)
+    return (time() - start) / runs
+
+
+def evaluate(model_name: str, images, runs: int = 5) -> dict:
+    """
+    对比 FP32 与 INT8 模型：
+    - alpha MAE：alpha 通道平均绝对误差（0~1）
+    - alpha SAD：alpha 通道绝对误差之和（0~1 归一化后求和，单位千）
+    - 延迟：单张图像抠图的平均耗时
+    """
+    matting_fn = QUANTIZABLE_MODELS[model_name]
+    fp32_path = WEIGHTS[model_name]
+    int8_path = WEIGHTS[int8_name(model_name)]
+
+    per_image = []
+    for name, image in images:
+        alpha_fp32 = matting_fn(image, fp32_path)[:, :, 3].astype(np.float32) / 255
+        alpha_int8 = matting_fn(image, int8_path)[:, :, 3].astype(np.float32) / 255
+        diff = np.abs(alpha_fp32 - alpha_int8)
+        per_image.append(
+            {
+                "image": name,
+                "mae": float(diff.mean()),
+                "sad": float(diff.sum() / 1000),
+            }
+        )
+
+    report = {
+        "model": model_name,
+        "fp32_size_mb": os.path.getsize(fp32_path) / 1024**2,
+        "int8_size_mb": os.path.getsize(int8_path) / 1024**2,
+        "images": per_image,
+    }
+    if per_image:
+        report["mae_mean"] = float(np.mean([r["mae"] for r in per_image]))
+        report["mae_max"] = float(np.max([r["mae"] for r in per_image]))
+        report["sad_mean"] = float(np.mean([r["sad"] for r in per_image]))
+        image = images[0][1]
+        report["fp32_latency"] = measure_latency(matting_fn, fp32_path, image, runs)
+        report["int8_latency"] = measure_latency(matting_fn, int8_path, image, runs)
+    return report
+
+
+def print_report(reports):
+    print()
+    print(
+        f"{'model':<40}{'size(MB)':>18}{'MAE mean':>10}{'MAE max':>10}"
+        f"{'SAD(k)':>10}{'latency(s)':>18}{'speedup':>9}"
+    )
+    for r in reports:
+        line = (
+            f"{r['model']:<40}"
+            f"{r['fp32_size_mb']:>8.1f} -> {r['int8_size_mb']:>6.1f}"
+        )
+        if "mae_mean" in r:
+            line += (
+                f"{r['mae_mean']:>10.4f}{r['mae_max']:>10.4f}{r['sad_mean']:>10.2f}"
+                f"{r['fp32_latency']:>8.3f} -> {r['int8_latency']:>6.3f}"
+                f"{r['fp32_latency'] / r['int8_latency']:>8.2f}x"
+            )
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="抠图模型 INT8 动态量化与评估")
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=list(QUANTIZABLE_MODELS),
+        choices=list(QUANTIZABLE_MODELS),
+        help="需要量化的模型",
+    )
+    parser.add_argument("--images", help="用于精度和速度评估的图像目录")
+    parser.add_argument("--limit", type=int, default=0, help="最多评估的图像数量，0 表示不限制")
+    parser.add_argument("--runs", type=int, default=5, help="测速时每个模型的推理次数")
+    parser.add_argument(
+        "--weight-type", default="QUInt8", choices=["QUInt8", "QInt8"], help="权重量化类型"
+    )
+    parser.add_argument("--op-types", nargs="+", default=None, help="需要量化的算子类型")
+    parser.add_argument("--skip-quantize", action="store_true", help="只评估已有的量化模型")
+    parser.add_argument("--report", help="将评估报告保存为 JSON 文件")
+    args = parser.parse_args()
+
+    for model_name in args.models:
+        if args.skip_quantize:
+            continue
+        print(f"[{model_name}] 开始量化...")
+        start = time()
+        path = quantize_model(model_name, args.weight_type, args.op_types)
+        print(f"[{model_name}] 量化完成: {path} ({time() - start:.1f}s)")
+
+    if not args.images:
+        return
+
+    images = load_images(args.images, args.limit)
+    if not images:
+        print(f"目录中没有可用的图像: {args.images}")
+        return
+
+    reports = [evaluate(model_name, images, args.runs) for model_name in args.models]
+    print_report(reports)
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
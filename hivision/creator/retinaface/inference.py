@@ -1,8 +1,9 @@
 import numpy as np
 import cv2
-import onnxruntime
+import os
 from hivision.creator.retinaface.box_utils import decode, decode_landm
 from hivision.creator.retinaface.prior_box import PriorBox
+from hivision.creator.onnx_session import create_session, get_provider
 
 
 def py_cpu_nms(dets, thresh):
@@ -36,6 +37,63 @@ def py_cpu_nms(dets, thresh):
     return keep
 
 
+def top_k_order(scores, k):
+    """
+    分数最高的 k 个下标（按分数降序），只对前 k 个排序，不做全量 argsort
+    """
+    if k and scores.size > k:
+        part = np.argpartition(-scores, k - 1)[:k]
+        return part[np.argsort(-scores[part], kind="stable")]
+    return np.argsort(-scores, kind="stable")
+
+
+def nms(dets, thresh, max_keep=0, block_size=64):
+    """
+    向量化 NMS，保留结果与 py_cpu_nms 一致
+    按分数从高到低每次取 block_size 个候选框：块内用 IoU 矩阵迭代求出贪心 NMS 的结果
+    （Cluster-NMS，迭代收敛后与逐个比较的结果相同），再用块内保留的框一次性抑制剩余候选框；
+    保留 max_keep 个框后提前结束
+    :param dets: (N, 5) [x1, y1, x2, y2, score]
+    :param thresh: IoU 阈值，大于阈值的框被抑制
+    :param max_keep: 最多保留的框数，0 表示不限制
+    :param block_size: 每次处理的候选框数量
+    :return: 保留框在 dets 中的下标，按分数降序
+    """
+    order = top_k_order(dets[:, 4], 0)
+    x1, y1, x2, y2 = dets[:, 0], dets[:, 1], dets[:, 2], dets[:, 3]
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+
+    def suppress(i, j):
+        # 框 i 与框 j 的 IoU 是否超过阈值，i、j 为可广播的下标数组
+        w = np.maximum(0.0, np.minimum(x2[i], x2[j]) - np.maximum(x1[i], x1[j]) + 1)
+        h = np.maximum(0.0, np.minimum(y2[i], y2[j]) - np.maximum(y1[i], y1[j]) + 1)
+        inter = w * h
+        return inter / (areas[i] + areas[j] - inter) > thresh
+
+    keep = []
+    while order.size:
+        block, order = order[:block_size], order[block_size:]
+
+        # 块内贪心：框 j 保留当且仅当前面没有被保留且与其重叠的框
+        over = np.triu(suppress(block[:, None], block[None, :]), 1)
+        kept = np.ones(block.size, dtype=bool)
+        while True:
+            new_kept = ~(over & kept[:, None]).any(axis=0)
+            if np.array_equal(new_kept, kept):
+                break
+            kept = new_kept
+        block = block[kept]
+
+        keep.extend(block.tolist())
+        if max_keep and len(keep) >= max_keep:
+            return np.array(keep[:max_keep], dtype=np.int64)
+
+        if order.size:
+            order = order[~suppress(block[:, None], order[None, :]).any(axis=0)]
+
+    return np.array(keep, dtype=np.int64)
+
+
 # 替换掉 argparse 的部分，直接使用普通变量
 network = "resnet50"
 use_cpu = False
@@ -46,33 +104,63 @@ keep_top_k = 750
 save_image = True
 vis_thres = 0.6
 
-ONNX_DEVICE = (
-    "CUDAExecutionProvider"
-    if onnxruntime.get_device() == "GPU"
-    else "CPUExecutionProvider"
-)
+cfg_re50 = {
+    "name": "Resnet50",
+    "min_sizes": [[16, 32], [64, 128], [256, 512]],
+    "steps": [8, 16, 32],
+    "variance": [0.1, 0.2],
+    "clip": False,
+    "loc_weight": 2.0,
+    "gpu_train": True,
+    "batch_size": 24,
+    "ngpu": 4,
+    "epoch": 100,
+    "decay1": 70,
+    "decay2": 90,
+    "image_size": 840,
+    "pretrain": True,
+    "return_layers": {"layer2": 1, "layer3": 2, "layer4": 3},
+    "in_channel": 256,
+    "out_channel": 256,
+}
+
+detect_max_size = int(os.getenv("HIVISION_RETINAFACE_MAX_SIZE", 0))
+"""
+检测时输入图像的最大边长，超过时先缩小再检测，结果映射回原图坐标；默认 0 表示使用原图检测，
+缩小检测会改变人脸框和关键点，需要时设置为训练尺寸 840（cfg_re50["image_size"]）等值开启
+"""
+detect_fixed_shape = os.getenv("HIVISION_RETINAFACE_FIXED_SHAPE", "0") == "1"
+"""
+是否将输入补边到 detect_max_size x detect_max_size 的固定尺寸，
+固定尺寸下先验框和 onnxruntime 的内存分配都可以复用；detect_max_size 为 0 时不生效
+"""
+
+
+def __getattr__(name):
+    # ONNX_DEVICE 在第一次访问时才导入 onnxruntime
+    if name == "ONNX_DEVICE":
+        return get_provider()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def load_onnx_model(checkpoint_path, set_cpu=False):
     providers = (
         ["CUDAExecutionProvider", "CPUExecutionProvider"]
-        if ONNX_DEVICE == "CUDAExecutionProvider"
+        if get_provider() == "CUDAExecutionProvider"
         else ["CPUExecutionProvider"]
     )
 
     if set_cpu:
-        sess = onnxruntime.InferenceSession(
-            checkpoint_path, providers=["CPUExecutionProvider"]
-        )
+        sess = create_session(checkpoint_path, providers=["CPUExecutionProvider"])
     else:
         try:
-            sess = onnxruntime.InferenceSession(checkpoint_path, providers=providers)
+            sess = create_session(checkpoint_path, providers=providers)
         except Exception as e:
-            if ONNX_DEVICE == "CUDAExecutionProvider":
+            if get_provider() == "CUDAExecutionProvider":
                 print(f"Failed to load model with CUDAExecutionProvider: {e}")
                 print("Falling back to CPUExecutionProvider")
                 # 尝试使用CPU加载模型
-                sess = onnxruntime.InferenceSession(
+                sess = create_session(
                     checkpoint_path, providers=["CPUExecutionProvider"]
                 )
             else:
@@ -81,26 +169,53 @@ def load_onnx_model(checkpoint_path, set_cpu=False):
     return sess
 
 
-def retinaface_detect_faces(image, model_path: str, sess=None):
-    cfg = {
-        "name": "Resnet50",
-        "min_sizes": [[16, 32], [64, 128], [256, 512]],
-        "steps": [8, 16, 32],
-        "variance": [0.1, 0.2],
-        "clip": False,
-        "loc_weight": 2.0,
-        "gpu_train": True,
-        "batch_size": 24,
-        "ngpu": 4,
-        "epoch": 100,
-        "decay1": 70,
-        "decay2": 90,
-        "image_size": 840,
-        "pretrain": True,
-        "return_layers": {"layer2": 1, "layer3": 2, "layer4": 3},
-        "in_channel": 256,
-        "out_channel": 256,
-    }
+def prepare_input(image, max_size: int = 0, fixed_shape: bool = False):
+    """
+    生成检测模型的输入
+    :param image: BGR 图像
+    :param max_size: 最大边长，超过时等比例缩小，0 表示不缩放
+    :param fixed_shape: 是否在右侧和下方补边到 max_size x max_size，补边区域在减均值后为 0
+    :return: (1, 3, H, W) 的 float32 输入，以及缩放比例 resize（输入尺寸 / 原图尺寸）
+    """
+    height, width = image.shape[:2]
+    resize = 1
+    if max_size and max(height, width) > max_size:
+        resize = max_size / max(height, width)
+        image = cv2.resize(
+            image,
+            (max(1, round(width * resize)), max(1, round(height * resize))),
+            interpolation=cv2.INTER_AREA,
+        )
+
+    img = np.float32(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    img -= (104, 117, 123)
+    img = img.transpose(2, 0, 1)
+
+    if fixed_shape and max_size:
+        tensor = np.zeros((1, 3, max_size, max_size), dtype=np.float32)
+        tensor[0, :, : img.shape[1], : img.shape[2]] = img
+        return tensor, resize
+
+    return np.expand_dims(img, axis=0), resize
+
+
+def retinaface_detect_faces(
+    image, model_path: str, sess=None, max_size: int = None, fixed_shape: bool = None
+):
+    """
+    RetinaFace 人脸检测
+    :param image: BGR 图像
+    :param model_path: 模型路径，sess 为 None 时加载
+    :param sess: 已加载的 InferenceSession
+    :param max_size: 检测时的最大边长，None 表示使用 detect_max_size
+    :param fixed_shape: 是否补边到固定尺寸，None 表示使用 detect_fixed_shape
+    :return: (N, 15) 的检测结果 [x1, y1, x2, y2, score, 5 个关键点]（原图坐标），以及会话
+    """
+    cfg = cfg_re50
+    if max_size is None:
+        max_size = detect_max_size
+    if fixed_shape is None:
+        fixed_shape = detect_fixed_shape
 
     # Load ONNX model
     if sess is None:
@@ -108,17 +223,11 @@ def retinaface_detect_faces(image, model_path: str, sess=None):
     else:
         retinaface = sess
 
-    resize = 1
-
     # Read and preprocess the image
-    img_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    img = np.float32(img_rgb)
+    img, resize = prepare_input(image, max_size, fixed_shape)
 
-    im_height, im_width, _ = img.shape
-    scale = np.array([img.shape[1], img.shape[0], img.shape[1], img.shape[0]])
-    img -= (104, 117, 123)
-    img = img.transpose(2, 0, 1)
-    img = np.expand_dims(img, axis=0)
+    im_height, im_width = img.shape[2], img.shape[3]
+    scale = np.array([im_width, im_height, im_width, im_height])
 
     # Run the model
     inputs = {"input": img}
@@ -158,14 +267,14 @@ def retinaface_detect_faces(image, model_path: str, sess=None):
     scores = scores[inds]
 
     # keep top-K before NMS
-    order = scores.argsort()[::-1][:top_k]
+    order = top_k_order(scores, top_k)
     boxes = boxes[order]
     landms = landms[order]
     scores = scores[order]
 
     # do NMS
     dets = np.hstack((boxes, scores[:, np.newaxis])).astype(np.float32, copy=False)
-    keep = py_cpu_nms(dets, nms_threshold)
+    keep = nms(dets, nms_threshold, keep_top_k)
     dets = dets[keep, :]
     landms = landms[keep]
 
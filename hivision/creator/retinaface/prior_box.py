@@ -1,8 +1,14 @@
-from itertools import product as product
+from functools import lru_cache
 import numpy as np
 from math import ceil
 
 
+PRIOR_CACHE_SIZE = 16
+"""
+按 (im_height, im_width) 缓存的先验框数量上限
+"""
+
+
 class PriorBox(object):
     def __init__(self, cfg, image_size=None):
         super(PriorBox, self).__init__()
@@ -17,25 +23,43 @@ class PriorBox(object):
         self.name = "s"
 
     def forward(self):
-        anchors = []
-        for k, f in enumerate(self.feature_maps):
-            min_sizes = self.min_sizes[k]
-            for i, j in product(range(f[0]), range(f[1])):
-                for min_size in min_sizes:
-                    s_kx = min_size / self.image_size[1]
-                    s_ky = min_size / self.image_size[0]
-                    dense_cx = [
-                        x * self.steps[k] / self.image_size[1] for x in [j + 0.5]
-                    ]
-                    dense_cy = [
-                        y * self.steps[k] / self.image_size[0] for y in [i + 0.5]
-                    ]
-                    for cy, cx in product(dense_cy, dense_cx):
-                        anchors += [cx, cy, s_kx, s_ky]
-
-        output = np.array(anchors).reshape(-1, 4)
-
-        if self.clip:
-            output = np.clip(output, 0, 1)
-
-        return output
+        """
+        返回 (num_priors, 4) 的先验框 [cx, cy, s_kx, s_ky]，同一配置和尺寸的结果会被缓存，
+        返回的数组为只读
+        """
+        return prior_boxes(
+            tuple(tuple(min_sizes) for min_sizes in self.min_sizes),
+            tuple(self.steps),
+            bool(self.clip),
+            tuple(self.image_size),
+        )
+
+
+@lru_cache(maxsize=PRIOR_CACHE_SIZE)
+def prior_boxes(min_sizes, steps, clip, image_size):
+    """
+    向量化生成先验框，排列顺序与逐个特征点循环生成时一致：
+    特征层 k -> 行 i -> 列 j -> min_size
+    """
+    im_height, im_width = image_size
+    anchors = []
+    for k, step in enumerate(steps):
+        f_h, f_w = ceil(im_height / step), ceil(im_width / step)
+        sizes = np.asarray(min_sizes[k], dtype=np.float64)
+        cx = (np.arange(f_w) + 0.5) * step / im_width
+        cy = (np.arange(f_h) + 0.5) * step / im_height
+
+        layer = np.empty((f_h, f_w, len(sizes), 4))
+        layer[..., 0] = cx[None, :, None]
+        layer[..., 1] = cy[:, None, None]
+        layer[..., 2] = sizes / im_width
+        layer[..., 3] = sizes / im_height
+        anchors.append(layer.reshape(-1, 4))
+
+    output = np.concatenate(anchors, axis=0)
+
+    if clip:
+        output = np.clip(output, 0, 1)
+
+    output.flags.writeable = False
+    return output
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+r"""
+@DATE: 2026/10/17 10:12
+@File: session_registry.py
+@IDE: pycharm
+@Description:
+    模型会话注册表，统一管理抠图与人脸检测模型的加载、常驻与释放
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from time import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class ModelMeta:
+    """
+    模型输入输出元信息，在模型加载时读取一次并缓存，避免每次推理都调用 get_inputs/get_outputs
+    """
+
+    def __init__(
+        self,
+        input_names: List[str],
+        output_names: List[str],
+        input_shapes: List[Tuple],
+    ):
+        self.input_names = input_names
+        self.output_names = output_names
+        self.input_shapes = input_shapes
+
+    @property
+    def input_name(self) -> str:
+        return self.input_names[0]
+
+    @property
+    def output_name(self) -> str:
+        return self.output_names[0]
+
+    @classmethod
+    def from_session(cls, sess) -> Optional["ModelMeta"]:
+        """
+        从 onnxruntime.InferenceSession 读取元信息，非 ONNX 模型（如 MTCNN）返回 None
+        """
+        if not hasattr(sess, "get_inputs") or not hasattr(sess, "get_outputs"):
+            return None
+        inputs = sess.get_inputs()
+        outputs = sess.get_outputs()
+        return cls(
+            input_names=[i.name for i in inputs],
+            output_names=[o.name for o in outputs],
+            input_shapes=[tuple(i.shape) for i in inputs],
+        )
+
+
+class _Entry:
+    def __init__(self, sess, meta: Optional[ModelMeta], nbytes: int):
+        self.sess = sess
+        self.meta = meta
+        self.nbytes = nbytes
+        self.last_used = time()
+
+
+class SessionRegistry:
+    """
+    模型会话注册表：
+    - 懒加载：首次 get 时才调用 loader 创建会话，加载在注册表的锁之外进行，同一模型的并发请求共用一次加载
+    - 空闲释放：超过 idle_timeout 秒未使用的会话会被释放
+    - 内存上限：已加载模型的估算占用超过 memory_limit 时，按 LRU 顺序释放
+    - 元信息缓存：加载时读取输入输出名称与形状
+    """
+
+    def __init__(self, idle_timeout: float = 300, memory_limit: int = 0):
+        """
+        :param idle_timeout: 空闲释放时间（秒），<=0 表示永不因空闲释放
+        :param memory_limit: 内存上限（字节），<=0 表示不限制
+        """
+        self.idle_timeout = idle_timeout
+        self.memory_limit = memory_limit
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._loading: Dict[str, Future] = {}
+        self._lock = threading.RLock()
+        self._reaper: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def get(self, key: str, loader: Callable[[], Any], nbytes: int = None):
+        """
+        获取模型会话，不存在时调用 loader 加载
+        :param key: 模型标识，一般为权重文件路径
+        :param loader: 无参加载函数，返回模型会话
+        :param nbytes: 模型内存占用估算，默认取权重文件大小
+        :return: (模型会话, 输入输出元信息)，两者取自同一个条目，不会因为中途被释放而不一致
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.last_used = time()
+                return entry.sess, entry.meta
+            # 同一模型只由一个线程加载，其他线程等待它的结果；加载在锁外进行，不阻塞其他模型的 get 和释放
+            loading = self._loading.get(key)
+            if loading is None:
+                loading = self._loading[key] = Future()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            return loading.result()
+
+        try:
+            if nbytes is None:
+                nbytes = os.path.getsize(key) if os.path.isfile(key) else 0
+            with self._lock:
+                self._make_room(nbytes)
+            sess = loader()
+            meta = ModelMeta.from_session(sess)
+        except BaseException as e:
+            with self._lock:
+                self._loading.pop(key, None)
+            loading.set_exception(e)
+            raise
+        with self._lock:
+            self._loading.pop(key, None)
+            self._make_room(nbytes)
+            self._entries[key] = _Entry(sess, meta, nbytes)
+            self._ensure_reaper()
+        loading.set_result((sess, meta))
+        return sess, meta
+
+    def meta(self, key: str) -> Optional[ModelMeta]:
+        """
+        获取已加载模型的输入输出元信息，未加载时返回 None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.meta if entry is not None else None
+
+    def is_loaded(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def loaded(self) -> List[str]:
+        """
+        当前常驻的模型列表，按最近使用时间从旧到新排列
+        """
+        with self._lock:
+            return list(self._entries.keys())
+
+    def memory_usage(self) -> int:
+        with self._lock:
+            return sum(e.nbytes for e in self._entries.values())
+
+    def release(self, key: str):
+        """
+        释放指定模型，正在推理的调用持有自己的引用，不受影响
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def evict_idle(self, now: float = None) -> List[str]:
+        """
+        释放空闲超时的模型
+        :return: 被释放的模型列表
+        """
+        if self.idle_timeout <= 0:
+            return []
+        now = time() if now is None else now
+        with self._lock:
+            expired = [
+                key
+                for key, entry in self._entries.items()
+                if now - entry.last_used > self.idle_timeout
+            ]
+            for key in expired:
+                del self._entries[key]
+        return expired
+
+    def _make_room(self, nbytes: int):
+        if self.memory_limit <= 0:
+            return
+        while self._entries and self.memory_usage() + nbytes > self.memory_limit:
+            self._entries.popitem(last=False)
+
+    def _ensure_reaper(self):
+        if self.idle_timeout <= 0 or (self._reaper and self._reaper.is_alive()):
+            return
+        self._reaper = threading.Thread(
+            target=self._reap_loop, name="hivision-session-reaper", daemon=True
+        )
+        self._reaper.start()
+
+    def _reap_loop(self):
+        interval = min(max(self.idle_timeout / 2, 1), 30)
+        while not self._stop.wait(interval):
+            self.evict_idle()
+            with self._lock:
+                if not self._entries:
+                    self._reaper = None
+                    return
+
+
+def _registry_from_env() -> SessionRegistry:
+    """
+    根据环境变量创建注册表：
+    - RUN_MODE=beast: 模型常驻，不因空闲释放
+    - HIVISION_MODEL_IDLE_TIMEOUT: 空闲释放时间（秒），默认 300
+    - HIVISION_MODEL_MEMORY_LIMIT: 模型内存上限（MB），默认 1024，0 表示不限制
+    """
+    idle_timeout = float(os.getenv("HIVISION_MODEL_IDLE_TIMEOUT", 300))
+    if os.getenv("RUN_MODE") == "beast":
+        idle_timeout = 0
+    memory_limit = int(float(os.getenv("HIVISION_MODEL_MEMORY_LIMIT", 1024)) * 1024**2)
+    return SessionRegistry(idle_timeout=idle_timeout, memory_limit=memory_limit)
+
+
+REGISTRY = _registry_from_env()
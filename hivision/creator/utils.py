@@ -9,6 +9,7 @@ r"""
 """
 import cv2
 import numpy as np
+from .mask_analysis import MaskAnalysis
 
 
 def resize_image_esp(input_image, esp=2000):
@@ -66,7 +67,7 @@ def get_box(
     # 输入必须为四通道
     if correction_factor is None:
         correction_factor = [0, 0, 0, 0]
-    if not isinstance(image, np.ndarray) or len(cv2.split(image)) != 4:
+    if not isinstance(image, np.ndarray) or image.ndim != 3 or image.shape[2] != 4:
         raise TypeError("输入的图像必须为四通道 np.ndarray 类型矩阵！")
     # correction_factor 规范化
     if isinstance(correction_factor, int):
@@ -74,20 +75,29 @@ def get_box(
     elif not isinstance(correction_factor, list):
         raise TypeError("correction_factor 必须为 int 或者 list 类型！")
     # ------------ 数据格式规范完毕 -------------- #
-    # 分离 mask
-    _, _, _, mask = cv2.split(image)
-    # mask 二值化处理
-    _, mask = cv2.threshold(mask, thresh=thresh, maxval=255, type=0)
-    contours, hierarchy = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-    temp = np.ones(image.shape, np.uint8) * 255
-    cv2.drawContours(temp, contours, -1, (0, 0, 255), -1)
-    contours_area = []
-    for cnt in contours:
-        contours_area.append(cv2.contourArea(cnt))
-    idx = contours_area.index(max(contours_area))
-    x, y, w, h = cv2.boundingRect(contours[idx])  # 框出图像
+    # 最大连通区域的外接矩形，由行列投影得到，不需要追踪轮廓
+    rect = MaskAnalysis(cv2.extractChannel(image, 3), thresh=thresh).bbox
+    if rect is None:
+        raise ValueError("图像中没有不透明区域！")
+    return box_edges(rect, image.shape[:2], model, correction_factor)
+
+
+def box_edges(rect, shape, model: int = 1, correction_factor=None):
+    """
+    把矩形 (x, y, w, h) 按 get_box 的格式输出
+    Args:
+        rect: 图像中的矩形 (x, y, w, h)
+        shape: 图像尺寸 (高, 宽)
+        model: 返回值模式，同 get_box
+        correction_factor: 边缘扩张 [up, down, left, right]，同 get_box
+    """
+    if correction_factor is None:
+        correction_factor = [0, 0, 0, 0]
+    elif isinstance(correction_factor, int):
+        correction_factor = [0, 0, correction_factor, correction_factor]
+    x, y, w, h = rect
     # ------------ 开始输出数据 -------------- #
-    height, width, _ = image.shape
+    height, width = shape[:2]
     y_up = y - correction_factor[0] if y - correction_factor[0] >= 0 else 0
     y_down = (
         y + h + correction_factor[1]
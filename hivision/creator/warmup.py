@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+r"""
+@DATE: 2026/10/17 20:10
+@File: warmup.py
+@IDE: pycharm
+@Description:
+    模型预热：提前加载抠图和人脸检测模型，并用一张空白图像做一次推理，
+    让 onnxruntime 完成首次推理时的内存分配，之后的第一次真实处理不再等待
+"""
+from time import time
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from .human_matting import (
+    WEIGHTS,
+    get_birefnet_portrait_matting,
+    get_mnn_modnet_matting,
+    get_modnet_matting,
+    get_rmbg_matting,
+)
+
+
+MATTING_WARMUP = {
+    "hivision_modnet": get_modnet_matting,
+    "modnet_photographic_portrait_matting": get_modnet_matting,
+    "mnn_hivision_modnet": get_mnn_modnet_matting,
+    "rmbg-1.4": get_rmbg_matting,
+    "birefnet-v1-lite": get_birefnet_portrait_matting,
+    "hivision_modnet-int8": get_modnet_matting,
+    "modnet_photographic_portrait_matting-int8": get_modnet_matting,
+    "rmbg-1.4-int8": get_rmbg_matting,
+}
+"""
+抠图模型名与对应的抠图函数，模型名与 choose_handler 中的一致
+"""
+
+WARMUP_IMAGE_SIZE = (640, 480)
+"""
+预热图像的尺寸 (h, w)
+"""
+
+ProgressCallback = Callable[[int, int, str], None]
+"""
+进度回调 (当前步骤序号（从 1 开始）, 总步骤数, 模型名)，在开始预热该模型前调用
+"""
+
+
+def warmup_image() -> np.ndarray:
+    return np.full((*WARMUP_IMAGE_SIZE, 3), 127, dtype=np.uint8)
+
+
+def warmup_matting(model_name: str):
+    """
+    加载抠图模型并做一次推理
+    """
+    if model_name not in MATTING_WARMUP:
+        raise ValueError(f"Unknown matting model: {model_name}")
+    MATTING_WARMUP[model_name](warmup_image(), WEIGHTS[model_name])
+
+
+def warmup_face(model_name: str):
+    """
+    加载人脸检测模型并做一次推理，Face++ 为在线接口，不需要预热
+    """
+    from .face_detector import MTCNN_KEY, RETINAFACE_WEIGHT, load_mtcnn
+    from .session_registry import REGISTRY
+
+    if model_name == "mtcnn":
+        mtcnn, _ = REGISTRY.get(MTCNN_KEY, load_mtcnn, nbytes=0)
+        try:
+            mtcnn.detect(warmup_image(), thresholds=[0.8, 0.8, 0.8])
+        except ValueError:
+            # 空白图像上没有候选框时 mtcnnruntime 会抛出 ValueError，此时推理已经执行过
+            pass
+    elif model_name == "retinaface-resnet50":
+        from .retinaface import retinaface_detect_faces
+        from .retinaface.inference import load_onnx_model
+
+        sess, _ = REGISTRY.get(
+            RETINAFACE_WEIGHT, lambda: load_onnx_model(RETINAFACE_WEIGHT, set_cpu=False)
+        )
+        retinaface_detect_faces(warmup_image(), RETINAFACE_WEIGHT, sess=sess)
+
+
+def warmup(
+    matting_model: Optional[str] = None,
+    face_model: Optional[str] = None,
+    progress: ProgressCallback = None,
+) -> List[Tuple[str, float, Optional[Exception]]]:
+    """
+    依次预热抠图模型和人脸检测模型，单个模型失败不影响其他模型
+    :param matting_model: 抠图模型名，None 表示不预热
+    :param face_model: 人脸检测模型名，None 表示不预热
+    :param progress: 进度回调
+    :return: 每个模型的 (模型名, 耗时, 异常)，成功时异常为 None
+    """
+    steps = []
+    if matting_model:
+        steps.append((matting_model, warmup_matting))
+    if face_model and "face++" not in face_model.lower():
+        steps.append((face_model, warmup_face))
+
+    results = []
+    for index, (model_name, fn) in enumerate(steps, 1):
+        progress and progress(index, len(steps), model_name)
+        start = time()
+        try:
+            fn(model_name)
+            error = None
+        except Exception as e:
+            error = e
+        cost = time() - start
+        if error is None:
+            print(f"[Warmup]  {model_name}: {cost:.3f}s")
+        else:
+            print(f"[Warmup]  {model_name} failed: {error}")
+        results.append((model_name, cost, error))
+    return results
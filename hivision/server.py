@@ -0,0 +1,546 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+r"""
+@DATE: 2026/10/17 22:10
+@File: server.py
+@IDE: pycharm
+@Description:
+    本地 HTTP 推理服务，只依赖标准库，供多台电脑共用一台机器上的模型
+
+    用法：
+    python -m hivision.server --port 8080 --workers 2 --queue-size 8
+
+    接口（POST，参数可以是 JSON，图像为 base64；也可以是 multipart/form-data，图像为文件字段 image）：
+    /matting      抠图，返回透明图 image_base64
+    /idphoto      证件照，参数 height、width、head_measure_ratio 等，返回 image_base64_standard、image_base64_hd
+    /background   换背景，参数 color（#RRGGBB）、render（pure_color/updown_gradient/center_gradient），返回 image_base64
+    /layout       六寸排版，参数 height、width、crop_line，返回 image_base64
+    接口地址加 ?format=png 时直接返回 PNG 图像
+    GET /health 返回服务状态，GET /metrics 返回请求计数、延迟和队列长度
+
+    请求由固定数量的工作线程处理，每个线程持有自己的 IDCreator，模型常驻内存；
+    等待队列满时直接返回 429，客户端稍后重试
+"""
+import argparse
+import base64
+import json
+import os
+import queue
+import re
+import threading
+from collections import Counter, defaultdict, deque
+from concurrent.futures import Future, TimeoutError
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+from typing import Callable, Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+
+from hivision.error import APIError, FaceError
+
+
+RENDER_MODES = ("pure_color", "updown_gradient", "center_gradient")
+"""
+/background 支持的背景渲染方式，与 add_background 的 mode 一致
+"""
+
+LATENCY_WINDOW = 1000
+"""
+每个接口保留最近多少次请求的耗时，用于计算延迟分位数
+"""
+
+
+class Fields:
+    """
+    请求参数，JSON 和 multipart 表单统一按名称读取，并转换为需要的类型
+    """
+
+    def __init__(self, values: Dict[str, object]):
+        self.values = values
+
+    def get(self, name: str, default=None, cast: Callable = str):
+        value = self.values.get(name)
+        if value is None or value == "":
+            return default
+        try:
+            if cast is bool and isinstance(value, str):
+                return value.lower() in ("1", "true", "yes", "on")
+            return cast(value)
+        except (TypeError, ValueError):
+            raise APIError(f"参数 {name} 格式错误: {value}", 400)
+
+    def image(self, channels: int) -> np.ndarray:
+        """
+        读取图像参数，转换为指定通道数（3 为 BGR，4 为 BGRA）
+        """
+        value = self.values.get("image")
+        if value is None:
+            raise APIError("缺少参数 image", 400)
+        if isinstance(value, str):
+            if value.startswith("data:image"):
+                value = value.split(",", 1)[1]
+            try:
+                value = base64.b64decode(value)
+            except ValueError:
+                raise APIError("image 不是有效的 base64", 400)
+        image = cv2.imdecode(np.frombuffer(value, np.uint8), cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise APIError("无法解码 image", 400)
+
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        if image.dtype != np.uint8:
+            image = cv2.convertScaleAbs(image, alpha=255 / np.iinfo(image.dtype).max)
+        if channels == 3 and image.shape[2] == 4:
+            image = image[:, :, :3]
+        if channels == 4 and image.shape[2] != 4:
+            raise APIError("image 必须是带透明通道的 PNG", 400)
+        return np.ascontiguousarray(image)
+
+
+def matting_job(fields: Fields):
+    image = fields.image(3)
+
+    def run(creator):
+        result = creator(image, change_bg_only=True)
+        return {"image_base64": result.standard}
+
+    return run
+
+
+def idphoto_job(fields: Fields):
+    image = fields.image(3)
+    size = (fields.get("height", 413, int), fields.get("width", 295, int))
+    if min(size) <= 0:
+        raise APIError("height 和 width 必须大于 0", 400)
+    kwargs = dict(
+        head_measure_ratio=fields.get("head_measure_ratio", 0.2, float),
+        head_height_ratio=fields.get("head_height_ratio", 0.45, float),
+        head_top_range=(
+            fields.get("top_distance_max", 0.12, float),
+            fields.get("top_distance_min", 0.1, float),
+        ),
+        whitening_strength=fields.get("whitening_strength", 0, int),
+        brightness_strength=fields.get("brightness_strength", 0, int),
+        contrast_strength=fields.get("contrast_strength", 0, int),
+        sharpen_strength=fields.get("sharpen_strength", 0, int),
+        saturation_strength=fields.get("saturation_strength", 0, int),
+        face_alignment=fields.get("face_alignment", False, bool),
+    )
+
+    def run(creator):
+        result = creator(image, size=size, **kwargs)
+        return {
+            "image_base64_standard": result.standard,
+            "image_base64_hd": result.hd,
+        }
+
+    return run
+
+
+def background_job(fields: Fields):
+    from hivision.utils import add_background, hex_to_rgb
+
+    image = fields.image(4)
+    color = fields.get("color", "#438EDB")
+    if not re.fullmatch(r"#?[0-9a-fA-F]{6}", color):
+        raise APIError(f"参数 color 格式错误: {color}", 400)
+    r, g, b = hex_to_rgb(color)
+    render = fields.get("render", "pure_color")
+    if render not in RENDER_MODES:
+        raise APIError(f"参数 render 必须是 {', '.join(RENDER_MODES)} 之一", 400)
+
+    def run(creator):
+        output = add_background(image, bgr=(b, g, r), mode=render)
+        return {"image_base64": output.astype(np.uint8)}
+
+    return run
+
+
+def layout_job(fields: Fields):
+    from hivision.creator.layout_calculator import (
+        generate_layout_array,
+        generate_layout_image,
+    )
+
+    image = fields.image(3)
+    height = fields.get("height", 413, int)
+    width = fields.get("width", 295, int)
+    if min(height, width) <= 0:
+        raise APIError("height 和 width 必须大于 0", 400)
+    crop_line = fields.get("crop_line", False, bool)
+
+    def run(creator):
+        typography_arr, typography_rotate = generate_layout_array(height, width)
+        if not typography_arr:
+            raise APIError("照片尺寸超过排版纸张", 400)
+        output = generate_layout_image(
+            image, typography_arr, typography_rotate, width, height, crop_line
+        )
+        return {"image_base64": output}
+
+    return run
+
+
+ENDPOINTS = {
+    "/matting": matting_job,
+    "/idphoto": idphoto_job,
+    "/background": background_job,
+    "/layout": layout_job,
+}
+"""
+接口路径与任务函数：任务函数在请求线程中解析参数，返回在工作线程中执行的 run(creator)
+"""
+
+
+class WorkerPool:
+    """
+    固定数量的工作线程，从有界队列中取任务执行；每个线程持有自己的 IDCreator，模型会话在线程间共享
+    """
+
+    def __init__(self, workers: int, queue_size: int, matting_model: str, face_model: str):
+        self.matting_model = matting_model
+        self.face_model = face_model
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.running = 0
+        self._lock = threading.Lock()
+        self.threads = [
+            threading.Thread(target=self._loop, name=f"hivision-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    @property
+    def queued(self) -> int:
+        return self.jobs.qsize()
+
+    def submit(self, fn: Callable) -> Future:
+        """
+        提交任务，队列已满时抛出 APIError(429)
+        """
+        future = Future()
+        try:
+            self.jobs.put_nowait((fn, future))
+        except queue.Full:
+            raise APIError("服务繁忙，请稍后重试", 429)
+        return future
+
+    def close(self):
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def _loop(self):
+        from hivision import IDCreator
+        from hivision.creator.choose_handler import choose_handler
+
+        creator = IDCreator()
+        # 人脸数量不符的照片在抠图之前就返回 422，不占用抠图推理
+        creator.detect_first = True
+        choose_handler(creator, self.matting_model, self.face_model)
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            fn, future = job
+            # 等待超时的请求已被取消，不再执行
+            if not future.set_running_or_notify_cancel():
+                continue
+            with self._lock:
+                self.running += 1
+            try:
+                future.set_result(fn(creator))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self.running -= 1
+
+
+class Metrics:
+    """
+    按接口统计请求数、状态码和最近请求的耗时
+    """
+
+    def __init__(self):
+        self.started = time()
+        self.requests = Counter()
+        self.statuses = defaultdict(Counter)
+        self.latency = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, status: int, seconds: float):
+        with self._lock:
+            self.requests[endpoint] += 1
+            self.statuses[endpoint][status] += 1
+            if status < 400:
+                self.latency[endpoint].append(seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            endpoints = {}
+            for endpoint, count in self.requests.items():
+                latency = np.array(self.latency[endpoint])
+                endpoints[endpoint] = {
+                    "requests": count,
+                    "status": {str(k): v for k, v in sorted(self.statuses[endpoint].items())},
+                    "latency_avg": round(float(latency.mean()), 4) if latency.size else None,
+                    "latency_p50": round(float(np.percentile(latency, 50)), 4) if latency.size else None,
+                    "latency_p95": round(float(np.percentile(latency, 95)), 4) if latency.size else None,
+                }
+            return {"uptime": round(time() - self.started, 1), "endpoints": endpoints}
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server_version = "HivisionIDPhotos"
+    protocol_version = "HTTP/1.1"
+    body_read = True
+    """
+    当前请求的请求体是否已从连接中读出；未读出时回复前先丢弃，避免残留的请求体被当作下一个请求解析
+    """
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/health":
+            self.send_json(200, self.server.health())
+        elif path == "/metrics":
+            self.send_json(200, self.server.metrics_snapshot())
+        else:
+            self.send_json(404, {"status": False, "error": f"未知接口: {path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        start = time()
+        status = 500
+        self.body_read = False
+        try:
+            if url.path not in ENDPOINTS:
+                raise APIError(f"未知接口: {url.path}", 404)
+            fields = Fields(self.read_fields())
+            future = self.server.pool.submit(ENDPOINTS[url.path](fields))
+            try:
+                output = future.result(timeout=self.server.request_timeout)
+            except TimeoutError:
+                future.cancel()
+                raise APIError("处理超时", 504)
+
+            images = {k: v for k, v in output.items() if isinstance(v, np.ndarray)}
+            if parse_qs(url.query).get("format") == ["png"]:
+                _, buffer = cv2.imencode(".png", next(iter(images.values())))
+                status = 200
+                self.send_bytes(status, buffer.tobytes(), "image/png")
+            else:
+                from hivision.utils import numpy_2_base64
+
+                output.update({k: numpy_2_base64(v) for k, v in images.items()})
+                status = 200
+                self.send_json(status, {"status": True, **output})
+        except APIError as e:
+            status = e.status_code
+            self.send_json(status, {"status": False, "error": str(e)})
+        except FaceError as e:
+            status = 422
+            self.send_json(status, {"status": False, "error": str(e), "face_num": e.face_num})
+        except Exception as e:
+            self.log_error("%s failed: %r", url.path, e)
+            self.send_json(status, {"status": False, "error": f"{type(e).__name__}: {e}"})
+        finally:
+            endpoint = url.path if url.path in ENDPOINTS else "other"
+            self.server.metrics.record(endpoint, status, time() - start)
+
+    def read_fields(self) -> dict:
+        length = self.content_length()
+        if length is None:
+            raise APIError("Content-Length 无效", 400)
+        if length == 0:
+            raise APIError("请求体为空", 400)
+        if length > self.server.max_body:
+            raise APIError("请求体过大", 413)
+        body = self.rfile.read(length)
+        self.body_read = True
+
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/form-data"):
+            message = BytesParser(policy=HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + body
+            )
+            fields = {}
+            for part in message.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                payload = part.get_payload(decode=True)
+                fields[name] = payload if part.get_filename() or name == "image" else payload.decode()
+            return fields
+        try:
+            fields = json.loads(body)
+        except ValueError:
+            raise APIError("请求体不是有效的 JSON", 400)
+        if not isinstance(fields, dict):
+            raise APIError("请求体必须是 JSON 对象", 400)
+        return fields
+
+    def send_json(self, status: int, data: dict):
+        self.send_bytes(status, json.dumps(data, ensure_ascii=False).encode(), "application/json; charset=utf-8")
+
+    def content_length(self) -> Optional[int]:
+        """
+        请求头中的 Content-Length，没有时为 0，不是非负整数时为 None
+        """
+        value = (self.headers.get("Content-Length") or "0").strip()
+        return int(value) if value.isdigit() else None
+
+    def discard_body(self):
+        """
+        丢弃未读取的请求体，使 keep-alive 连接上的下一个请求从正确的位置开始；
+        请求体过大或长度无效时不再读取，回复后关闭连接
+        """
+        self.body_read = True
+        length = self.content_length()
+        if length is not None and length <= self.server.max_body:
+            self.rfile.read(length)
+        else:
+            self.close_connection = True
+
+    def send_bytes(self, status: int, body: bytes, content_type: str):
+        if not self.body_read:
+            self.discard_body()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class IDPhotoServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        workers: int = 2,
+        queue_size: int = 8,
+        matting_model: str = "hivision_modnet",
+        face_model: str = "mtcnn",
+        timeout: float = 60,
+        max_body: int = 20 * 1024**2,
+        verbose: bool = False,
+    ):
+        """
+        :param address: 监听地址 (host, port)，port 为 0 时自动选择空闲端口
+        :param workers: 工作线程数
+        :param queue_size: 等待队列长度，队列满时返回 429
+        :param timeout: 单个请求的最长等待时间（秒），超时返回 504
+        :param max_body: 请求体大小上限（字节）
+        """
+        super().__init__(address, RequestHandler)
+        self.pool = WorkerPool(workers, queue_size, matting_model, face_model)
+        self.metrics = Metrics()
+        self.request_timeout = timeout
+        self.max_body = max_body
+        self.verbose = verbose
+
+    def health(self) -> dict:
+        from hivision.creator.session_registry import REGISTRY
+
+        return {
+            "status": "ok",
+            "workers": len(self.pool.threads),
+            "running": self.pool.running,
+            "queued": self.pool.queued,
+            "queue_size": self.pool.jobs.maxsize,
+            "matting_model": self.pool.matting_model,
+            "face_model": self.pool.face_model,
+            "models": [os.path.basename(key) for key in REGISTRY.loaded()],
+        }
+
+    def metrics_snapshot(self) -> dict:
+        from hivision.creator.matting_cache import MATTING_CACHE
+        from hivision.creator.matting_scheduler import SCHEDULER
+        from hivision.creator.session_registry import REGISTRY
+
+        return {
+            **self.metrics.snapshot(),
+            "running": self.pool.running,
+            "queued": self.pool.queued,
+            "model_memory_mb": round(REGISTRY.memory_usage() / 1024**2, 1),
+            "matting_batching": SCHEDULER.stats(),
+            "matting_cache": MATTING_CACHE.stats(),
+        }
+
+    def server_close(self):
+        super().server_close()
+        self.pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="证件照本地 HTTP 服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址，局域网访问使用 0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080, help="监听端口")
+    parser.add_argument("--workers", type=int, default=2, help="工作线程数")
+    parser.add_argument("--queue-size", type=int, default=8, help="等待队列长度，队列满时返回 429")
+    parser.add_argument("--timeout", type=float, default=60, help="单个请求的最长等待时间（秒）")
+    parser.add_argument("--max-body", type=float, default=20, help="请求体大小上限（MB）")
+    parser.add_argument("--matting-model", default="hivision_modnet", help="抠图模型")
+    parser.add_argument("--face-model", default="mtcnn", help="人脸检测模型")
+    parser.add_argument(
+        "--threads", type=int, default=0, help="每个工作线程的推理线程数，默认 CPU 核数 / 工作线程数"
+    )
+    parser.add_argument(
+        "--batch-wait", type=float, default=0, help="抠图请求等待合并推理的最长时间（毫秒），0 表示不合并"
+    )
+    parser.add_argument("--max-batch", type=int, default=0, help="合并推理的最大图像数，默认等于工作线程数")
+    parser.add_argument("--verbose", action="store_true", help="输出每个请求的访问日志")
+    args = parser.parse_args()
+
+    from hivision.creator.matting_scheduler import SCHEDULER
+    from hivision.creator.onnx_session import set_session_profile
+    from hivision.creator.session_registry import REGISTRY
+    from hivision.creator.warmup import warmup
+
+    workers = max(1, args.workers)
+    SCHEDULER.configure(max_batch=args.max_batch or workers, max_wait=args.batch_wait / 1000)
+    # 合并推理时同一模型的推理串行执行，每次推理使用全部 CPU 核
+    threads = 1 if SCHEDULER.enabled else workers
+    set_session_profile(
+        intra_op_num_threads=args.threads or max(1, (os.cpu_count() or 1) // threads),
+        inter_op_num_threads=1,
+    )
+    # 服务模式下模型常驻，不因空闲释放
+    REGISTRY.idle_timeout = 0
+    warmup(args.matting_model, args.face_model)
+
+    server = IDPhotoServer(
+        (args.host, args.port),
+        workers=workers,
+        queue_size=max(1, args.queue_size),
+        matting_model=args.matting_model,
+        face_model=args.face_model,
+        timeout=args.timeout,
+        max_body=int(args.max_body * 1024**2),
+        verbose=args.verbose,
+    )
+    host, port = server.server_address[:2]
+    print(f"[Server]  http://{host}:{port}  {workers} workers, queue {args.queue_size}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,11 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from PIL import Image
 import io
 import numpy as np
 import cv2
 import base64
-from hivision.plugin.watermark import Watermarker, WatermarkerStyles
+
+# PIL 只在图像编码相关的函数中使用，在函数内导入，避免 import hivision 时加载
 
 
 def save_image_dpi_to_bytes(image: np.ndarray, output_image_path: str = None, dpi: int = 300):
@@ -16,6 +16,8 @@ def save_image_dpi_to_bytes(image: np.ndarray, output_image_path: str = None, dp
     :param output_image_path: Path to save the resized image. 保存调整大小后的图像的路径。
     :param dpi: int, 要设置的DPI值，默认为300
     """
+    from PIL import Image
+
     image = Image.fromarray(image)
     # 创建一个字节流对象
     byte_stream = io.BytesIO()
@@ -44,6 +46,7 @@ def resize_image_to_kb(input_image: np.ndarray, output_image_path: str = None, t
     Example:
     resize_image_to_kb('input_image.jpg', 'output_image.jpg', 50)
     """
+    from PIL import Image
 
     if isinstance(input_image, np.ndarray):
         img = Image.fromarray(input_image)
@@ -105,6 +108,7 @@ def resize_image_to_kb_base64(input_image, target_size_kb, mode="exact"):
 
     :return: Base64 encoded string of the resized image. 调整大小后的图像的base64编码字符串。
     """
+    from PIL import Image
 
     if isinstance(input_image, np.ndarray):
         img = Image.fromarray(input_image)
@@ -197,6 +201,8 @@ def bytes_2_base64(img_byte_arr: bytes) -> str:
 
 
 def save_numpy_image(numpy_img, file_path):
+    from PIL import Image
+
     # 检查数组的形状
     if numpy_img.shape[2] == 4:
         # 将 BGR 转换为 RGB，并保留透明通道
@@ -213,6 +219,8 @@ def save_numpy_image(numpy_img, file_path):
 
 
 def numpy_to_bytes(numpy_img):
+    from PIL import Image
+
     img = Image.fromarray(numpy_img)
     img_byte_arr = io.BytesIO()
     img.save(img_byte_arr, format="PNG")
@@ -283,38 +291,58 @@ def generate_gradient(start_color, width, height, mode="updown"):
     return r_out, g_out, b_out
 
 
+def composite(foreground, background, out=None, premultiplied=False):
+    """
+    alpha 合成内核，所有换底路径共用：out = 前景 * a + 背景 * (1 - a)。
+    全程在 uint8 定点下计算（cv2.multiply 的 scale=1/255 在内部做定点乘法并四舍五入），
+    只需要两个 uint8 的三通道临时数组，不再拆分通道或生成 float64 中间结果
+    :param foreground: numpy.array(4 channels, uint8), 透明图像
+    :param background: numpy.array(3 channels, uint8) 与前景同尺寸的背景图，或 (b, g, r) 纯色
+    :param out: 预分配的输出 numpy.array(3 channels, uint8)，可以就是 background，此时原地合成；None 表示新建
+    :param premultiplied: 前景的 BGR 是否已经乘过 alpha
+    :return: out，合成好的 uint8 图像
+    """
+    if foreground.ndim != 3 or foreground.shape[2] != 4:
+        raise ValueError(
+            "The input image must have 4 channels. 输入图像必须有4个通道，即透明图像。"
+        )
+    foreground = foreground.astype(np.uint8, copy=False)
+
+    color = cv2.cvtColor(foreground, cv2.COLOR_BGRA2BGR)
+    weight = cv2.cvtColor(cv2.extractChannel(foreground, 3), cv2.COLOR_GRAY2BGR)
+    if not premultiplied:
+        cv2.multiply(color, weight, dst=color, scale=1 / 255)
+    cv2.bitwise_not(weight, dst=weight)  # 255 - a
+    if isinstance(background, np.ndarray):
+        cv2.multiply(background.astype(np.uint8, copy=False), weight, dst=weight, scale=1 / 255)
+    else:
+        cv2.multiply(weight, tuple(background) + (0,), dst=weight, scale=1 / 255)
+    if out is None:
+        out = np.empty_like(color)
+    return cv2.add(color, weight, dst=out)
+
+
 def add_background(input_image, bgr=(0, 0, 0), mode="pure_color"):
     """
     本函数的功能为为透明图像加上背景。
     :param input_image: numpy.array(4 channels), 透明图像
     :param bgr: tuple, 合成纯色底时的 BGR 值
-    :param new_background: numpy.array(3 channels)，合成自定义图像底时的背景图
-    :return: output: 合成好的输出图像
+    :param mode: 背景渲染方式：pure_color 纯色，updown_gradient 上下渐变，其他为中心渐变
+    :return: output: 合成好的输出图像（uint8）
     """
     height, width = input_image.shape[0], input_image.shape[1]
-    try:
-        b, g, r, a = cv2.split(input_image)
-    except ValueError:
-        raise ValueError(
-            "The input image must have 4 channels. 输入图像必须有4个通道，即透明图像。"
-        )
-
-    a_cal = a / 255
     if mode == "pure_color":
-        # 纯色填充
-        b2 = np.full([height, width], bgr[0], dtype=int)
-        g2 = np.full([height, width], bgr[1], dtype=int)
-        r2 = np.full([height, width], bgr[2], dtype=int)
+        # 纯色填充，不生成背景图
+        return composite(input_image, bgr)
     elif mode == "updown_gradient":
         b2, g2, r2 = generate_gradient(bgr, width, height, mode="updown")
     else:
         b2, g2, r2 = generate_gradient(bgr, width, height, mode="center")
 
-    output = cv2.merge(
-        ((b - b2) * a_cal + b2, (g - g2) * a_cal + g2, (r - r2) * a_cal + r2)
-    )
+    # 直接合成到背景图中
+    background = cv2.merge([channel.astype(np.uint8) for channel in (b2, g2, r2)])
+    return composite(input_image, background, out=background)
 
-    return output
 
 def add_background_with_image(input_image: np.ndarray, background_image: np.ndarray) -> np.ndarray:
     """
@@ -324,32 +352,20 @@ def add_background_with_image(input_image: np.ndarray, background_image: np.ndar
     :return: output: 合成好的输出图像
     """
     height, width = input_image.shape[:2]
-    try:
-        b, g, r, a = cv2.split(input_image)
-    except ValueError:
-        raise ValueError(
-            "The input image must have 4 channels. 输入图像必须有4个通道，即透明图像。"
-        )
 
     # 确保背景图像与输入图像大小一致
     background_image = cv2.resize(background_image, (width, height), cv2.INTER_AREA)
     background_image = cv2.cvtColor(background_image, cv2.COLOR_BGR2RGB)
-    b2, g2, r2 = cv2.split(background_image)
 
-    a_cal = a / 255.0
+    return composite(input_image, background_image, out=background_image)
 
-    # 修正混合公式
-    output = cv2.merge(
-        (b * a_cal + b2 * (1 - a_cal),
-         g * a_cal + g2 * (1 - a_cal),
-         r * a_cal + r2 * (1 - a_cal))
-    )
-
-    return output.astype(np.uint8)
 
 def add_watermark(
     image, text, size=50, opacity=0.5, angle=45, color="#8B8B1B", space=75
 ):
+    from PIL import Image
+    from hivision.plugin.watermark import Watermarker, WatermarkerStyles
+
     image = Image.fromarray(image)
     watermarker = Watermarker(
         input_image=image,
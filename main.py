@@ -65,9 +65,8 @@ class IDPhotoProcessor:
             ttk.Button(
                 button_row,
                 text="换背景",
-                command=lambda: (
-                    self.image_processor.process_background(),
-                    self.params_manager.layout_params.update_photos()
+                command=lambda: self.image_processor.process_background(
+                    on_done=self.params_manager.layout_params.update_photos
                 ),
                 style='Primary.TButton'
             ).pack(side=tk.LEFT, expand=True, padx=2)
@@ -95,6 +94,29 @@ class IDPhotoProcessor:
                 style='Primary.TButton'
             ).pack(fill=tk.X, pady=(0, 5))
             
+            # 状态提示（抠图、排版、模型预热等后台任务的进度）
+            status_row = ttk.Frame(bottom_frame)
+            status_row.pack(fill=tk.X)
+            
+            ttk.Label(
+                status_row,
+                textvariable=self.status_var,
+                foreground='#666666'
+            ).pack(side=tk.LEFT, fill=tk.X, expand=True)
+            
+            # 取消按钮，仅在后台任务执行时显示
+            self.cancel_button = ttk.Button(
+                status_row,
+                text="取消",
+                command=lambda: self.image_processor.cancel(),
+                width=6
+            )
+            self.window.bind('<Escape>', lambda e: self.image_processor.cancel())
+            
+            # 窗口显示后在后台预热模型（设置 HIVISION_WARMUP=1 开启）
+            if os.getenv('HIVISION_WARMUP', '0') == '1':
+                self.window.after(500, self.image_processor.start_warmup)
+            
         except Exception as e:
             import traceback
             print(f"初始化失败: {str(e)}")
@@ -152,6 +174,7 @@ class IDPhotoProcessor:
         self.align_var = tk.BooleanVar(value=False)  # 人脸矫正
         self.hd_var = tk.BooleanVar(value=True)     # 高清输出默认为True
         self.show_gridlines_var = tk.BooleanVar(value=True)  # 显示参考线
+        self.status_var = tk.StringVar(value="")  # 状态提示
         
     def run(self):
         """运行程序"""
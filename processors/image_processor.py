@@ -4,17 +4,44 @@ import cv2
 import numpy as np
 from PIL import Image
 from hivision import IDCreator, IDParams
+from hivision.utils import composite
 from hivision.creator.choose_handler import choose_handler, HUMAN_MATTING_MODELS, FACE_DETECT_MODELS
 from hivision.error import FaceError, APIError
 from utils.image_utils import compress_image
 import json
 import os
-from utils.layout_preview import LayoutPreviewGenerator
+import queue
+import threading
+from hivision.creator.layout_preview import LayoutPreviewGenerator
+from processors.task_runner import TaskRunner
+
+# IDCreator 各处理阶段在状态栏中的名称
+STAGE_LABELS = {
+    "matting": "人像抠图",
+    "beauty": "美颜",
+    "detection": "人脸检测",
+    "alignment": "人脸矫正",
+    "adjust": "裁剪调整",
+}
 
 class ImageProcessor:
     def __init__(self, app):
         self.app = app
+        # 该 IDCreator 只在后台任务线程中使用
         self.creator = IDCreator()
+        # 增量模式：只修改尺寸、面部比例、美颜等参数重新生成时，只重新执行受影响的处理阶段；
+        # 会在内存中保留上一张照片各阶段的结果，默认关闭，设置 HIVISION_INCREMENTAL=1 开启
+        self.creator.incremental = os.getenv('HIVISION_INCREMENTAL') == '1'
+        # 并行模式：人脸检测与抠图同时执行，多核电脑上缩短单张照片的处理时间，
+        # 但两个模型会争用 CPU 线程，默认关闭，设置 HIVISION_PARALLEL=1 开启
+        self.creator.parallel = os.getenv('HIVISION_PARALLEL') == '1'
+        
+        # 抠图、排版等耗时操作在后台线程中执行，避免界面卡住
+        self.runner = TaskRunner(
+            app.window,
+            on_progress=lambda message: self.app.status_var.set(message),
+            on_busy=self.set_busy
+        )
         
         # 检查环境变量
         api_key = os.getenv('FACE_PLUS_API_KEY')
@@ -38,6 +65,65 @@ class ImageProcessor:
             except Exception as e:
                 print(f"读取 API 配置失败: {str(e)}")
         
+    def set_busy(self, busy):
+        """后台任务开始或结束时更新光标和取消按钮"""
+        self.app.window.configure(cursor='watch' if busy else '')
+        if hasattr(self.app, 'cancel_button'):
+            if busy:
+                self.app.cancel_button.pack(side=tk.RIGHT)
+            else:
+                self.app.cancel_button.pack_forget()
+        
+    def show_status(self, message, timeout=3000):
+        """在状态栏显示消息，timeout 毫秒后若未被其他消息覆盖则清除"""
+        self.app.status_var.set(message)
+        if timeout:
+            self.app.window.after(
+                timeout,
+                lambda: self.app.status_var.get() == message and self.app.status_var.set("")
+            )
+        
+    def cancel(self):
+        """取消正在执行的后台任务"""
+        self.runner.cancel()
+        
+    def start_warmup(self):
+        """在后台线程中预热当前选择的抠图和人脸检测模型，进度显示在状态栏"""
+        from hivision.creator.warmup import warmup
+        
+        matting_model = self.app.params_manager.matting_params.get_matting_model()
+        face_model = self.app.params_manager.matting_params.get_face_model()
+        messages = queue.Queue()
+        
+        def progress(index, total, model_name):
+            messages.put(f"模型预热中 ({index}/{total})：{model_name}")
+        
+        def run():
+            results = warmup(matting_model, face_model, progress)
+            failed = [name for name, _, error in results if error is not None]
+            if failed:
+                messages.put(f"模型预热失败：{', '.join(failed)}")
+            else:
+                messages.put("模型预热完成")
+            messages.put(None)
+        
+        def poll():
+            # Tk 控件只能在主线程中更新，这里定时取出后台线程的进度消息
+            try:
+                while True:
+                    message = messages.get_nowait()
+                    if message is None:
+                        self.app.window.after(3000, lambda: self.app.status_var.set(""))
+                        return
+                    self.app.status_var.set(message)
+            except queue.Empty:
+                pass
+            self.app.window.after(100, poll)
+        
+        self.app.status_var.set("模型预热中...")
+        threading.Thread(target=run, name="hivision-warmup", daemon=True).start()
+        poll()
+        
     def upload_image(self):
         """上传图片"""
         # 打开文件选择对话框
@@ -147,8 +233,11 @@ class ImageProcessor:
         if hasattr(self.app, 'transparent_image'):
             self.process_matting()
 
-    def process_matting(self):
-        """抠图处理"""
+    def process_matting(self, on_done=None):
+        """抠图处理，在后台线程中执行
+        Args:
+            on_done: 抠图成功后在主线程中调用的回调
+        """
         try:
             if not hasattr(self.app, 'current_image'):
                 self.upload_image()
@@ -179,21 +268,7 @@ class ImageProcessor:
                     )
                     face_model = "retinaface-resnet50"
             
-            # 设置抠图和人脸检测模型
-            try:
-                choose_handler(
-                    self.creator,
-                    self.app.params_manager.matting_params.get_matting_model(),
-                    face_model
-                )
-            except APIError as e:
-                print(f"Face++ API 错误: {str(e)}")
-                # 如果 Face++ 失败，切换到备用模型
-                choose_handler(
-                    self.creator,
-                    self.app.params_manager.matting_params.get_matting_model(),
-                    "retinaface-resnet50"  # 使用备用人脸检测模型
-                )
+            matting_model = self.app.params_manager.matting_params.get_matting_model()
             
             # 获取参数
             top_value = float(self.app.top_value.get())
@@ -208,9 +283,8 @@ class ImageProcessor:
             width = int(photo_size[0] * dpi / 25.4)  # 将毫米转换为像素
             height = int(photo_size[1] * dpi / 25.4)
             
-            # 直接执行抠图，不使用 IDParams
-            result = self.creator(
-                image,
+            # Tk 变量只能在主线程读取，提交任务前取出所有参数
+            params = dict(
                 head_measure_ratio=ratio_value,
                 head_top_range=(top_value, 0.1),
                 face_alignment=self.app.align_var.get(),
@@ -218,9 +292,34 @@ class ImageProcessor:
                 contrast_strength=self.app.contrast_var.get(),
                 sharpen_strength=self.app.sharpen_var.get(),
                 saturation_strength=self.app.saturation_var.get(),
-                size=(height, width)
+                size=(height, width),
+                # 不输出高清照时，按标准照尺寸选择够用的抠图分辨率
+                matting_resolution=None if self.app.hd_var.get() else "auto",
             )
+        except Exception as e:
+            messagebox.showerror("错误", f"抠图失败: {str(e)}")
+            return
+        
+        creator = self.creator
+        
+        def run(task):
+            def before_stage(stage, ctx):
+                # 在阶段之间检查是否已取消，并在状态栏显示当前阶段
+                task.check()
+                task.progress(f"抠图中：{STAGE_LABELS.get(stage, stage)}...")
             
+            # 任务依次在同一个后台线程中执行，在这里设置处理器不会影响正在执行的任务
+            try:
+                choose_handler(creator, matting_model, face_model)
+            except APIError as e:
+                print(f"Face++ API 错误: {str(e)}")
+                # 如果 Face++ 失败，切换到备用模型
+                choose_handler(creator, matting_model, "retinaface-resnet50")
+            creator.before_stage = before_stage
+            # 直接执行抠图，不使用 IDParams
+            return creator(image, **params)
+        
+        def done(result):
             # 保存结果 - 保持BGRA格式
             self.app.transparent_image = result.standard
             if self.app.hd_var.get():
@@ -244,9 +343,16 @@ class ImageProcessor:
             # 更新菜单状态
             self.app.menu_manager.update_menu_state()
             
-        except Exception as e:
+            self.show_status("抠图完成")
+            on_done and on_done()
+        
+        def failed(e):
+            self.show_status("抠图失败")
             messagebox.showerror("错误", f"抠图失败: {str(e)}")
         
+        self.app.status_var.set("抠图中...")
+        self.runner.submit("抠图", run, on_done=done, on_error=failed)
+        
     def hex_to_bgr(self, hex_color):
         """将HEX颜色转换为BGR元组"""
         hex_color = hex_color.lstrip('#')
@@ -255,13 +361,18 @@ class ImageProcessor:
         r = int(hex_color[4:6], 16)  # 红色分量
         return (b, g, r)  # 直接返回 BGR 顺序
 
-    def process_background(self):
-        """换背景处理"""
+    def process_background(self, on_done=None):
+        """换背景处理
+        Args:
+            on_done: 换背景成功后调用的回调
+        """
         try:
             if not hasattr(self.app, 'transparent_image'):
-                self.process_matting()
-                if not hasattr(self.app, 'transparent_image'):
-                    return
+                # 先在后台抠图，抠图完成后再换背景
+                self.process_matting(
+                    on_done=lambda: self.process_background(on_done)
+                )
+                return
             
             # 切换到换背景参数标签页
             self.app.params_notebook.select(1)
@@ -328,6 +439,9 @@ class ImageProcessor:
             
         except Exception as e:
             messagebox.showerror("错误", f"换背景失败: {str(e)}")
+            return
+        
+        on_done and on_done()
 
     def create_vertical_gradient(self, width, height, start_hex, end_hex):
         """创建上下渐变背景"""
@@ -385,24 +499,14 @@ class ImageProcessor:
         return background
 
     def merge_with_background(self, foreground, background):
-        """合并前景和背景"""
-        # 分离前景的BGR和Alpha通道
-        b, g, r, a = cv2.split(foreground)
-        foreground_bgr = cv2.merge([b, g, r])
-        
-        # 归一化Alpha通道
-        alpha = a.astype(float) / 255
-        
-        # 扩展维度以便广播
-        alpha = np.expand_dims(alpha, axis=-1)
-        
-        # 合并图像
-        result = (foreground_bgr * alpha + background * (1 - alpha)).astype(np.uint8)
-        
-        return result
+        """合并前景和背景，结果直接写入 background"""
+        return composite(foreground, background, out=background)
 
-    def process_layout(self):
-        """排版处理"""
+    def process_layout(self, on_done=None):
+        """排版处理，排版图在后台线程中生成
+        Args:
+            on_done: 排版成功后在主线程中调用的回调
+        """
         try:
             # 检查是否有照片可以排版
             if not hasattr(self.app, 'processed_images'):
@@ -463,8 +567,14 @@ class ImageProcessor:
                         'image': self.app.processed_images[valid_photos[photo_mapping[i]]]
                     })
             
+        except Exception as e:
+            messagebox.showerror("错误", f"排版失败: {str(e)}")
+            return
+        
+        def run(task):
+            task.progress("排版中...")
             # 生成预览
-            canvas = LayoutPreviewGenerator.generate_preview(
+            return LayoutPreviewGenerator.generate_preview(
                 paper_size=paper_size,
                 orientation=style['orientation'],
                 margins=style['margins'],
@@ -474,7 +584,8 @@ class ImageProcessor:
                 show_divider=style['show_divider'],
                 images=True  # 表示需要绘制实际照片而不是占位符
             )
-            
+        
+        def done(canvas):
             # 保存结果
             self.app.layout_image = canvas
             
@@ -491,8 +602,14 @@ class ImageProcessor:
             # 更新菜单状态
             self.app.menu_manager.update_menu_state()
             
-        except Exception as e:
+            self.show_status("排版完成")
+            on_done and on_done()
+        
+        def failed(e):
+            self.show_status("排版失败")
             messagebox.showerror("错误", f"排版失败: {str(e)}")
+        
+        self.runner.submit("排版", run, on_done=done, on_error=failed)
 
     def draw_gridlines(self, canvas, params):
         """绘制参考线"""
@@ -602,23 +719,8 @@ class ImageProcessor:
             return "layout.jpg"
 
     def process_photo(self):
-        """一键制作证件照"""
-        try:
-            # 1. 抠图
-            self.process_matting()
-            if not hasattr(self.app, 'transparent_image'):
-                return
-            
-            # 2. 换背景
-            self.process_background()
-            if not hasattr(self.app, 'processed_image'):
-                return
-            
-            # 3. 排版
-            self.process_layout()
-            if not hasattr(self.app, 'layout_image'):
-                return
-            
+        """一键制作证件照：抠图、换背景、排版依次执行，前一步成功后再执行下一步"""
+        def finished():
             # 提示完成
             messagebox.showinfo(
                 "完成",
@@ -628,6 +730,18 @@ class ImageProcessor:
                 "- 换底片\n"
                 "- 排版照片"
             )
+        
+        def layout():
+            # 3. 排版
+            self.process_layout(on_done=finished)
+        
+        def background():
+            # 2. 换背景
+            self.process_background(on_done=layout)
+        
+        try:
+            # 1. 抠图
+            self.process_matting(on_done=background)
             
         except Exception as e:
             messagebox.showerror("错误", f"一键制作失败: {str(e)}")
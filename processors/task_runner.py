@@ -0,0 +1,124 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TaskCancelled(Exception):
+    """任务已被取消"""
+
+
+class Task:
+    """后台任务的句柄，在工作线程中用于报告进度和检查是否已取消"""
+
+    def __init__(self, name, messages):
+        self.name = name
+        self.cancelled = threading.Event()
+        self._messages = messages
+
+    def progress(self, message):
+        """报告进度，消息会在主线程中显示"""
+        self._messages.put((self, message))
+
+    def check(self):
+        """已取消时抛出 TaskCancelled，在阶段之间调用以尽早结束任务"""
+        if self.cancelled.is_set():
+            raise TaskCancelled(self.name)
+
+
+class TaskRunner:
+    """在工作线程中执行耗时任务，结果通过 window.after 回到 Tk 主线程
+
+    任务在同一个工作线程中依次执行；同名任务只保留最新提交的一个，
+    提交新任务时会取消同名的旧任务，被取消的任务在下一个阶段边界结束，其结果会被丢弃
+    """
+
+    def __init__(self, window, on_progress=None, on_busy=None, interval=50):
+        """
+        Args:
+            window: Tk 主窗口
+            on_progress: 进度回调 on_progress(message)，在主线程中调用
+            on_busy: 状态回调 on_busy(busy)，有任务开始或全部结束时在主线程中调用
+            interval: 轮询任务状态的间隔（毫秒）
+        """
+        self.window = window
+        self.on_progress = on_progress
+        self.on_busy = on_busy
+        self.interval = interval
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="idphoto-task")
+        self.messages = queue.Queue()
+        self.tasks = {}
+        self.polling = False
+
+    @property
+    def busy(self):
+        return bool(self.tasks)
+
+    def submit(self, name, fn, on_done=None, on_error=None):
+        """提交任务
+        Args:
+            name: 任务名称，同名的旧任务会被取消
+            fn: 在工作线程中执行的函数 fn(task)，返回值传给 on_done
+            on_done: 完成回调 on_done(result)，在主线程中调用
+            on_error: 异常回调 on_error(exception)，在主线程中调用
+        """
+        old = self.tasks.pop(name, None)
+        if old is not None:
+            old.cancelled.set()
+
+        task = Task(name, self.messages)
+        task.on_done = on_done
+        task.on_error = on_error
+        task.future = self.executor.submit(self._run, task, fn)
+        self.tasks[name] = task
+
+        self.on_busy and self.on_busy(True)
+        if not self.polling:
+            self.polling = True
+            self.window.after(self.interval, self._poll)
+        return task
+
+    def cancel(self):
+        """取消所有未完成的任务"""
+        if not self.tasks:
+            return
+        names = "、".join(self.tasks)
+        for task in self.tasks.values():
+            task.cancelled.set()
+        self.tasks.clear()
+        self.on_progress and self.on_progress(f"已取消：{names}")
+        self.on_busy and self.on_busy(False)
+
+    def _run(self, task, fn):
+        task.check()
+        return fn(task)
+
+    def _poll(self):
+        # 只显示未取消任务的进度，已取消任务的消息直接丢弃
+        try:
+            while True:
+                task, message = self.messages.get_nowait()
+                if self.tasks.get(task.name) is task:
+                    self.on_progress and self.on_progress(message)
+        except queue.Empty:
+            pass
+
+        for name, task in list(self.tasks.items()):
+            # 前一个任务的完成回调可能已提交同名新任务
+            if self.tasks.get(name) is not task or not task.future.done():
+                continue
+            del self.tasks[name]
+            if not self.tasks:
+                self.on_busy and self.on_busy(False)
+            try:
+                result = task.future.result()
+            except TaskCancelled:
+                pass
+            except Exception as e:
+                task.on_error and task.on_error(e)
+            else:
+                task.on_done and task.on_done(result)
+
+        if not self.tasks:
+            self.polling = False
+            return
+        self.window.after(self.interval, self._poll)
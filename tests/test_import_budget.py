@@ -0,0 +1,60 @@
+"""
+导入耗时预算：在新的解释器进程中导入 hivision 的各个入口模块，导入耗时不超过预算，
+且 onnxruntime、mtcnnruntime、requests、MNN、PIL 等重量级依赖没有在导入时被加载。
+numpy 和 cv2 是核心依赖，先导入它们，不计入预算
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BUDGET_MS = float(os.getenv("HIVISION_IMPORT_BUDGET_MS", 100))
+"""
+单个模块的导入耗时预算（毫秒），较慢的机器上可以通过环境变量放宽
+"""
+
+RUNS = 3
+"""
+每个模块的测量次数，取最小值，减少进程调度带来的波动
+"""
+
+HEAVY_MODULES = ["onnxruntime", "mtcnnruntime", "requests", "MNN", "PIL", "gradio"]
+"""
+只允许在第一次使用时导入的依赖
+"""
+
+PROBE = """
+import json, sys, time
+import numpy, cv2
+start = time.perf_counter()
+import {module}
+cost = (time.perf_counter() - start) * 1000
+print(json.dumps({{"ms": cost, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str) -> dict:
+    """
+    在新进程中导入模块，返回 {"ms": 导入耗时（毫秒）, "heavy": 被加载的重量级依赖}
+    """
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        check=True,
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize("module", ["hivision", "hivision.creator.choose_handler", "hivision.utils"])
+def test_import_budget(module):
+    results = [measure(module) for _ in range(RUNS)]
+    heavy = sorted({m for r in results for m in r["heavy"]})
+    assert not heavy, f"{module} imports {', '.join(heavy)} at import time"
+    cost = min(r["ms"] for r in results)
+    assert cost <= BUDGET_MS, f"{module} took {cost:.1f}ms to import (budget {BUDGET_MS:.0f}ms)"
@@ -0,0 +1,34 @@
+"""
+批量抠图与单张抠图使用相同的输入尺寸选择
+"""
+import numpy as np
+
+from hivision.creator.context import Context, Params
+from hivision.creator.human_matting import choose_ref_size, matting_batch
+from hivision.creator.matting_cache import MATTING_CACHE
+
+
+def test_batch_groups_by_ref_size(monkeypatch):
+    monkeypatch.setattr(MATTING_CACHE, "get", lambda key: None)
+    monkeypatch.setattr(MATTING_CACHE, "put", lambda key, alpha: None)
+    calls = []
+
+    def batch_fn(images, checkpoint_path, ref_size):
+        calls.append((len(images), ref_size))
+        return [np.dstack([image, np.full(image.shape[:2], ref_size // 4, np.uint8)]) for image in images]
+
+    targets = [None, 300, None, 400]
+    ctxs = []
+    for i, target in enumerate(targets):
+        ctx = Context(Params())
+        ctx.processing_image = np.full((64, 48, 3), i, np.uint8)
+        ctx.matting_target = target
+        ctxs.append(ctx)
+
+    matting_batch(ctxs, batch_fn, "hivision_modnet")
+
+    sizes = [choose_ref_size("hivision_modnet", target) for target in targets]
+    assert sorted(calls) == sorted((sizes.count(size), size) for size in set(sizes))
+    for ctx, size in zip(ctxs, sizes):
+        assert ctx.matting_ref_size == size
+        assert (ctx.matting_image[:, :, 3] == size // 4).all()
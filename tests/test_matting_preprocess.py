@@ -0,0 +1,55 @@
+"""
+抠图预处理与原有实现（PIL 缩放 + float64 归一化）的一致性
+"""
+import numpy as np
+import pytest
+from PIL import Image
+
+from hivision.creator.human_matting import (
+    BIREFNET_MEAN_STD,
+    PIL_BICUBIC,
+    PIL_BILINEAR,
+    RMBG_MEAN_STD,
+    image_to_tensor,
+)
+
+
+def baseline_rmbg(input_image, ref_size):
+    image = Image.fromarray(input_image).convert("RGB")
+    image = image.resize((ref_size, ref_size), Image.BILINEAR)
+    im_np = np.array(image).astype(np.float32)
+    im_np = im_np.transpose(2, 0, 1)
+    im_np = im_np / 255.0
+    im_np = (im_np - 0.5) / 0.5
+    return im_np
+
+
+def baseline_birefnet(input_image, ref_size):
+    image = Image.fromarray(input_image).resize((ref_size, ref_size))
+    image = np.array(image, dtype=np.float32) / 255.0
+    image = (image - [0.485, 0.456, 0.406]) / [0.229, 0.224, 0.225]
+    return np.transpose(image, (2, 0, 1)).astype(np.float32)
+
+
+@pytest.fixture
+def image():
+    rng = np.random.default_rng(0)
+    # 平滑的底图加噪声，缩放时各种插值的差异都能体现出来
+    base = np.linspace(0, 255, 300 * 220 * 3).reshape(300, 220, 3)
+    return np.clip(base + rng.normal(0, 40, base.shape), 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize("ref_size", [128, 512])
+def test_rmbg_matches_baseline(image, ref_size):
+    out = np.empty((3, ref_size, ref_size), np.float32)
+    image_to_tensor(image, (ref_size, ref_size), RMBG_MEAN_STD, out, resample=PIL_BILINEAR)
+    expected = baseline_rmbg(image, ref_size)
+    assert out.min() >= -1 and out.max() <= 1
+    np.testing.assert_allclose(out, expected, atol=1e-5)
+
+
+@pytest.mark.parametrize("ref_size", [128, 512])
+def test_birefnet_matches_baseline(image, ref_size):
+    out = np.empty((3, ref_size, ref_size), np.float32)
+    image_to_tensor(image, (ref_size, ref_size), BIREFNET_MEAN_STD, out, resample=PIL_BICUBIC)
+    np.testing.assert_allclose(out, baseline_birefnet(image, ref_size), atol=1e-5)
@@ -0,0 +1,77 @@
+"""
+HTTP/1.1 keep-alive 连接上出错的请求不能把未读的请求体留给下一个请求
+"""
+import json
+import socket
+import threading
+
+import pytest
+
+from hivision.server import IDPhotoServer
+
+
+@pytest.fixture
+def server():
+    server = IDPhotoServer(("127.0.0.1", 0), workers=1, max_body=1024)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def request(method, path, body=b"", headers=None):
+    lines = [f"{method} {path} HTTP/1.1", "Host: localhost", f"Content-Length: {len(body)}"]
+    lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode() + body
+
+
+def read_response(sock_file):
+    status = int(sock_file.readline().split()[1])
+    headers = {}
+    while True:
+        line = sock_file.readline().decode().strip()
+        if not line:
+            break
+        key, value = line.split(":", 1)
+        headers[key.lower()] = value.strip()
+    body = sock_file.read(int(headers["content-length"]))
+    return status, headers, json.loads(body)
+
+
+def test_unknown_path_body_is_drained(server):
+    # 第一个请求的请求体看起来像一个请求，未丢弃时会被当作第二个请求解析
+    body = request("GET", "/metrics")
+    with socket.create_connection(server.server_address, timeout=10) as sock:
+        sock.sendall(request("POST", "/unknown", body) + request("GET", "/health"))
+        sock_file = sock.makefile("rb")
+        status, headers, _ = read_response(sock_file)
+        assert status == 404
+        assert headers.get("connection") != "close"
+        status, _, data = read_response(sock_file)
+        assert status == 200
+        assert data["status"] == "ok"
+
+
+def test_oversized_body_closes_connection(server):
+    with socket.create_connection(server.server_address, timeout=10) as sock:
+        sock.sendall(request("POST", "/idphoto", b"x" * 2048) + request("GET", "/health"))
+        sock_file = sock.makefile("rb")
+        status, headers, _ = read_response(sock_file)
+        assert status == 413
+        assert headers["connection"] == "close"
+        # 服务端不再解析残留的请求体，直接关闭连接
+        assert sock_file.read() == b""
+
+
+@pytest.mark.parametrize("length", ["abc", "-5"])
+def test_invalid_content_length_is_rejected(server, length):
+    raw = f"POST /idphoto HTTP/1.1\r\nHost: localhost\r\nContent-Length: {length}\r\n\r\n".encode()
+    with socket.create_connection(server.server_address, timeout=10) as sock:
+        sock.sendall(raw + b"{}")
+        sock_file = sock.makefile("rb")
+        status, headers, data = read_response(sock_file)
+        assert status == 400
+        assert "Content-Length" in data["error"]
+        # 请求体长度未知，无法找到下一个请求的起点，只能关闭连接
+        assert headers["connection"] == "close"
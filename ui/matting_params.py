@@ -11,7 +11,10 @@ class MattingParams:
             "MODNet（抠图效果好，速度中等）": "modnet_photographic_portrait_matting",
             "birefnet-v1-lite（抠图效果好，速度慢）": "birefnet-v1-lite",
             "hivision_modnet（纯色换底好，速度快）": "hivision_modnet",
-            "rmbg-1.4（背景复杂换底好，速度快）": "rmbg-1.4"
+            "rmbg-1.4（背景复杂换底好，速度快）": "rmbg-1.4",
+            "hivision_modnet-int8（量化版，速度更快）": "hivision_modnet-int8",
+            "MODNet-int8（量化版，速度更快）": "modnet_photographic_portrait_matting-int8",
+            "rmbg-1.4-int8（量化版，速度更快）": "rmbg-1.4-int8"
         }
         
         self.face_model_map = {
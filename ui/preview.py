@@ -747,12 +747,13 @@ class PreviewManager:
 
     def change_background_and_select(self):
         """换背景并选择照片"""
-        # 执行换背景操作
-        self.app.image_processor.process_background()
+        def select_first():
+            # 如果换背景成功，自动选择第一张照片
+            if hasattr(self.app, 'processed_images') and self.app.processed_images[0] is not None:
+                self.select_photo(0)
         
-        # 如果换背景成功，自动选择第一张照片
-        if hasattr(self.app, 'processed_images') and self.app.processed_images[0] is not None:
-            self.select_photo(0)
+        # 执行换背景操作，需要先抠图时在抠图完成后再选择照片
+        self.app.image_processor.process_background(on_done=select_first)
 
     def setup_layout_button(self):
         """设置排版按钮"""